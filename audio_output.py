@@ -0,0 +1,256 @@
+"""
+Output formats, streaming encoders and output file naming.
+
+`AudioWriter` is fed one segment at a time as synthesis produces it and
+encodes straight to disk, so compressed formats never need the whole
+recording in memory. Formats are provided by libsndfile through soundfile;
+which ones are usable depends on the libsndfile build (Opus needs 1.0.31+,
+MP3 needs 1.1.0+), see `available_formats()`. Audio can be resampled from
+the model's 24 kHz on the fly with a stateful polyphase filter.
+"""
+
+import os
+import re
+import time
+from dataclasses import dataclass
+from math import gcd
+
+import settings
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    name: str
+    extension: str
+    container: str
+    subtype: str
+    lossless: bool
+    # Sample rates the codec accepts; None means any
+    rates: tuple | None = None
+
+
+FORMATS = {
+    fmt.name: fmt
+    for fmt in (
+        OutputFormat("wav", ".wav", "WAV", "PCM_16", True),
+        OutputFormat("flac", ".flac", "FLAC", "PCM_16", True),
+        OutputFormat(
+            "opus", ".opus", "OGG", "OPUS", False, rates=(8000, 12000, 16000, 24000, 48000)
+        ),
+        OutputFormat("mp3", ".mp3", "MP3", "MPEG_LAYER_III", False),
+    )
+}
+
+# Sample rates offered for resampling; 0 keeps the model's native rate
+OUTPUT_RATES = (0, 16000, 22050, 44100, 48000)
+
+
+def available_formats():
+    """Names of the formats the installed libsndfile can write."""
+    import soundfile
+
+    containers = soundfile.available_formats()
+    names = []
+    for fmt in FORMATS.values():
+        if fmt.container in containers and fmt.subtype in soundfile.available_subtypes(
+            fmt.container
+        ):
+            names.append(fmt.name)
+    return names
+
+
+def format_for_path(path):
+    """Returns the OutputFormat matching a file's extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for fmt in FORMATS.values():
+        if fmt.extension == extension:
+            return fmt
+    if extension == ".ogg":
+        return FORMATS["opus"]
+    raise ValueError(f"Unsupported output format: {extension or path}")
+
+
+class StreamingResampler:
+    """
+    Windowed-sinc polyphase resampler that works on consecutive chunks.
+
+    The tail of each chunk is kept as filter history, so the output is the
+    same as resampling the whole signal at once, without clicks at chunk
+    boundaries.
+    """
+
+    def __init__(self, in_rate, out_rate, half_taps=16, beta=8.6):
+        import numpy as np
+
+        divisor = gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.half_taps = half_taps
+        self._offsets = np.arange(-half_taps + 1, half_taps + 1)
+        # Low-pass at the lower of the two Nyquist frequencies.
+        cutoff = min(1.0, self.up / self.down)
+        distance = self._offsets[None, :] - (np.arange(self.up) / self.up)[:, None]
+        window = np.i0(beta * np.sqrt(np.clip(1 - (distance / half_taps) ** 2, 0, 1)))
+        self._table = (cutoff * np.sinc(cutoff * distance) * window / np.i0(beta)).astype(
+            np.float32
+        )
+        # History starts with zeros standing in for samples before the signal.
+        self._buffer = np.zeros(half_taps - 1, dtype=np.float32)
+        self._buffer_start = -(half_taps - 1)
+        self._next_output = 0
+        self._input_frames = 0
+
+    def _process(self, last_output):
+        import numpy as np
+
+        outputs = np.arange(self._next_output, last_output)
+        if not len(outputs):
+            return np.zeros(0, dtype=np.float32)
+        bases = outputs * self.down // self.up
+        phases = outputs * self.down % self.up
+        index = bases[:, None] + self._offsets[None, :] - self._buffer_start
+        samples = np.einsum("ij,ij->i", self._table[phases], self._buffer[index])
+        self._next_output = last_output
+        # Drop history no later output can reach.
+        keep_from = self._next_output * self.down // self.up - self.half_taps + 1
+        drop = max(0, keep_from - self._buffer_start)
+        self._buffer = self._buffer[drop:]
+        self._buffer_start += drop
+        return samples.astype(np.float32)
+
+    def process(self, chunk):
+        import numpy as np
+
+        self._buffer = np.concatenate([self._buffer, np.asarray(chunk, dtype=np.float32)])
+        self._input_frames += len(chunk)
+        last_input = self._buffer_start + len(self._buffer) - 1
+        # Outputs whose filter window lies entirely within the input so far.
+        reachable = last_input - self.half_taps + 1
+        last_output = max(
+            self._next_output, -(-reachable * self.up // self.down)
+        )
+        return self._process(last_output)
+
+    def flush(self):
+        """Returns the remaining output, padding the signal end with silence."""
+        import numpy as np
+
+        self._buffer = np.concatenate(
+            [self._buffer, np.zeros(self.half_taps, dtype=np.float32)]
+        )
+        total = -(-self._input_frames * self.up // self.down)
+        return self._process(max(self._next_output, total))
+
+
+class AudioWriter:
+    """
+    Streams mono float32 audio into a file of the given format and rate.
+
+    The format comes from the file extension unless given explicitly.
+    Use as a context manager, or call close() to finalize the file.
+    """
+
+    def __init__(self, path, fmt=None, samplerate=0):
+        import soundfile
+
+        self.path = path
+        self.format = FORMATS[fmt] if isinstance(fmt, str) else fmt or format_for_path(path)
+        self.samplerate = samplerate or settings.SAMPLE_RATE
+        if self.format.rates and self.samplerate not in self.format.rates:
+            raise ValueError(
+                f"{self.format.name} does not support {self.samplerate} Hz; "
+                f"use one of {', '.join(map(str, self.format.rates))}"
+            )
+        self._resampler = (
+            StreamingResampler(settings.SAMPLE_RATE, self.samplerate)
+            if self.samplerate != settings.SAMPLE_RATE
+            else None
+        )
+        self._file = soundfile.SoundFile(
+            path,
+            mode="w",
+            samplerate=self.samplerate,
+            channels=1,
+            format=self.format.container,
+            subtype=self.format.subtype,
+        )
+        self.frames = 0
+
+    @property
+    def native(self):
+        """True if the file holds the model's samples unchanged."""
+        return self.format.lossless and self._resampler is None
+
+    def write(self, samples):
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        if len(samples):
+            self._file.write(samples)
+            self.frames += len(samples)
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self._resampler is not None:
+                tail = self._resampler.flush()
+                if len(tail):
+                    self._file.write(tail)
+                    self.frames += len(tail)
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# --- Naming ----------------------------------------------------------------
+
+_UNSAFE_RE = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+def _slug(value, max_chars=20):
+    return _UNSAFE_RE.sub("_", value.strip())[:max_chars].strip("_") or "audio"
+
+
+def output_filename(template, extension, text="", voice="", language="", job_id=0, when=None):
+    """
+    Expands a naming template such as "{date}-{time}-{voice}".
+
+    Available fields: date, time, timestamp, voice, language, id and text
+    (the first characters of the text, made filename-safe).
+    """
+    when = time.localtime(when if when is not None else time.time())
+    name = template.format(
+        date=time.strftime("%Y%m%d", when),
+        time=time.strftime("%H%M%S", when),
+        timestamp=int(time.mktime(when)),
+        voice=_slug(voice),
+        language=language,
+        id=job_id,
+        text=_slug(text),
+    )
+    return _slug(name, max_chars=120) + extension
+
+
+def reserve_output_path(directory, filename):
+    """
+    Returns a path in `directory` that no other job will get.
+
+    A numeric suffix is added on collision, and the file is created
+    immediately so jobs named in the same second cannot race for it.
+    """
+    os.makedirs(directory or ".", exist_ok=True)
+    stem, extension = os.path.splitext(filename)
+    counter = 0
+    while True:
+        candidate = f"{stem}-{counter}{extension}" if counter else filename
+        path = os.path.join(directory, candidate)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            counter += 1
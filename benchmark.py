@@ -0,0 +1,647 @@
+"""
+Headless performance benchmark.
+
+Usage:
+    python -m benchmark [-o results.json] [--compare baseline.json]
+
+Runs a fixed corpus of Chinese, English and mixed text through the engine
+and reports, as JSON:
+  * cold model load (fresh interpreter) and warm load (same process),
+    including the warm-up pass, and the latency of the first job after it,
+  * reloading after an idle unload, and the latency of that first job,
+  * KPipeline construction time per language,
+  * G2P time vs. model time per segment,
+  * wall time, time to first audio and real-time factor per corpus entry,
+  * peak resident memory, and memory private to the process (Linux).
+
+The result cache is always bypassed. With `--compare`, every timing is
+checked against a previous result file and the exit code is 1 when one
+regressed by more than `--tolerance`, which makes the command usable as a
+CI gate on CPU-only runners.
+
+`--precision-compare` instead runs the corpus with fp32 and with int8
+dynamically quantized weights, and `--backend-compare` with the torch and
+the ONNX Runtime backend. Both report load time, memory and speed of each
+variant and how far its audio drifts from the first one; the backend
+comparison fails (exit code 1) when the ONNX output does not match.
+"""
+
+import argparse
+import contextlib
+import functools
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import settings
+from metrics import METRICS, utilization
+
+# Fixed corpus: (name, language, text). Keep it stable so results stay
+# comparable between releases.
+BENCHMARK_CORPUS = [
+    ("zh_short", "zh-cn", "今天天气很好。"),
+    (
+        "zh_medium",
+        "zh-cn",
+        "语音合成技术把文字转换成自然流畅的语音。它被广泛用于有声读物、导航和无障碍阅读。"
+        "一个好的合成系统不仅要发音准确，还要在停顿和语调上接近真人。",
+    ),
+    (
+        "zh_long",
+        "zh-cn",
+        "清晨，小镇还笼罩在薄雾之中。面包店的灯最先亮起，烤箱里飘出麦香。"
+        "街角的邮递员骑着自行车，把一封封信送到各家门口。学校的铃声响起，孩子们背着书包跑进校园。"
+        "中午时分，阳光穿过云层，照在河面上，泛起点点金光。老人们坐在树下下棋，谈论着今年的收成。"
+        "傍晚，晚霞染红了半边天，炊烟从屋顶升起。夜里，小镇渐渐安静下来，只剩下几声虫鸣。\n"
+        "第二天，一切又重新开始。",
+    ),
+    ("en_short", "en", "The quick brown fox jumps over the lazy dog."),
+    (
+        "en_medium",
+        "en",
+        "Speech synthesis turns written text into natural sounding audio. "
+        "It powers audiobooks, navigation systems and screen readers. "
+        "A good system pronounces words correctly and sounds human in its pauses and intonation.",
+    ),
+    (
+        "mixed",
+        "zh-cn",
+        "我们使用 Python 和 PyTorch 开发了这个 GTK 应用。"
+        "请把 README 里的 API key 换成你自己的，然后运行 benchmark 命令。"
+        "GitHub Actions 会在每次 release 之前检查 real-time factor。",
+    ),
+]
+
+# Metrics compared by --compare; all of them are better when lower.
+COMPARED_METRICS = ("elapsed_seconds", "time_to_first_audio", "rtf")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def private_memory_mb():
+    """
+    Memory used by this process alone in MiB, or None if unknown.
+
+    Unlike RSS, this leaves out file pages shared with other processes, such
+    as memory-mapped model weights.
+    """
+    try:
+        with open("/proc/self/smaps_rollup", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    kib = sum(int(fields[name].split()[0]) for name in ("Private_Clean", "Private_Dirty"))
+    return round(kib / 1024, 1)
+
+
+def uncached_engine(device, config):
+    """
+    A TTSEngine without the result cache or the persistent G2P memo, so
+    every run renders and phonemizes from scratch.
+    """
+    from tts_engine import TTSEngine
+
+    engine = TTSEngine(device=device, config=config)
+    engine.cache = None
+    # Before load(), which builds the pipelines around the memo.
+    engine.g2p_memo = engine.pipelines.g2p_memo = None
+    return engine
+
+
+def _cold_load_probe(device, config):
+    """Runs in a fresh interpreter: imports the backend and loads the model."""
+    start = time.perf_counter()
+    import tts_engine
+
+    tts_engine.import_backend()
+    imported = time.perf_counter()
+    engine = uncached_engine(device, config)
+    engine.load()
+    loaded = time.perf_counter()
+    warm_up = METRICS.spans.get("warm_up")
+    # The latency the first job of a fresh process sees, with or without
+    # the warm-up pass.
+    first_job = measure_first_job(engine)
+    print(
+        json.dumps(
+            {
+                "import_seconds": round(imported - start, 3),
+                "load_seconds": round(loaded - start, 3),
+                "warm_up_seconds": round(warm_up.last, 3) if warm_up else None,
+                "first_job_seconds": first_job,
+                "peak_rss_mb": peak_rss_mb(),
+                "private_mb": private_memory_mb(),
+            }
+        )
+    )
+
+
+def measure_first_job(engine, voice=None):
+    """Seconds to synthesize a short sentence, e.g. right after loading."""
+    voice = voice or (engine.voices.available() or settings.DEFAULT_VOICES)[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        engine.synthesize(
+            "这是第一个任务。", voice, os.path.join(tmp, "first.wav"), use_cache=False
+        )
+        return round(time.perf_counter() - start, 3)
+
+
+def measure_idle_reload(engine, voice):
+    """Unloads the model as the idle timeout would and times the next job."""
+    engine.unload()
+    first_job = measure_first_job(engine, voice)
+    return {
+        "reload_seconds": round(METRICS.spans["reload"].last, 3),
+        "first_job_seconds": first_job,
+    }
+
+
+def measure_cold_load(device, config):
+    """Loads the model in a new process so no import or model is cached."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmark",
+            "--cold-load-probe",
+            "--device",
+            device or "",
+            "--config-json",
+            json.dumps(config),
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # The probe prints load progress first; the JSON is the last line.
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_pipeline_build(engine):
+    """Times building fresh pipelines against the loaded model."""
+    from tts_engine import PipelineRegistry
+
+    registry = PipelineRegistry(engine.repo_id)
+    timings = {}
+    start = time.perf_counter()
+    registry.get("a")
+    timings["en_seconds"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    # The English pipeline already exists, so this is the Chinese one only.
+    registry.get("zh", engine.model if engine.backend == "torch" else None)
+    timings["zh_seconds"] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+def measure_stages(engine, text, voice, speed):
+    """
+    Splits the time of each segment into G2P and model inference.
+
+    Uses the same steps as the staged renderer: phonemize each segment into
+    model-sized chunks, then run the model on them with the voice pack.
+    """
+    import tts_engine
+
+    torch = tts_engine.torch
+    pack = engine.voices.get(voice).to(engine.model.device)
+    g2p_seconds = 0.0
+    model_seconds = 0.0
+    segments = tts_engine.split_segments(text, engine.config.get("segment_chars", 0))
+    with torch.inference_mode():
+        for segment in segments:
+            start = time.perf_counter()
+            phonemes = engine._phonemize(segment, speed, 0)
+            g2p_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            engine._infer(phonemes, pack, speed)
+            model_seconds += time.perf_counter() - start
+    return {
+        "g2p_seconds": round(g2p_seconds, 4),
+        "model_seconds": round(model_seconds, 4),
+        "g2p_seconds_per_segment": round(g2p_seconds / max(1, len(segments)), 4),
+        "model_seconds_per_segment": round(model_seconds / max(1, len(segments)), 4),
+    }
+
+
+def measure_synthesis(engine, name, language, text, voice, speed, repeat, output_dir):
+    """Synthesizes one corpus entry `repeat` times and keeps the fastest run."""
+    runs = []
+    for _ in range(repeat):
+        first_audio = []
+        start = time.perf_counter()
+
+        def on_audio(samples):
+            if not first_audio and len(samples):
+                first_audio.append(time.perf_counter() - start)
+
+        with METRICS.trace() as stages:
+            result = engine.synthesize(
+                text,
+                voice,
+                os.path.join(output_dir, f"{name}.wav"),
+                speed=speed,
+                language=language,
+                on_audio=on_audio,
+                use_cache=False,
+                samplerate=0,
+            )
+        elapsed = time.perf_counter() - start
+        runs.append((elapsed, first_audio[0] if first_audio else elapsed, result, stages))
+
+    elapsed, ttfa, result, stages = min(runs, key=lambda run: run[0])
+    audio_seconds = result.audio_seconds
+    entry = {
+        "name": name,
+        "language": language,
+        "chars": len(text),
+        "segments": result.segments,
+        "audio_seconds": round(audio_seconds, 3),
+        "elapsed_seconds": round(elapsed, 4),
+        "time_to_first_audio": round(ttfa, 4),
+        # Processing time per second of audio; lower is better.
+        "rtf": round(elapsed / audio_seconds, 4) if audio_seconds else None,
+        # Busy share of the wall time per stage; overlapping stages add up to >1
+        "utilization": utilization(stages, elapsed),
+    }
+    entry.update(measure_stages(engine, text, voice, speed))
+    return entry
+
+
+def environment(engine):
+    import tts_engine
+
+    try:
+        from importlib.metadata import version
+
+        kokoro_version = version("kokoro")
+    except Exception:
+        kokoro_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": tts_engine.torch.__version__,
+        "torch_threads": tts_engine.torch.get_num_threads(),
+        "kokoro": kokoro_version,
+        "device": str(engine.device),
+        "model_revision": engine.store.revision,
+        "config": engine.config,
+    }
+
+
+def run_benchmark(
+    device=None, config=None, voice="zf_001", repeat=1, cold=True, corpus=None
+):
+    config = dict(config or settings.CONFIG)
+    results = {"version": 1, "timestamp": time.time()}
+
+    load = {}
+    if cold:
+        cold_load = measure_cold_load(device, config)
+        load["cold_seconds"] = cold_load["load_seconds"]
+        load["cold_import_seconds"] = cold_load["import_seconds"]
+        load["cold_warm_up_seconds"] = cold_load["warm_up_seconds"]
+        load["cold_first_job_seconds"] = cold_load["first_job_seconds"]
+        load["cold_peak_rss_mb"] = cold_load["peak_rss_mb"]
+        load["cold_private_mb"] = cold_load["private_mb"]
+
+    start = time.perf_counter()
+    engine = uncached_engine(device, config)
+    engine.load()
+    load["first_in_process_seconds"] = round(time.perf_counter() - start, 3)
+    # Free the first model so peak RSS reflects a single loaded model.
+    del engine
+    gc.collect()
+
+    # Everything is imported and the weights are in the page cache now.
+    start = time.perf_counter()
+    engine = uncached_engine(device, config)
+    engine.load()
+    load["warm_seconds"] = round(time.perf_counter() - start, 3)
+    warm_up = METRICS.spans.get("warm_up")
+    load["warm_up_seconds"] = round(warm_up.last, 3) if warm_up else None
+    results["load"] = load
+    results["pipeline_build"] = measure_pipeline_build(engine)
+    results["environment"] = environment(engine)
+
+    entries = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, language, text in corpus or BENCHMARK_CORPUS:
+            print(f"Benchmarking {name}...", file=sys.stderr)
+            entries.append(
+                measure_synthesis(
+                    engine,
+                    name,
+                    language,
+                    text,
+                    voice,
+                    settings.DEFAULT_SPEED,
+                    repeat,
+                    output_dir,
+                )
+            )
+    results["corpus"] = entries
+    # Last, so the reload doesn't skew the corpus timings.
+    results["idle_reload"] = measure_idle_reload(engine, voice)
+
+    audio_seconds = sum(entry["audio_seconds"] for entry in entries)
+    elapsed = sum(entry["elapsed_seconds"] for entry in entries)
+    results["totals"] = {
+        "audio_seconds": round(audio_seconds, 3),
+        "elapsed_seconds": round(elapsed, 4),
+        "rtf": round(elapsed / audio_seconds, 4) if audio_seconds else None,
+        "g2p_seconds": round(sum(entry["g2p_seconds"] for entry in entries), 4),
+        "model_seconds": round(sum(entry["model_seconds"] for entry in entries), 4),
+    }
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def spectral_distance_db(reference, candidate, frame=1024):
+    """
+    Log-spectral distance in dB between the average spectra of two signals.
+
+    Averaging over time keeps the measure meaningful when quantization
+    shifts the predicted durations and the signals no longer line up.
+    """
+    import numpy as np
+
+    def spectrum(samples):
+        usable = len(samples) // frame * frame
+        frames = samples[:usable].reshape(-1, frame) * np.hanning(frame)
+        return np.abs(np.fft.rfft(frames, axis=1)).mean(axis=0) + 1e-8
+
+    if min(len(reference), len(candidate)) < frame:
+        return None
+    ratio = 20 * np.log10(spectrum(reference) / spectrum(candidate))
+    return round(float(np.sqrt(np.mean(ratio**2))), 3)
+
+
+# Variants run by --precision-compare and --backend-compare; the first one
+# is the reference the others are compared with.
+PRECISION_VARIANTS = (("fp32", {"quantize_int8": False}), ("int8", {"quantize_int8": True}))
+BACKEND_VARIANTS = (
+    ("torch", {"backend": "torch", "quantize_int8": False}),
+    ("onnx", {"backend": "onnx"}),
+)
+# Largest spectral distance at which two backends count as matching. Kokoro
+# adds random noise in its vocoder, so two torch runs differ slightly too.
+PARITY_MAX_DISTANCE_DB = 1.0
+# Allowed difference in audio length, for durations rounded the other way
+PARITY_MAX_DURATION_DRIFT = 0.01
+
+
+def compare_variants(variants, device=None, config=None, voice="zf_001", repeat=1, cold=True):
+    """Runs the corpus once per config variant and compares them."""
+    import soundfile
+
+    config = dict(config or settings.CONFIG)
+    results = {"version": 1, "timestamp": time.time(), "variants": {}}
+    audio = {}
+    for variant, overrides in variants:
+        variant_config = dict(config, **overrides)
+        entry = {}
+        if cold:
+            cold_load = measure_cold_load(device, variant_config)
+            entry["cold_load_seconds"] = cold_load["load_seconds"]
+            entry["cold_peak_rss_mb"] = cold_load["peak_rss_mb"]
+            entry["cold_private_mb"] = cold_load["private_mb"]
+        engine = uncached_engine(device, variant_config)
+        engine.load()
+        if variant_config.get("quantize_int8") and not engine.quantized:
+            raise SystemExit(f"int8 quantization is CPU only, not {engine.device}")
+        if engine.backend != variant_config.get("backend", engine.backend):
+            raise SystemExit(f"the {variant_config['backend']} backend is not available")
+
+        corpus = []
+        with tempfile.TemporaryDirectory() as output_dir:
+            for name, language, text in BENCHMARK_CORPUS:
+                print(f"Benchmarking {name} ({variant})...", file=sys.stderr)
+                corpus.append(
+                    measure_synthesis(
+                        engine,
+                        name,
+                        language,
+                        text,
+                        voice,
+                        settings.DEFAULT_SPEED,
+                        repeat,
+                        output_dir,
+                    )
+                )
+                audio[variant, name], _ = soundfile.read(
+                    os.path.join(output_dir, f"{name}.wav"), dtype="float32"
+                )
+        audio_seconds = sum(item["audio_seconds"] for item in corpus)
+        elapsed = sum(item["elapsed_seconds"] for item in corpus)
+        entry["corpus"] = corpus
+        entry["rtf"] = round(elapsed / audio_seconds, 4) if audio_seconds else None
+        results["variants"][variant] = entry
+        del engine
+        gc.collect()
+
+    reference = variants[0][0]
+    results["reference"] = reference
+    results["speedup"] = {}
+    results["quality"] = {}
+    for variant, _ in variants[1:]:
+        reference_rtf = results["variants"][reference]["rtf"]
+        rtf = results["variants"][variant]["rtf"]
+        if reference_rtf and rtf:
+            results["speedup"][variant] = round(reference_rtf / rtf, 3)
+        results["quality"][variant] = [
+            {
+                "name": name,
+                # Audio length relative to the reference; 1.0 = same durations
+                "duration_ratio": round(
+                    len(audio[variant, name]) / max(1, len(audio[reference, name])), 4
+                ),
+                "spectral_distance_db": spectral_distance_db(
+                    audio[reference, name], audio[variant, name]
+                ),
+            }
+            for name, _, _ in BENCHMARK_CORPUS
+        ]
+    return results
+
+
+def parity_failures(results):
+    """Corpus entries whose audio does not match the reference backend."""
+    return [
+        f"{variant}:{entry['name']}"
+        for variant, entries in results["quality"].items()
+        for entry in entries
+        if abs(entry["duration_ratio"] - 1.0) > PARITY_MAX_DURATION_DRIFT
+        or (entry["spectral_distance_db"] or 0.0) > PARITY_MAX_DISTANCE_DB
+    ]
+
+
+def _flatten(results):
+    """Maps metric paths such as "corpus.zh_long.rtf" to values."""
+    metrics = {}
+    for key in (
+        "cold_seconds",
+        "warm_seconds",
+        "cold_private_mb",
+        "cold_first_job_seconds",
+    ):
+        if results.get("load", {}).get(key) is not None:
+            metrics[f"load.{key}"] = results["load"][key]
+    for key, value in results.get("idle_reload", {}).items():
+        metrics[f"idle_reload.{key}"] = value
+    for key, value in results.get("pipeline_build", {}).items():
+        metrics[f"pipeline_build.{key}"] = value
+    for entry in results.get("corpus", []):
+        for key in COMPARED_METRICS:
+            if entry.get(key) is not None:
+                metrics[f"corpus.{entry['name']}.{key}"] = entry[key]
+    if results.get("totals", {}).get("rtf") is not None:
+        metrics["totals.rtf"] = results["totals"]["rtf"]
+    if results.get("peak_rss_mb") is not None:
+        metrics["peak_rss_mb"] = results["peak_rss_mb"]
+    return metrics
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each metric next to its baseline value.
+
+    Returns the names of the metrics that got worse by more than
+    `tolerance` (a fraction, 0.15 = 15%).
+    """
+    current = _flatten(results)
+    previous = _flatten(baseline)
+    regressions = []
+    for name in sorted(current.keys() & previous.keys()):
+        old, new = previous[name], current[name]
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:45s} {old:10.4f} -> {new:10.4f} ({change:+.1%}){flag}",
+            file=sys.stderr,
+        )
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="kokoro-bench", description="Benchmark model load and synthesis speed."
+    )
+    parser.add_argument("-o", "--output", default=None, help="write JSON results here")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.15,
+        help="allowed slowdown before --compare fails (fraction, default 0.15)",
+    )
+    parser.add_argument("--device", default=None, help="torch device, e.g. cpu or cuda")
+    parser.add_argument("-v", "--voice", default="zf_001")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per corpus entry; the fastest counts"
+    )
+    parser.add_argument(
+        "--skip-cold", action="store_true", help="don't measure a cold load in a new process"
+    )
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument(
+        "--segment-chars", type=int, default=None, help="pack sentences into segments"
+    )
+    parser.add_argument(
+        "--precision-compare",
+        action="store_true",
+        help="compare fp32 with int8 quantized weights instead",
+    )
+    parser.add_argument(
+        "--backend-compare",
+        action="store_true",
+        help="check ONNX Runtime against torch and compare their speed instead",
+    )
+    parser.add_argument(
+        "--backend", choices=("torch", "onnx"), default=None, help="inference backend"
+    )
+    parser.add_argument("--cold-load-probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--config-json", default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = dict(settings.CONFIG)
+    if args.config_json:
+        config.update(json.loads(args.config_json))
+    if args.threads is not None:
+        config["torch_threads"] = args.threads
+    if args.segment_chars is not None:
+        config["segment_chars"] = args.segment_chars
+    if args.backend is not None:
+        config["backend"] = args.backend
+
+    if args.cold_load_probe:
+        _cold_load_probe(args.device or None, config)
+        return 0
+
+    # Keep stdout clean for the JSON results; progress goes to stderr.
+    if args.precision_compare:
+        run = functools.partial(compare_variants, PRECISION_VARIANTS)
+    elif args.backend_compare:
+        run = functools.partial(compare_variants, BACKEND_VARIANTS)
+    else:
+        run = run_benchmark
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(
+            device=args.device,
+            config=config,
+            voice=args.voice,
+            repeat=max(1, args.repeat),
+            cold=not args.skip_cold,
+        )
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.backend_compare:
+        failures = parity_failures(results)
+        if failures:
+            print(f"Backend output differs: {', '.join(failures)}", file=sys.stderr)
+            return 1
+    elif args.compare and not args.precision_compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(
+                f"{len(regressions)} metrics regressed beyond {args.tolerance:.0%}",
+                file=sys.stderr,
+            )
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
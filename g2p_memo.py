@@ -0,0 +1,184 @@
+"""
+Memoization of grapheme-to-phoneme results.
+
+Chinese text routinely embeds the same English brand names and technical
+terms, and every one of them used to run through the full English pipeline.
+`G2PMemo` wraps the English callback and the Chinese `g2p` of the shared
+pipelines with a bounded LRU keyed by the normalized input, so a recurring
+term or sentence is phonemized once. The table can be saved to disk and is
+discarded automatically when the installed misaki version changes.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import settings
+from metrics import METRICS
+from result_cache import normalize_text
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def _g2p_version():
+    """Version of the G2P backend; cached phonemes are only valid for it."""
+    try:
+        from importlib.metadata import version
+
+        return version("misaki")
+    except Exception:
+        return "unknown"
+
+
+class G2PMemo:
+    def __init__(
+        self,
+        capacity=settings.G2P_MEMO_SIZE,
+        path=settings.G2P_MEMO_PATH,
+        save_every=500,
+    ):
+        self.capacity = capacity
+        self.path = path
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saver = None
+        self._unsaved = 0
+
+    def wrap(self, namespace, func, unpack=False):
+        """
+        Returns a memoized version of `func(text)`.
+
+        `unpack` is for KPipeline.g2p, which returns a (phonemes, tokens)
+        pair: only results without tokens (the Chinese G2P) are memoized,
+        since only plain strings survive a round trip through the file.
+        """
+
+        def memoized(text):
+            key = f"{namespace}\x00{normalize_text(text)}"
+            phonemes = self.get(key)
+            if phonemes is not None:
+                return (phonemes, None) if unpack else phonemes
+            result = func(text)
+            if unpack:
+                phonemes, tokens = result
+                if tokens is None and isinstance(phonemes, str):
+                    self.put(key, phonemes)
+            elif isinstance(result, str):
+                self.put(key, result)
+            return result
+
+        return memoized
+
+    # --- Table -------------------------------------------------------------
+
+    def get(self, key):
+        with self._lock:
+            phonemes = self._entries.get(key)
+            if phonemes is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        METRICS.increment("g2p_memo_misses" if phonemes is None else "g2p_memo_hits")
+        return phonemes
+
+    def put(self, key, phonemes):
+        with self._lock:
+            self._entries[key] = phonemes
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            saver = None
+            if (
+                self.path
+                and self._unsaved >= self.save_every
+                and (self._saver is None or not self._saver.is_alive())
+            ):
+                # put() runs inside the pipeline lock; writing a large table
+                # there would stall synthesis.
+                saver = self._saver = threading.Thread(
+                    target=self.save, name="g2p-memo-save", daemon=True
+                )
+        if saver is not None:
+            saver.start()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self._unsaved = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    # --- Persistence -------------------------------------------------------
+
+    def load(self):
+        """Loads the saved table. Returns the number of entries loaded."""
+        if not self.path:
+            return 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if data.get("format") != FORMAT_VERSION or data.get("g2p") != _g2p_version():
+            # Phonemes from another misaki release may differ; start over.
+            return 0
+        with self._lock:
+            # Saved oldest first, so the LRU order survives the round trip.
+            for key, phonemes in data.get("entries", []):
+                self._entries[key] = phonemes
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            return len(self._entries)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._unsaved:
+                return
+            entries = list(self._entries.items())
+            self._unsaved = 0
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with self._save_lock:
+            # Unique per save: the GUI, the CLI, the server and every render
+            # farm worker may save the same file at once.
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(
+                        {
+                            "format": FORMAT_VERSION,
+                            "g2p": _g2p_version(),
+                            "entries": entries,
+                        },
+                        f,
+                        ensure_ascii=False,
+                    )
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                # Only a cache: another process's save is as good as this one.
+                log.warning("Cannot save the G2P memo to %s: %s", self.path, e)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
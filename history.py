@@ -0,0 +1,167 @@
+"""
+Persistent generation history backed by SQLite.
+
+Every finished job is stored with its text, voice, language, speed, output
+path, audio duration and synthesis time. A full-text index makes the history
+searchable, and `page()` only returns short previews, so the GUI can page
+through thousands of entries without loading every text.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import settings
+
+log = logging.getLogger(__name__)
+
+PREVIEW_CHARS = 80
+
+
+@dataclass
+class HistoryEntry:
+    id: int
+    created_at: float
+    text: str
+    voice: str
+    language: str
+    speed: float
+    output_path: str
+    duration: float
+    synthesis_seconds: float
+
+
+class HistoryStore:
+    def __init__(self, path=settings.HISTORY_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Accessed from the GTK thread and, in batch tools, worker threads.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.fts = self._create_schema()
+
+    def _create_schema(self):
+        """Creates the tables; returns whether a full-text index is available."""
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    text TEXT NOT NULL,
+                    voice TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    speed REAL NOT NULL,
+                    output_path TEXT NOT NULL,
+                    duration REAL NOT NULL DEFAULT 0,
+                    synthesis_seconds REAL NOT NULL DEFAULT 0
+                )
+                """
+            )
+            # The trigram tokenizer matches substrings, which is what Chinese
+            # text needs; older SQLite builds only have unicode61.
+            for tokenizer in ("trigram", "unicode61"):
+                try:
+                    self._conn.execute(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5("
+                        "text, content='entries', content_rowid='id', "
+                        f"tokenize='{tokenizer}')"
+                    )
+                    break
+                except sqlite3.OperationalError:
+                    continue
+            else:
+                log.warning("SQLite has no FTS5 support, history search falls back to LIKE")
+                return False
+            self._conn.executescript(
+                """
+                CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+                    INSERT INTO entries_fts(rowid, text) VALUES (new.id, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+                    INSERT INTO entries_fts(entries_fts, rowid, text)
+                    VALUES ('delete', old.id, old.text);
+                END;
+                """
+            )
+            return True
+
+    def _where(self, query):
+        if not query:
+            return "", ()
+        if self.fts and len(query) >= 3:
+            # Quote the query so user input is matched literally.
+            phrase = '"' + query.replace('"', '""') + '"'
+            return "WHERE id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)", (
+                phrase,
+            )
+        # Too short for trigrams (or no FTS5): a plain scan is fine.
+        return "WHERE text LIKE ?", (f"%{query}%",)
+
+    def add(
+        self,
+        text,
+        voice,
+        language,
+        speed,
+        output_path,
+        duration=0.0,
+        synthesis_seconds=0.0,
+        created_at=None,
+    ):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO entries (created_at, text, voice, language, speed, "
+                "output_path, duration, synthesis_seconds) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    created_at or time.time(),
+                    text,
+                    voice,
+                    language,
+                    speed,
+                    output_path,
+                    duration,
+                    synthesis_seconds,
+                ),
+            )
+            return cursor.lastrowid
+
+    def count(self, query=None):
+        where, params = self._where(query)
+        with self._lock:
+            row = self._conn.execute(f"SELECT COUNT(*) FROM entries {where}", params).fetchone()
+        return row[0]
+
+    def page(self, offset, limit, query=None):
+        """
+        Returns (id, preview, created_at, duration) rows, newest first.
+        """
+        where, params = self._where(query)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, substr(text, 1, {PREVIEW_CHARS}) AS preview, "
+                f"created_at, duration FROM entries {where} "
+                "ORDER BY id DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def get(self, entry_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM entries WHERE id = ?", (entry_id,)
+            ).fetchone()
+        return HistoryEntry(**dict(row)) if row else None
+
+    def delete(self, entry_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
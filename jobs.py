@@ -0,0 +1,190 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import settings
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+
+class JobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    # Terminal states; the queue reports each job in one of them only once.
+    FINISHED = (DONE, FAILED, CANCELLED)
+
+
+_job_ids = itertools.count(1)
+
+
+@dataclass
+class SynthesisJob:
+    """A single text-to-speech request waiting in, or taken from, the queue."""
+
+    text: str
+    voice: str
+    language: str
+    output_path: str
+    speed: float = settings.DEFAULT_SPEED
+    priority: int = 0
+    # Play the audio in the app while it is being synthesized
+    stream_playback: bool = False
+    # Earlier render of this text whose unchanged segments can be reused
+    base_path: str | None = None
+    # Output sample rate; None uses the configured rate, 0 the native one
+    samplerate: int | None = None
+    id: int = field(default_factory=lambda: next(_job_ids))
+    status: str = JobStatus.PENDING
+    error: str | None = None
+    segments_done: int = 0
+    segments_total: int = 0
+    audio_seconds: float = 0.0
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    # Set to stop a running job at the next segment boundary
+    cancel_event: threading.Event = field(
+        default_factory=threading.Event, repr=False, compare=False
+    )
+
+    @property
+    def finished(self):
+        return self.status in JobStatus.FINISHED
+
+
+def record_job_metrics(job, stages):
+    """Counts a finished job and records its stage breakdown if it succeeded."""
+    METRICS.increment(f"jobs_{job.status}")
+    if job.status == JobStatus.DONE:
+        METRICS.record_job(
+            stages,
+            job.audio_seconds,
+            job.finished_at - (job.started_at or job.submitted_at),
+            job_id=job.id,
+            voice=job.voice,
+            language=job.language,
+            chars=len(job.text),
+        )
+
+
+class JobQueue:
+    """
+    Runs synthesis jobs one at a time on a single long-lived worker thread.
+
+    The worker is the only thread that drives the model, so jobs never
+    contend for it. Jobs with a higher priority run first; jobs with equal
+    priority run in submission order. `on_update` is called from the worker
+    thread whenever a job changes state or reports progress, so GUI callers
+    must hop back to their main loop themselves.
+    """
+
+    # Sorts ahead of every real job so stop() takes effect right away.
+    _STOP = (float("-inf"), -1, None)
+
+    def __init__(self, runner, on_update=None):
+        self._runner = runner
+        self._on_update = on_update
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._worker.start()
+
+    def stop(self):
+        """Drops the pending jobs; the running one, if any, still finishes."""
+        self._queue.put(self._STOP)
+
+    def join(self, timeout=None):
+        """Waits for the worker to exit after stop()."""
+        self._worker.join(timeout)
+
+    def submit(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+        self._queue.put((-job.priority, next(self._sequence), job))
+        self._notify(job)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. Returns True on success.
+
+        A pending job is dropped right away. A running job is asked to stop:
+        the runner sees `job.cancel_event` between segments and gives up,
+        after which the job is marked cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            if job.status == JobStatus.RUNNING:
+                job.cancel_event.set()
+                return True
+            job.status = JobStatus.CANCELLED
+            job.finished_at = time.time()
+        METRICS.increment("jobs_cancelled")
+        # The cancelled entry stays in the queue and is skipped by the worker.
+        self._notify(job)
+        return True
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def clear_finished(self):
+        """Forgets finished jobs so their text can be garbage collected."""
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+            for job_id in finished:
+                del self._jobs[job_id]
+        return finished
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == JobStatus.PENDING)
+
+    def report_progress(self, job):
+        """Called by the runner after each segment to publish progress."""
+        self._notify(job)
+
+    def _notify(self, job):
+        if self._on_update is not None:
+            self._on_update(job)
+
+    def _run(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                break
+
+            with self._lock:
+                if job.status != JobStatus.PENDING:
+                    continue
+                job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            self._notify(job)
+
+            with METRICS.trace() as stages:
+                try:
+                    self._runner(job)
+                    job.status = JobStatus.DONE
+                except Exception as e:
+                    if job.cancel_event.is_set():
+                        job.status = JobStatus.CANCELLED
+                    else:
+                        log.exception("Job %d failed", job.id)
+                        job.status = JobStatus.FAILED
+                        job.error = str(e)
+            job.finished_at = time.time()
+            record_job_metrics(job, stages)
+            self._notify(job)
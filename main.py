@@ -1,15 +1,10 @@
+# Imported first so startup timings are measured from process start.
+from timing import STARTUP
 import sys
 import os
 import ssl
-import requests
 import certifi
 
-# Set HF endpoint for Chinese users to download models - MUST be set before importing kokoro
-os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
-
-from kokoro import KModel, KPipeline
-import soundfile
-
 # --- Step 1: Perform dependency check before anything else ---
 # This is a blocking call that will use a temporary GTK loop if needed.
 from tts_installer import check_and_install_tts
@@ -20,93 +15,185 @@ if not check_and_install_tts():
     sys.exit(1)  # Exit with an error code
 
 # --- Step 2: Dependencies are met, now we can import and run the main app ---
+import logging
 import time
+from typing import TYPE_CHECKING
 import gi
 
 # Set version requirements for GTK4
 gi.require_version("Gtk", "4.0")
 import threading
-import torch
-from gi.repository import GLib
+from gi.repository import Gio, GLib, GObject, Pango
 from gi.repository import Gtk
 import settings
+from audio_output import (
+    FORMATS,
+    OUTPUT_RATES,
+    available_formats,
+    output_filename,
+    reserve_output_path,
+)
+from history import HistoryStore
+from jobs import JobQueue, JobStatus, SynthesisJob
+from metrics import METRICS, format_stages, format_utilization
+from tts_engine import SynthesisCancelled, TTSEngine, configure_torch
+from tts_server import SynthesisServer
+from voices import format_voice_spec
+from watch_folder import FolderWatcher
+
+if TYPE_CHECKING:
+    from playback import PlayerState, StreamingPlayer
+else:
+    try:
+        from playback import PlayerState, StreamingPlayer
+    except (ImportError, ValueError) as e:
+        # GStreamer or its introspection data is not installed.
+        print(f"Audio playback unavailable: {e}")
+        PlayerState = StreamingPlayer = None
+
+STARTUP.mark("app modules imported")
+
+log = logging.getLogger(__name__)
+
+JOB_STATUS_LABELS = {
+    JobStatus.PENDING: "等待中",
+    JobStatus.RUNNING: "生成中",
+    JobStatus.DONE: "已完成",
+    JobStatus.FAILED: "失败",
+    JobStatus.CANCELLED: "已取消",
+}
+
+BLEND_NONE = "无"
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+class HistoryItem(GObject.Object):
+    """One row of the history list; the full entry stays in SQLite."""
+
+    def __init__(self, entry_id, preview, created_at, duration):
+        super().__init__()
+        self.entry_id = entry_id
+        self.preview = preview
+        self.created_at = created_at
+        self.duration = duration
+
+
+class HistoryListModel(GObject.Object, Gio.ListModel):
+    """
+    Lazily paged view over the history table, newest entry first.
+
+    Gtk.ListView only asks for the rows it shows, so only the pages around
+    the visible range are ever read from the database.
+    """
+
+    PAGE_SIZE = 100
+    MAX_PAGES = 8
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.query = ""
+        self._count = store.count()
+        self._pages = {}
+
+    def do_get_item_type(self):
+        return HistoryItem.__gtype__
+
+    def do_get_n_items(self):
+        return self._count
+
+    def do_get_item(self, position):
+        if position >= self._count:
+            return None
+        page_index, offset = divmod(position, self.PAGE_SIZE)
+        page = self._pages.pop(page_index, None)
+        if page is None:
+            rows = self.store.page(
+                page_index * self.PAGE_SIZE, self.PAGE_SIZE, self.query
+            )
+            page = [HistoryItem(*row) for row in rows]
+            if len(self._pages) >= self.MAX_PAGES:
+                # Drop the least recently used page.
+                self._pages.pop(next(iter(self._pages)))
+        self._pages[page_index] = page
+        return page[offset] if offset < len(page) else None
+
+    def refresh(self, query=None):
+        """Reloads the row count, e.g. after an insert or a new search."""
+        if query is not None:
+            self.query = query
+        removed = self._count
+        self._pages.clear()
+        self._count = self.store.count(self.query)
+        self.items_changed(0, removed, self._count)
 
 
 class XttsApp(Gtk.Application):
     def __init__(self):
         super().__init__(application_id="org.remy.xtts-gtk")
-        self.tts_model = None
+        self.engine = TTSEngine()
+        self.player = None
+        if StreamingPlayer is not None:
+            try:
+                self.player = StreamingPlayer(
+                    on_state_changed=lambda state: GLib.idle_add(
+                        self._on_player_state_changed, state
+                    )
+                )
+            except Exception as e:
+                log.warning("Audio playback unavailable: %s", e)
+        # A single worker thread owns the model; the GUI only submits jobs.
+        self.job_queue = JobQueue(
+            self._generate_speech_worker,
+            # The status is passed along: by the time the callback runs, the
+            # worker may already have moved the job on.
+            on_update=lambda job: GLib.idle_add(self._on_job_updated, job, job.status),
+        )
+        self.queue_rows = {}
+        self.history = HistoryStore()
+        # Last render of the text in the editor, reused by the next generate
+        self.last_output_path = None
+        # Local HTTP server sharing the loaded engine, if enabled
+        self.server = None
+        # Watch-folder mode, if enabled
+        self.watcher = None
+        # Stopped watchers whose queued jobs have not finished yet
+        self._retired_watchers = []
         self.main_window = None
         self.connect("activate", self.on_activate)
+        self.connect("shutdown", self._on_shutdown)
 
     def _load_model(self):
         """
         Worker function to load the TTS model in a separate thread.
         Reports success or failure back to the main thread.
         """
-        print("Starting to load TTS model in background thread...")
-        print(f"Using device: {'cuda' if torch.cuda.is_available() else 'cpu'}")
-        print(f"HF_ENDPOINT: {os.environ.get('HF_ENDPOINT', 'not set')}")
+        log.info("Starting to load TTS model in background thread...")
+        # Probing libsndfile imports soundfile and numpy, which would delay
+        # the first window.
+        try:
+            GLib.idle_add(self._set_output_formats, available_formats())
+        except Exception as e:
+            log.warning("Cannot list the supported output formats: %s", e)
         try:
             # This is the time-consuming operation
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            print(f"Attempting to load model from hexgrad/Kokoro-82M-v1.1-zh...")
-
-            # Try different approaches to load the model
-            model_loaded = False
-
-            # First attempt: Normal loading
-            try:
-                self.tts_model = (
-                    KModel(repo_id="hexgrad/Kokoro-82M-v1.1-zh").to(device).eval()
-                )
-                model_loaded = True
-                print("Model loaded successfully via normal method!")
-            except (ssl.SSLError, requests.exceptions.SSLError) as ssl_e:
-                print(f"SSL Error during normal model loading: {ssl_e}")
-                print("Attempting alternative loading methods...")
-
-                # Second attempt: Try without SSL verification
-                try:
-                    import urllib3
-
-                    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                    # Create a session with disabled SSL verification
-                    session = requests.Session()
-                    session.verify = False
-                    # Try to load model with custom session (this might not work with all model loaders)
-                    print("Trying alternative SSL configuration...")
-                    original_context = ssl._create_default_https_context
-                    ssl._create_default_https_context = ssl._create_unverified_context
-                    self.tts_model = (
-                        KModel(repo_id="hexgrad/Kokoro-82M-v1.1-zh").to(device).eval()
-                    )
-                    ssl._create_default_https_context = original_context
-                    model_loaded = True
-                    print("Model loaded successfully via SSL bypass method!")
-                except Exception as alt_e:
-                    print(f"Alternative SSL method also failed: {alt_e}")
-
-            if model_loaded:
-                # Schedule the UI update on the main GTK thread
-                GLib.idle_add(self._on_model_loaded, "success")
-            else:
-                # All methods failed
-                raise Exception("All model loading methods failed")
+            self.engine.load()
+            # Schedule the UI update on the main GTK thread
+            GLib.idle_add(self._on_model_loaded, "success")
         except ssl.SSLError as ssl_e:
-            print(f"SSL Error during model loading: {ssl_e}")
-            print("This might be due to network restrictions or certificate issues.")
+            log.error("SSL error during model loading: %s", ssl_e)
+            log.error("This might be due to network restrictions or certificate issues.")
             GLib.idle_add(
                 self._on_model_loaded,
                 "failure",
                 f"SSL错误: {ssl_e}\n请检查网络连接或尝试使用VPN。\n建议：\n1. 检查系统时间是否正确\n2. 尝试更新CA证书\n3. 使用VPN或代理\n4. 手动下载模型到本地",
             )
         except Exception as e:
-            print(f"Failed to load TTS model: {e}")
-            print(f"Error type: {type(e).__name__}")
-            import traceback
-
-            traceback.print_exc()
+            log.exception("Failed to load TTS model (%s)", type(e).__name__)
             # Report failure back to the main thread
             GLib.idle_add(self._on_model_loaded, "failure", str(e))
 
@@ -118,12 +205,20 @@ class XttsApp(Gtk.Application):
         self.spinner.set_visible(False)
 
         if status == "success":
-            print("TTS model successfully loaded.")
+            log.info("TTS model successfully loaded.")
+            STARTUP.mark("model ready")
+            STARTUP.print_report()
             self.generate_button.set_sensitive(True)
             self.generate_button.set_label("生成语音")
             self.generate_button.connect("clicked", self._on_generate_clicked)
+            self._populate_voice_lists(rescan=True)
+            self.job_queue.start()
+            if self.engine.config["server_enabled"]:
+                self._start_server()
+            if self.engine.config["watch_enabled"]:
+                self._start_watcher()
         else:
-            print("Disabling generation functionality due to model load failure.")
+            log.warning("Disabling generation functionality due to model load failure.")
             self.generate_button.set_label("模型加载失败")
             # Optionally, show an error dialog to the user
             dialog = Gtk.MessageDialog(
@@ -157,13 +252,28 @@ class XttsApp(Gtk.Application):
         history_frame.set_size_request(250, -1)
         main_box.append(history_frame)
 
-        history_scrolled_window = Gtk.ScrolledWindow()
-        history_frame.set_child(history_scrolled_window)
+        history_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        history_frame.set_child(history_box)
 
-        self.history_list_box = Gtk.ListBox()
-        self.history_list_box.set_selection_mode(Gtk.SelectionMode.SINGLE)
-        self.history_list_box.connect("row-activated", self._on_history_row_activated)
-        history_scrolled_window.set_child(self.history_list_box)
+        history_search = Gtk.SearchEntry(placeholder_text="搜索历史")
+        history_search.connect("search-changed", self._on_history_search_changed)
+        history_box.append(history_search)
+
+        history_scrolled_window = Gtk.ScrolledWindow()
+        history_scrolled_window.set_vexpand(True)
+        history_box.append(history_scrolled_window)
+
+        self.history_model = HistoryListModel(self.history)
+        history_factory = Gtk.SignalListItemFactory()
+        history_factory.connect("setup", self._on_history_item_setup)
+        history_factory.connect("bind", self._on_history_item_bind)
+        self.history_list_view = Gtk.ListView(
+            model=Gtk.SingleSelection(model=self.history_model),
+            factory=history_factory,
+            single_click_activate=True,
+        )
+        self.history_list_view.connect("activate", self._on_history_item_activated)
+        history_scrolled_window.set_child(self.history_list_view)
 
         # --- Center Panel: Text Input ---
         center_box = Gtk.Box(
@@ -191,9 +301,77 @@ class XttsApp(Gtk.Application):
         self.spinner = Gtk.Spinner()
         center_box.append(self.spinner)
 
+        self.progress_bar = Gtk.ProgressBar(show_text=True)
+        self.progress_bar.set_visible(False)
+        center_box.append(self.progress_bar)
+
+        self.progress_label = Gtk.Label(label="")
+        center_box.append(self.progress_label)
+
+        # --- Playback controls ---
+        playback_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.play_button = Gtk.Button(label="播放")
+        self.play_button.set_sensitive(False)
+        self.play_button.connect("clicked", self._on_play_clicked)
+        playback_box.append(self.play_button)
+
+        self.seek_scale = Gtk.Scale.new_with_range(
+            Gtk.Orientation.HORIZONTAL, 0.0, 1.0, 0.1
+        )
+        self.seek_scale.set_draw_value(False)
+        self.seek_scale.set_hexpand(True)
+        self.seek_scale.connect("change-value", self._on_seek_changed)
+        playback_box.append(self.seek_scale)
+
+        self.playback_time_label = Gtk.Label(label="0:00 / 0:00")
+        playback_box.append(self.playback_time_label)
+        playback_box.set_visible(self.player is not None)
+        center_box.append(playback_box)
+
+        generate_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         self.generate_button = Gtk.Button(label="正在加载模型...")
         self.generate_button.set_sensitive(False)  # Disable initially
-        center_box.append(self.generate_button)
+        self.generate_button.set_hexpand(True)
+        generate_box.append(self.generate_button)
+
+        self.stop_button = Gtk.Button(label="停止")
+        self.stop_button.set_sensitive(False)
+        self.stop_button.connect("clicked", self._on_stop_clicked)
+        generate_box.append(self.stop_button)
+        center_box.append(generate_box)
+
+        # --- Job queue panel ---
+        queue_frame = Gtk.Frame(label="任务队列")
+        center_box.append(queue_frame)
+
+        queue_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        queue_frame.set_child(queue_box)
+
+        queue_scrolled_window = Gtk.ScrolledWindow()
+        queue_scrolled_window.set_min_content_height(120)
+        queue_box.append(queue_scrolled_window)
+
+        self.queue_list_box = Gtk.ListBox()
+        self.queue_list_box.set_selection_mode(Gtk.SelectionMode.NONE)
+        queue_scrolled_window.set_child(self.queue_list_box)
+
+        clear_queue_button = Gtk.Button(label="清除已完成任务")
+        clear_queue_button.connect("clicked", self._on_clear_queue_clicked)
+        queue_box.append(clear_queue_button)
+
+        # --- Performance panel ---
+        perf_frame = Gtk.Frame(label="性能")
+        center_box.append(perf_frame)
+        self.perf_label = Gtk.Label(
+            label="暂无数据",
+            halign=Gtk.Align.START,
+            margin_start=6,
+            margin_end=6,
+            margin_top=3,
+            margin_bottom=3,
+            wrap=True,
+        )
+        perf_frame.set_child(self.perf_label)
 
         # --- Right Panel: Settings ---
         settings_frame = Gtk.Frame(
@@ -227,11 +405,8 @@ class XttsApp(Gtk.Application):
         speaker_label = Gtk.Label(label="音色", halign=Gtk.Align.START)
         settings_grid.attach(speaker_label, 0, 1, 1, 1)
 
-        speaker_list = Gtk.StringList()
-        speaker_list.append("zf_001")
-        speaker_list.append("zf_002")
-        self.speaker_combo = Gtk.DropDown.new(speaker_list, None)
-        self.speaker_combo.set_selected(0)
+        # Filled from the voice packs installed in the model store
+        self.speaker_combo = Gtk.DropDown.new(Gtk.StringList(), None)
         settings_grid.attach(self.speaker_combo, 1, 1, 1, 1)
 
         # Output Directory
@@ -247,7 +422,167 @@ class XttsApp(Gtk.Application):
         output_box.append(self.output_button)
         settings_grid.attach(output_box, 1, 2, 1, 1)
 
+        # Job priority
+        priority_label = Gtk.Label(label="优先级", halign=Gtk.Align.START)
+        settings_grid.attach(priority_label, 0, 3, 1, 1)
+
+        self.priority_spin = Gtk.SpinButton.new_with_range(0, 10, 1)
+        self.priority_spin.set_value(0)
+        settings_grid.attach(self.priority_spin, 1, 3, 1, 1)
+
+        # Voice blending
+        blend_label = Gtk.Label(label="混合音色", halign=Gtk.Align.START)
+        settings_grid.attach(blend_label, 0, 4, 1, 1)
+
+        self.blend_combo = Gtk.DropDown.new(Gtk.StringList(), None)
+        settings_grid.attach(self.blend_combo, 1, 4, 1, 1)
+
+        blend_ratio_label = Gtk.Label(label="混合比例", halign=Gtk.Align.START)
+        settings_grid.attach(blend_ratio_label, 0, 5, 1, 1)
+
+        self.blend_scale = Gtk.Scale.new_with_range(
+            Gtk.Orientation.HORIZONTAL, 0.0, 1.0, 0.05
+        )
+        self.blend_scale.set_value(0.5)
+        self.blend_scale.set_digits(2)
+        self.blend_scale.set_hexpand(True)
+        settings_grid.attach(self.blend_scale, 1, 5, 1, 1)
+
+        self._populate_voice_lists()
+
+        # Result cache
+        cache_label = Gtk.Label(label="音频缓存", halign=Gtk.Align.START)
+        settings_grid.attach(cache_label, 0, 6, 1, 1)
+
+        cache_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self.cache_stats_label = Gtk.Label(halign=Gtk.Align.START)
+        cache_box.append(self.cache_stats_label)
+        clear_cache_button = Gtk.Button(label="清除缓存")
+        clear_cache_button.connect("clicked", self._on_clear_cache_clicked)
+        clear_cache_button.set_sensitive(self.engine.cache is not None)
+        cache_box.append(clear_cache_button)
+        settings_grid.attach(cache_box, 1, 6, 1, 1)
+        self._update_cache_stats()
+
+        # CPU performance
+        config = self.engine.config
+        threads_label = Gtk.Label(label="推理线程", halign=Gtk.Align.START)
+        settings_grid.attach(threads_label, 0, 7, 1, 1)
+        self.threads_spin = Gtk.SpinButton.new_with_range(0, 256, 1)
+        self.threads_spin.set_value(config["torch_threads"])
+        self.threads_spin.set_tooltip_text("0 表示使用 torch 默认值")
+        settings_grid.attach(self.threads_spin, 1, 7, 1, 1)
+
+        interop_label = Gtk.Label(label="并行线程", halign=Gtk.Align.START)
+        settings_grid.attach(interop_label, 0, 8, 1, 1)
+        self.interop_spin = Gtk.SpinButton.new_with_range(0, 64, 1)
+        self.interop_spin.set_value(config["interop_threads"])
+        self.interop_spin.set_tooltip_text("0 表示使用 torch 默认值，重启后生效")
+        settings_grid.attach(self.interop_spin, 1, 8, 1, 1)
+
+        segment_label = Gtk.Label(label="分段字数", halign=Gtk.Align.START)
+        settings_grid.attach(segment_label, 0, 9, 1, 1)
+        self.segment_spin = Gtk.SpinButton.new_with_range(0, 400, 10)
+        self.segment_spin.set_value(config["segment_chars"])
+        self.segment_spin.set_tooltip_text("把同一段落的短句合并后再推理，0 表示逐句推理")
+        settings_grid.attach(self.segment_spin, 1, 9, 1, 1)
+
+        self.inference_mode_check = Gtk.CheckButton(label="推理模式 (inference_mode)")
+        self.inference_mode_check.set_active(config["inference_mode"])
+        settings_grid.attach(self.inference_mode_check, 0, 10, 2, 1)
+
+        self.stream_playback_check = Gtk.CheckButton(label="边生成边播放")
+        self.stream_playback_check.set_active(self.player is not None)
+        self.stream_playback_check.set_sensitive(self.player is not None)
+        settings_grid.attach(self.stream_playback_check, 0, 11, 2, 1)
+
+        # Output encoding and naming
+        format_label = Gtk.Label(label="输出格式", halign=Gtk.Align.START)
+        settings_grid.attach(format_label, 0, 12, 1, 1)
+        # Every format until the background loader has probed libsndfile
+        self.output_formats = list(FORMATS)
+        self.format_combo = Gtk.DropDown.new_from_strings(
+            [FORMATS[name].extension[1:].upper() for name in self.output_formats]
+        )
+        if config["output_format"] in self.output_formats:
+            self.format_combo.set_selected(
+                self.output_formats.index(config["output_format"])
+            )
+        settings_grid.attach(self.format_combo, 1, 12, 1, 1)
+
+        rate_label = Gtk.Label(label="采样率", halign=Gtk.Align.START)
+        settings_grid.attach(rate_label, 0, 13, 1, 1)
+        self.rate_combo = Gtk.DropDown.new_from_strings(
+            [
+                f"{rate} Hz" if rate else f"原始 ({settings.SAMPLE_RATE} Hz)"
+                for rate in OUTPUT_RATES
+            ]
+        )
+        if config["output_sample_rate"] in OUTPUT_RATES:
+            self.rate_combo.set_selected(
+                OUTPUT_RATES.index(config["output_sample_rate"])
+            )
+        settings_grid.attach(self.rate_combo, 1, 13, 1, 1)
+
+        template_label = Gtk.Label(label="文件名", halign=Gtk.Align.START)
+        settings_grid.attach(template_label, 0, 14, 1, 1)
+        self.template_entry = Gtk.Entry(text=config["output_name_template"])
+        self.template_entry.set_tooltip_text(
+            "可用字段: {date} {time} {timestamp} {voice} {language} {id} {text}"
+        )
+        settings_grid.attach(self.template_entry, 1, 14, 1, 1)
+
+        self.keep_partial_check = Gtk.CheckButton(label="停止时保留已生成部分")
+        self.keep_partial_check.set_active(config["keep_partial_output"])
+        settings_grid.attach(self.keep_partial_check, 0, 15, 2, 1)
+
+        self.server_check = Gtk.CheckButton(
+            label=f"启用本地 HTTP 服务 (端口 {settings.SERVER_PORT})"
+        )
+        self.server_check.set_active(config["server_enabled"])
+        settings_grid.attach(self.server_check, 0, 16, 2, 1)
+
+        self.quantize_check = Gtk.CheckButton(label="int8 量化 (仅 CPU，重启后生效)")
+        self.quantize_check.set_active(config["quantize_int8"])
+        settings_grid.attach(self.quantize_check, 0, 17, 2, 1)
+
+        self.onnx_check = Gtk.CheckButton(label="ONNX Runtime 推理 (仅 CPU，重启后生效)")
+        self.onnx_check.set_active(config["backend"] == "onnx")
+        settings_grid.attach(self.onnx_check, 0, 18, 2, 1)
+
+        idle_label = Gtk.Label(label="空闲卸载 (分钟)", halign=Gtk.Align.START)
+        settings_grid.attach(idle_label, 0, 19, 1, 1)
+        self.idle_unload_spin = Gtk.SpinButton.new_with_range(0, 1440, 5)
+        self.idle_unload_spin.set_value(config["idle_unload_minutes"])
+        self.idle_unload_spin.set_tooltip_text(
+            "空闲这么久后释放模型，下次生成时自动重新加载；0 表示不卸载"
+        )
+        settings_grid.attach(self.idle_unload_spin, 1, 19, 1, 1)
+
+        watch_label = Gtk.Label(label="监视目录", halign=Gtk.Align.START)
+        settings_grid.attach(watch_label, 0, 20, 1, 1)
+        watch_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.watch_entry = Gtk.Entry(text=config["watch_dir"])
+        self.watch_entry.set_tooltip_text("新增或修改的 .txt 文件会自动生成到输出目录")
+        watch_box.append(self.watch_entry)
+        watch_button = Gtk.Button(label="浏览...")
+        watch_button.connect("clicked", self._on_select_watch_folder_clicked)
+        watch_box.append(watch_button)
+        settings_grid.attach(watch_box, 1, 20, 1, 1)
+
+        self.watch_check = Gtk.CheckButton(label="监视文件夹并自动生成")
+        self.watch_check.set_active(config["watch_enabled"])
+        settings_grid.attach(self.watch_check, 0, 21, 2, 1)
+
+        save_config_button = Gtk.Button(label="保存设置")
+        save_config_button.connect("clicked", self._on_save_config_clicked)
+        settings_grid.attach(save_config_button, 0, 22, 2, 1)
+
+        if self.player is not None:
+            GLib.timeout_add(200, self._update_playback_position)
+
         self.main_window.present()
+        STARTUP.mark("first window presented")
 
         # Start the spinner and the background thread for model loading
         self.spinner.start()
@@ -278,6 +613,25 @@ class XttsApp(Gtk.Application):
         dialog.connect("response", on_response)
         dialog.show()
 
+    def _on_select_watch_folder_clicked(self, button):
+        dialog = Gtk.FileChooserNative(
+            title="选择监视目录",
+            transient_for=self.get_active_window(),
+            action=Gtk.FileChooserAction.SELECT_FOLDER,
+            accept_label="_Select",
+            cancel_label="_Cancel",
+        )
+
+        def on_response(dialog_instance, response_id):
+            if response_id == Gtk.ResponseType.ACCEPT:
+                files = dialog_instance.get_files()
+                if files:
+                    self.watch_entry.set_text(files[0].get_path())
+            dialog_instance.destroy()
+
+        dialog.connect("response", on_response)
+        dialog.show()
+
     def _on_generate_clicked(self, button):
         buffer = self.text_view.get_buffer()
         start_iter = buffer.get_start_iter()
@@ -287,11 +641,7 @@ class XttsApp(Gtk.Application):
         if not text_content.strip():
             return
 
-        selected_speaker_index = self.speaker_combo.get_selected()
-        speaker_model = self.speaker_combo.get_model()
-        speaker_path = "zf_001"  # 默认音色
-        if speaker_model and selected_speaker_index != Gtk.INVALID_LIST_POSITION:
-            speaker_path = speaker_model.get_string(selected_speaker_index)
+        speaker_path = self._selected_voice_spec()
         output_path = self.output_entry.get_text()
         selected_index = self.lang_combo.get_selected()
         model = self.lang_combo.get_model()
@@ -299,122 +649,532 @@ class XttsApp(Gtk.Application):
         if model and selected_index != Gtk.INVALID_LIST_POSITION:
             selected_text = model.get_string(selected_index)
             language_id = settings.LANG_ID[selected_text]
-            output_file = os.path.join(output_path, f"{int(time.time())}.wav")
 
-            self.spinner.start()
-            self.generate_button.set_sensitive(False)
-            self.generate_button.set_label("正在生成...")
-
-            thread = threading.Thread(
-                target=self._generate_speech_worker,
-                args=(text_content, language_id, speaker_path, output_file),
+            job = SynthesisJob(
+                text=text_content,
+                voice=speaker_path,
+                language=language_id,
+                output_path="",
+                priority=self.priority_spin.get_value_as_int(),
+                stream_playback=self.stream_playback_check.get_active(),
+                base_path=self.last_output_path,
+            )
+            output_format = FORMATS[self._selected_output_format()]
+            samplerate = OUTPUT_RATES[self.rate_combo.get_selected()]
+            rate = samplerate or settings.SAMPLE_RATE
+            if output_format.rates and rate not in output_format.rates:
+                self._show_error(
+                    "无法生成语音",
+                    f"{output_format.name} 不支持 {rate} Hz 采样率。",
+                )
+                return
+            job.samplerate = samplerate
+            try:
+                template = (
+                    self.template_entry.get_text()
+                    or settings.DEFAULT_CONFIG["output_name_template"]
+                )
+                filename = output_filename(
+                    template,
+                    output_format.extension,
+                    text=text_content,
+                    voice=speaker_path,
+                    language=language_id,
+                    job_id=job.id,
+                )
+            except (KeyError, IndexError, ValueError) as e:
+                self._show_error("文件名模板无效", f"无法解析文件名模板: {e}")
+                return
+            job.output_path = reserve_output_path(output_path, filename)
+            self.job_queue.submit(job)
+
+    def _set_output_formats(self, names):
+        """Offers only the formats the installed libsndfile can write."""
+        selected = self._selected_output_format()
+        self.output_formats = [name for name in FORMATS if name in names]
+        self.format_combo.set_model(
+            Gtk.StringList.new(
+                [FORMATS[name].extension[1:].upper() for name in self.output_formats]
             )
-            thread.daemon = True
-            thread.start()
+        )
+        self.format_combo.set_selected(
+            self.output_formats.index(selected) if selected in self.output_formats else 0
+        )
+        return False
+
+    def _selected_output_format(self):
+        index = self.format_combo.get_selected()
+        if index == Gtk.INVALID_LIST_POSITION or index >= len(self.output_formats):
+            return "wav"
+        return self.output_formats[index]
+
+    def _show_error(self, text, secondary_text):
+        dialog = Gtk.MessageDialog(
+            transient_for=self.main_window,
+            modal=True,
+            message_type=Gtk.MessageType.ERROR,
+            buttons=Gtk.ButtonsType.OK,
+            text=text,
+            secondary_text=secondary_text,
+        )
+        dialog.connect("response", lambda d, r: d.destroy())
+        dialog.show()
+
+    def _populate_voice_lists(self, rescan=False):
+        """Fills the voice dropdowns from the installed voice packs."""
+        voices = self.engine.voices.available(rescan=rescan)
+        if not voices:
+            voices = list(settings.DEFAULT_VOICES)
+
+        selected = self._dropdown_string(self.speaker_combo)
+        self.speaker_combo.set_model(Gtk.StringList.new(voices))
+        self.speaker_combo.set_selected(
+            voices.index(selected) if selected is not None and selected in voices else 0
+        )
+
+        blend_selected = self._dropdown_string(self.blend_combo)
+        blend_choices = [BLEND_NONE] + voices
+        self.blend_combo.set_model(Gtk.StringList.new(blend_choices))
+        self.blend_combo.set_selected(
+            blend_choices.index(blend_selected) if blend_selected in blend_choices else 0
+        )
 
-    def _generate_speech_worker(self, text, language, speaker_path, file_path):
+    @staticmethod
+    def _dropdown_string(dropdown):
+        model = dropdown.get_model()
+        index = dropdown.get_selected()
+        if model is None or index == Gtk.INVALID_LIST_POSITION:
+            return None
+        return model.get_string(index)
+
+    def _selected_voice_spec(self):
+        """Builds the voice spec for the selected voice and optional blend."""
+        voice = self._dropdown_string(self.speaker_combo) or "zf_001"  # 默认音色
+        blend_voice = self._dropdown_string(self.blend_combo)
+        if blend_voice in (None, BLEND_NONE) or blend_voice == voice:
+            return voice
+        ratio = self.blend_scale.get_value()
+        return format_voice_spec(((voice, 1.0 - ratio), (blend_voice, ratio)))
+
+    def _generate_speech_worker(self, job):
         """
-        Worker function to generate speech in a separate thread.
+        Runs a single job on the job queue's worker thread.
+
+        Errors propagate to the job queue, which marks the job as failed.
         """
+        def on_progress(done, total, audio_seconds):
+            job.segments_done = done
+            job.segments_total = total
+            job.audio_seconds = audio_seconds
+            self.job_queue.report_progress(job)
+
+        # Called from this worker thread: the player's feeding side is
+        # thread-safe, so audio reaches the sink without a main-loop hop.
+        player = self.player if job.stream_playback else None
+        if player is not None:
+            player.start_stream()
+
         try:
-            print(f"Generating speech with voice: {speaker_path}")
-            en_pipeline = KPipeline(
-                lang_code="a", repo_id="hexgrad/Kokoro-82M-v1.1-zh", model=False
+            log.info("Job #%d: generating speech with voice %s", job.id, job.voice)
+            self.engine.synthesize(
+                job.text,
+                job.voice,
+                job.output_path,
+                speed=job.speed,
+                language=job.language,
+                on_progress=on_progress,
+                on_audio=player.feed if player is not None else None,
+                base_path=job.base_path,
+                samplerate=job.samplerate,
+                cancel=job.cancel_event,
             )
+        except SynthesisCancelled as e:
+            log.info("Job #%d: stopped after %d segments", job.id, e.segments_done)
+            raise
+        except ssl.SSLError as ssl_e:
+            log.error("SSL error during speech generation: %s", ssl_e)
+            raise RuntimeError(
+                f"SSL错误: {ssl_e}\n请检查网络连接或尝试使用VPN。"
+            ) from ssl_e
+        finally:
+            if player is not None:
+                player.finish_stream()
+
+    def _on_player_state_changed(self, state):
+        """
+        Callback executed in the main GTK thread when the player changes state.
+        """
+        self.play_button.set_sensitive(state != PlayerState.STOPPED)
+        if state in (PlayerState.PLAYING, PlayerState.BUFFERING):
+            self.play_button.set_label("暂停")
+        else:
+            self.play_button.set_label("播放")
+        if state == PlayerState.BUFFERING:
+            self.progress_label.set_text("正在缓冲...")
+        return False
 
-            def en_callable(text):
-                return next(en_pipeline(text)).phonemes
+    def _on_play_clicked(self, button):
+        player = self.player
+        if player is None:
+            return
+        if player.state in (PlayerState.PLAYING, PlayerState.BUFFERING):
+            player.pause()
+        else:
+            player.play()
 
-            zh_pipeline = KPipeline(
-                lang_code="zh",
-                repo_id="hexgrad/Kokoro-82M-v1.1-zh",
-                model=self.tts_model,
-                en_callable=en_callable,
-            )
-            generator = zh_pipeline(text=text, voice=speaker_path, speed=0.8 * 1.1)
-            result = next(generator)
-            wav = result.audio
-            soundfile.write(file_path, wav, 24000)
+    def _on_seek_changed(self, scale, scroll_type, value):
+        if self.player is not None:
+            self.player.seek(value)
+        return False
 
-            print(f"Speech generated successfully: {file_path}")
-            # Pass back a dictionary with all the info
-            GLib.idle_add(
-                self._on_generation_finished,
-                "success",
-                {"file_path": file_path, "text": text},
+    def _update_playback_position(self):
+        player = self.player
+        if player is None:
+            return False
+        available = player.available_seconds()
+        position = min(player.position_seconds(), available)
+        self.seek_scale.set_range(0.0, max(available, 0.1))
+        self.seek_scale.set_value(position)
+        self.playback_time_label.set_text(
+            f"{format_seconds(position)} / {format_seconds(available)}"
+        )
+        return True  # Keep the timeout running
+
+    def _on_job_updated(self, job, status):
+        """
+        Callback executed in the main GTK thread whenever a job changes.
+
+        `status` is the job's status when the update was sent. Only the
+        update that reported the terminal status runs the once-per-job
+        side effects, even if earlier updates still pending see the job
+        finished already.
+        """
+        self._update_queue_row(job)
+        finished = status in JobStatus.FINISHED
+        watcher = self._watcher_of(job)
+        watched = watcher is not None
+        if watcher is not None and finished:
+            watcher.job_finished(job)
+            if watcher is not self.watcher and not watcher.busy:
+                self._retired_watchers.remove(watcher)
+
+        if status == JobStatus.RUNNING:
+            self.stop_button.set_sensitive(not job.cancel_event.is_set())
+            if job.segments_total:
+                self._update_progress(job)
+        elif status == JobStatus.DONE:
+            log.info("Job #%d: speech saved to %s", job.id, job.output_path)
+            self._add_to_history(job)
+            if not watched:
+                self.last_output_path = job.output_path
+        elif status == JobStatus.FAILED and not watched:
+            self._show_error(
+                "无法生成语音", f"生成过程中发生错误。\n\n错误: {job.error}"
             )
-        except ssl.SSLError as ssl_e:
-            print(f"SSL Error during speech generation: {ssl_e}")
-            GLib.idle_add(
-                self._on_generation_finished,
-                "failure",
-                f"SSL错误: {ssl_e}\n请检查网络连接或尝试使用VPN。",
+
+        if finished:
+            self._update_cache_stats()
+            self._update_perf_panel()
+            if status != JobStatus.DONE and os.path.isfile(job.output_path):
+                # Drop the empty placeholder reserved for the output name.
+                if os.path.getsize(job.output_path) == 0:
+                    os.remove(job.output_path)
+
+        busy = any(not queued.finished for queued in self.job_queue.jobs())
+        self.spinner.set_visible(busy)
+        if busy:
+            self.spinner.start()
+        else:
+            self.spinner.stop()
+            self.progress_label.set_text("")
+            self.progress_bar.set_visible(False)
+            self.stop_button.set_sensitive(False)
+        return False
+
+    def _update_progress(self, job):
+        """Shows a running job's segment progress and estimated time left."""
+        done, total = job.segments_done, job.segments_total
+        self.progress_bar.set_visible(True)
+        self.progress_bar.set_fraction(done / total)
+        if done and job.started_at is not None:
+            elapsed = time.time() - job.started_at
+            remaining = elapsed / done * (total - done)
+            self.progress_bar.set_text(
+                f"{done}/{total} 段，剩余约 {format_seconds(remaining)}"
             )
-        except Exception as e:
-            print(f"Failed to generate speech: {e}")
-            print(f"Error type: {type(e).__name__}")
-            import traceback
+        else:
+            self.progress_bar.set_text(f"{done}/{total} 段")
+        self.progress_label.set_text(
+            f"任务 #{job.id}: 已生成 {job.audio_seconds:.1f} 秒音频"
+        )
 
-            traceback.print_exc()
-            GLib.idle_add(self._on_generation_finished, "failure", str(e))
+    def _on_stop_clicked(self, button):
+        """Stops the running job at the next segment boundary."""
+        for job in self.job_queue.jobs():
+            if job.status == JobStatus.RUNNING:
+                self.job_queue.cancel(job.id)
+                if job.stream_playback and self.player is not None:
+                    self.player.stop()
+        button.set_sensitive(False)
+        self.progress_label.set_text("正在停止...")
+
+    def _update_queue_row(self, job):
+        """Creates or refreshes the queue panel row for a job."""
+        row = self.queue_rows.get(job.id)
+        if row is None:
+            row_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+            row = Gtk.ListBoxRow()
+            row.set_child(row_box)
+            row.label = Gtk.Label(halign=Gtk.Align.START, hexpand=True)
+            row_box.append(row.label)
+            row.cancel_button = Gtk.Button(label="取消")
+            row.cancel_button.connect(
+                "clicked", lambda b: self.job_queue.cancel(job.id)
+            )
+            row_box.append(row.cancel_button)
+            self.queue_rows[job.id] = row
+            self.queue_list_box.append(row)
+
+        short_text = job.text.replace("\n", " ").strip()
+        if len(short_text) > 20:
+            short_text = short_text[:20] + "..."
+        row.label.set_text(
+            f"#{job.id} [{JOB_STATUS_LABELS[job.status]}] {short_text}"
+        )
+        row.cancel_button.set_sensitive(
+            job.status == JobStatus.PENDING
+            or (job.status == JobStatus.RUNNING and not job.cancel_event.is_set())
+        )
 
-    def _on_generation_finished(self, status, message):
-        """
-        Callback executed in the main GTK thread after speech generation.
-        """
-        self.spinner.stop()
-        self.generate_button.set_sensitive(True)
-        self.generate_button.set_label("生成语音")
+    def _update_perf_panel(self):
+        """Shows the last job's stage breakdown and the rolling RTF."""
+        last_job = METRICS.last_job
+        if last_job is None:
+            return
+        rolling_rtf = METRICS.rolling_rtf()
+        lines = [
+            f"上次任务: {last_job['elapsed']:.2f} 秒生成 "
+            f"{last_job['audio_seconds']:.1f} 秒音频",
+        ]
+        if last_job["stages"]:
+            lines.append(f"阶段: {format_stages(last_job['stages'])}")
+            lines.append(f"利用率: {format_utilization(last_job['utilization'])}")
+        if rolling_rtf is not None:
+            lines.append(
+                f"实时率 (最近 {len(METRICS.recent_jobs)} 个任务): {rolling_rtf:.2f}"
+            )
+        self.perf_label.set_text("\n".join(lines))
 
-        if status == "success":
-            file_path = message["file_path"]
-            text = message["text"]
-            print(f"Speech successfully saved to {file_path}")
-            self._add_to_history(text)
+    def _update_cache_stats(self):
+        lines = []
+        if self.engine.cache is None:
+            lines.append("已禁用")
         else:
-            # message is an error string here
-            dialog = Gtk.MessageDialog(
-                transient_for=self.main_window,
-                modal=True,
-                message_type=Gtk.MessageType.ERROR,
-                buttons=Gtk.ButtonsType.OK,
-                text="无法生成语音",
-                secondary_text=f"生成过程中发生错误。\n\n错误: {message}",
+            stats = self.engine.cache.stats()
+            lines.append(
+                f"命中 {stats['hits']} / 未命中 {stats['misses']}，"
+                f"{stats['size_bytes'] / (1024 * 1024):.1f} MB"
+            )
+        if self.engine.g2p_memo is not None:
+            memo = self.engine.g2p_memo.stats()
+            lines.append(
+                f"音素缓存 {memo['entries']} 条，命中率 {memo['hit_rate']:.0%}"
+            )
+        self.cache_stats_label.set_text("\n".join(lines))
+
+    def _start_server(self):
+        """Serves the loaded engine over HTTP on localhost."""
+        server = SynthesisServer(
+            self.engine,
+            workers=self.engine.config["server_workers"],
+            max_pending=self.engine.config["server_max_pending"],
+        )
+        try:
+            server.start_in_thread()
+        except OSError as e:
+            log.error("Could not start the synthesis server: %s", e)
+            self._show_error("无法启动本地 HTTP 服务", str(e))
+            return
+        self.server = server
+
+    def _stop_server(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+    def _start_watcher(self):
+        """Synthesizes new and changed .txt files of the watched folder."""
+        config = self.engine.config
+        directory = config["watch_dir"]
+        if not os.path.isdir(directory):
+            self._show_error("无法监视文件夹", f"目录不存在: {directory}")
+            return
+        output_format = FORMATS[self._selected_output_format()]
+
+        def make_job(text, output_path):
+            return SynthesisJob(
+                text=text,
+                voice=self._selected_voice_spec(),
+                language=settings.LANG_ID[
+                    self._dropdown_string(self.lang_combo) or "中文 (zh-cn)"
+                ],
+                output_path=output_path,
+                # Jobs typed into the editor go first.
+                priority=-1,
+                samplerate=OUTPUT_RATES[self.rate_combo.get_selected()],
             )
-            dialog.connect("response", lambda d, r: d.destroy())
-            dialog.show()
 
-        return False
+        self.watcher = FolderWatcher(
+            directory,
+            self.output_entry.get_text(),
+            make_job,
+            self.job_queue.submit,
+            extension=output_format.extension,
+            debounce_seconds=config["watch_debounce_seconds"],
+            poll_seconds=config["watch_poll_seconds"],
+        )
+        # Jobs the previous watcher of the same folder still has queued
+        self._retired_watchers = [
+            retired for retired in self._retired_watchers if not self.watcher.adopt(retired)
+        ]
+        self.watcher.start()
+
+    def _stop_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            if self.watcher.busy:
+                # Its queued jobs still run and report back to it.
+                self._retired_watchers.append(self.watcher)
+            self.watcher = None
+
+    def _watcher_of(self, job):
+        """The watcher that queued `job`, or None for jobs from the editor."""
+        for watcher in (self.watcher, *self._retired_watchers):
+            if watcher is not None and watcher.owns(job):
+                return watcher
+        return None
+
+    def _on_shutdown(self, app):
+        self._stop_watcher()
+        self._stop_server()
+        if self.engine.g2p_memo is not None:
+            self.engine.g2p_memo.save()
+
+    def _on_clear_cache_clicked(self, button):
+        if self.engine.cache is not None:
+            self.engine.cache.clear()
+        self._update_cache_stats()
+
+    def _on_save_config_clicked(self, button):
+        config = {
+            "torch_threads": self.threads_spin.get_value_as_int(),
+            "interop_threads": self.interop_spin.get_value_as_int(),
+            "inference_mode": self.inference_mode_check.get_active(),
+            "segment_chars": self.segment_spin.get_value_as_int(),
+            "output_format": self._selected_output_format(),
+            "output_sample_rate": OUTPUT_RATES[self.rate_combo.get_selected()],
+            "output_name_template": self.template_entry.get_text()
+            or settings.DEFAULT_CONFIG["output_name_template"],
+            "keep_partial_output": self.keep_partial_check.get_active(),
+            "server_enabled": self.server_check.get_active(),
+            "quantize_int8": self.quantize_check.get_active(),
+            "backend": "onnx" if self.onnx_check.get_active() else "torch",
+            "idle_unload_minutes": self.idle_unload_spin.get_value_as_int(),
+            "watch_enabled": self.watch_check.get_active(),
+            "watch_dir": self.watch_entry.get_text(),
+        }
+        self.engine.config.update(config)
+        settings.save_config(self.engine.config)
+        if self.engine.ready:
+            configure_torch(self.engine.config)
+            if config["server_enabled"] and self.server is None:
+                self._start_server()
+            elif not config["server_enabled"]:
+                self._stop_server()
+            # Restarted, so a new folder, output directory or format applies.
+            self._stop_watcher()
+            if config["watch_enabled"]:
+                self._start_watcher()
+
+    def _on_clear_queue_clicked(self, button):
+        for job_id in self.job_queue.clear_finished():
+            row = self.queue_rows.pop(job_id, None)
+            if row is not None:
+                self.queue_list_box.remove(row)
+
+    def _add_to_history(self, job):
+        """Records a finished job in the history database."""
+        self.history.add(
+            job.text,
+            job.voice,
+            job.language,
+            job.speed,
+            job.output_path,
+            duration=job.audio_seconds,
+            synthesis_seconds=job.finished_at - (job.started_at or job.submitted_at),
+            created_at=job.finished_at,
+        )
+        self.history_model.refresh()
 
-    def _add_to_history(self, full_text):
-        """Adds a new entry to the history list."""
-        # Create a shortened label for display
-        short_text = full_text.replace("\n", " ").strip()
-        if len(short_text) > 35:
-            short_text = short_text[:35] + "..."
+    def _on_history_search_changed(self, entry):
+        self.history_model.refresh(entry.get_text().strip())
 
+    def _on_history_item_setup(self, factory, list_item):
         label = Gtk.Label(
-            label=short_text, halign=Gtk.Align.START, margin_top=5, margin_bottom=5
+            halign=Gtk.Align.START,
+            margin_top=5,
+            margin_bottom=5,
+            ellipsize=Pango.EllipsizeMode.END,
         )
+        list_item.set_child(label)
 
-        row = Gtk.ListBoxRow()
-        row.set_child(label)
+    def _on_history_item_bind(self, factory, list_item):
+        item = list_item.get_item()
+        short_text = item.preview.replace("\n", " ").strip()
+        list_item.get_child().set_text(
+            f"{short_text} ({format_seconds(item.duration)})"
+        )
 
-        # Store the full original text within the row widget itself
-        row.full_text = full_text
+    def _on_history_item_activated(self, list_view, position):
+        """Loads a history entry, then replays or re-synthesizes it."""
+        item = self.history_model.get_item(position)
+        if item is None:
+            return
+        entry = self.history.get(item.entry_id)
+        if entry is None:
+            return
+        self.text_view.get_buffer().set_text(entry.text)
+        self.last_output_path = entry.output_path
 
-        self.history_list_box.insert(row, 0)
+        if os.path.isfile(entry.output_path):
+            if self.player is not None:
+                # Starts by itself once the first blocks are buffered.
+                self.player.play_file(entry.output_path)
+            return
 
-    def _on_history_row_activated(self, list_box, row):
-        """Callback for when a history item is clicked."""
-        if row and hasattr(row, "full_text"):
-            full_text = row.full_text
-            self.text_view.get_buffer().set_text(full_text)
+        # The audio file is gone: render it again with the stored settings.
+        if self.engine.ready:
+            self.job_queue.submit(
+                SynthesisJob(
+                    text=entry.text,
+                    voice=entry.voice,
+                    language=entry.language,
+                    output_path=entry.output_path,
+                    speed=entry.speed,
+                    stream_playback=self.player is not None,
+                )
+            )
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    argv = list(sys.argv)
+    if "--timing" in argv:
+        # Handled here; Gtk.Application would reject the unknown option.
+        argv.remove("--timing")
+        STARTUP.enabled = True
     app = XttsApp()
-    app.run(sys.argv)
+    app.run(argv)
 
 
 if __name__ == "__main__":
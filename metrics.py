@@ -0,0 +1,267 @@
+"""
+Lightweight structured instrumentation for the synthesis hot path.
+
+`METRICS.span(name)` times a stage (model load, pipeline build, G2P,
+inference, file write) and `METRICS.increment(name)` bumps a counter (jobs,
+cache hits, failures). Spans recorded while a job runs inside
+`METRICS.trace()` are also summed per stage for that job, which feeds the
+stage breakdown and rolling real-time factor shown in the GUI.
+
+Aggregates can be exported as Prometheus text (for a node_exporter textfile
+collector or the server's /metrics endpoint) and every finished job can be
+appended to a JSON-lines file; both are enabled through settings.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import settings
+
+log = logging.getLogger(__name__)
+
+# Jobs kept for the rolling real-time factor
+ROLLING_JOBS = 20
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    last: float = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per finished job to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export_job(self, record, metrics):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusTextfileExporter:
+    """Rewrites a Prometheus text file with the current aggregates."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export_job(self, record, metrics):
+        text = metrics.prometheus_text()
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {}
+        self.spans = {}
+        self.info = {}
+        self.recent_jobs = deque(maxlen=ROLLING_JOBS)
+        self.exporters = []
+
+    # --- Recording ---------------------------------------------------------
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        """Records a duration that was measured elsewhere."""
+        with self._lock:
+            self.spans.setdefault(name, SpanStats()).add(seconds)
+        totals = self._thread_totals()
+        totals[name] = totals.get(name, 0.0) + seconds
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            # A trace may be shared by the stage threads of one job.
+            with self._lock:
+                trace[name] = trace.get(name, 0.0) + seconds
+
+    def thread_total(self, name):
+        """Seconds spent in `name` on the calling thread so far."""
+        return self._thread_totals().get(name, 0.0)
+
+    def _thread_totals(self):
+        totals = getattr(self._local, "totals", None)
+        if totals is None:
+            totals = self._local.totals = {}
+        return totals
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_info(self, **labels):
+        """Records static facts such as the device or model revision."""
+        with self._lock:
+            self.info.update({key: str(value) for key, value in labels.items()})
+
+    @contextmanager
+    def trace(self, stages=None):
+        """
+        Collects the stage totals of everything the block runs on this thread.
+
+        Pass the dict of another thread's trace (see current_trace()) to
+        add this thread's spans to it.
+        """
+        previous = getattr(self._local, "trace", None)
+        stages = self._local.trace = {} if stages is None else stages
+        try:
+            yield stages
+        finally:
+            self._local.trace = previous
+
+    def current_trace(self):
+        """The stage totals collected on this thread, or None outside a trace."""
+        return getattr(self._local, "trace", None)
+
+    def record_job(self, stages, audio_seconds, elapsed, **fields):
+        """Records a finished job and passes it to the exporters."""
+        record = {
+            "time": time.time(),
+            "elapsed": round(elapsed, 4),
+            "audio_seconds": round(audio_seconds, 3),
+            "stages": {name: round(seconds, 4) for name, seconds in stages.items()},
+            "utilization": utilization(stages, elapsed),
+            **fields,
+        }
+        with self._lock:
+            self.recent_jobs.append(record)
+        for exporter in self.exporters:
+            try:
+                exporter.export_job(record, self)
+            except OSError as e:
+                log.warning("Metrics export to %s failed: %s", exporter.path, e)
+        return record
+
+    # --- Reading -----------------------------------------------------------
+
+    @property
+    def last_job(self):
+        with self._lock:
+            return self.recent_jobs[-1] if self.recent_jobs else None
+
+    def rolling_rtf(self):
+        """Processing seconds per audio second over the recent jobs."""
+        with self._lock:
+            return self._rolling_rtf_locked()
+
+    def _rolling_rtf_locked(self):
+        elapsed = sum(job["elapsed"] for job in self.recent_jobs)
+        audio = sum(job["audio_seconds"] for job in self.recent_jobs)
+        return round(elapsed / audio, 4) if audio else None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "spans": {
+                    name: {
+                        "count": stats.count,
+                        "total": round(stats.total, 4),
+                        "max": round(stats.max, 4),
+                        "last": round(stats.last, 4),
+                    }
+                    for name, stats in self.spans.items()
+                },
+                "info": dict(self.info),
+                "rolling_rtf": self._rolling_rtf_locked(),
+            }
+
+    def prometheus_text(self):
+        """Renders the aggregates in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot["info"]:
+            labels = ",".join(
+                f'{key}="{_escape(value)}"'
+                for key, value in sorted(snapshot["info"].items())
+            )
+            lines += ["# TYPE kokoro_info gauge", f"kokoro_info{{{labels}}} 1"]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines += [
+                f"# TYPE kokoro_{name}_total counter",
+                f"kokoro_{name}_total {value}",
+            ]
+        if snapshot["spans"]:
+            lines.append("# TYPE kokoro_span_seconds summary")
+            for name, stats in sorted(snapshot["spans"].items()):
+                lines.append(f'kokoro_span_seconds_sum{{span="{name}"}} {stats["total"]}')
+                lines.append(f'kokoro_span_seconds_count{{span="{name}"}} {stats["count"]}')
+            lines.append("# TYPE kokoro_span_seconds_max gauge")
+            for name, stats in sorted(snapshot["spans"].items()):
+                lines.append(f'kokoro_span_seconds_max{{span="{name}"}} {stats["max"]}')
+        if snapshot["rolling_rtf"] is not None:
+            lines += [
+                "# TYPE kokoro_rolling_rtf gauge",
+                f"kokoro_rolling_rtf {snapshot['rolling_rtf']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def utilization(stages, elapsed):
+    """
+    Fraction of the wall time each stage was busy.
+
+    With the staged renderer the stages overlap, so the fractions can add
+    up to more than 1; the busiest stage is the bottleneck.
+    """
+    if elapsed <= 0:
+        return {}
+    return {name: round(seconds / elapsed, 3) for name, seconds in stages.items()}
+
+
+def format_utilization(fractions):
+    return ", ".join(
+        f"{name} {fraction:.0%}"
+        for name, fraction in sorted(fractions.items(), key=lambda item: -item[1])
+    )
+
+
+def format_stages(stages):
+    """Formats a {stage: seconds} breakdown, slowest stage first."""
+    return ", ".join(
+        f"{name} {seconds:.2f}s"
+        for name, seconds in sorted(stages.items(), key=lambda item: -item[1])
+    )
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = Metrics()
+if settings.METRICS_JSONL_PATH:
+    METRICS.exporters.append(JsonLinesExporter(settings.METRICS_JSONL_PATH))
+if settings.METRICS_PROM_PATH:
+    METRICS.exporters.append(PrometheusTextfileExporter(settings.METRICS_PROM_PATH))
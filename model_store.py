@@ -0,0 +1,222 @@
+"""
+Offline-first on-disk store for the Kokoro config, weights and voice packs.
+
+Files live under `settings.MODEL_DIR/<repo>` and are recorded in a
+`manifest.json` with their size, mtime and sha256. When every required file
+is present and unchanged the store is resolved without any network access;
+missing files are copied from the local Hugging Face cache if possible and
+only downloaded as a last resort.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+
+import settings
+
+log = logging.getLogger(__name__)
+
+WEIGHT_FILES = {
+    "hexgrad/Kokoro-82M": "kokoro-v1_0.pth",
+    "hexgrad/Kokoro-82M-v1.1-zh": "kokoro-v1_1-zh.pth",
+}
+CONFIG_FILE = "config.json"
+MANIFEST_FILE = "manifest.json"
+
+# Voice pack names as published in the Kokoro repositories ("zf_001")
+VOICE_NAME_RE = re.compile(r"[A-Za-z0-9_]+")
+
+
+class ModelStoreError(Exception):
+    """Raised when a stored file is missing or fails its integrity check."""
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    def __init__(self, root=None, repo_id=settings.REPO_ID, voices=None):
+        self.repo_id = repo_id
+        self.root = os.path.join(
+            root or settings.MODEL_DIR, repo_id.replace("/", "--")
+        )
+        self.voices = list(voices if voices is not None else settings.DEFAULT_VOICES)
+        for voice in self.voices:
+            self.voice_path(voice)  # Validates the name
+        self._manifest_path = os.path.join(self.root, MANIFEST_FILE)
+        self._manifest = self._read_manifest()
+        self._lock = threading.Lock()
+
+    # --- Paths -------------------------------------------------------------
+
+    @property
+    def config_path(self):
+        return os.path.join(self.root, CONFIG_FILE)
+
+    @property
+    def weights_path(self):
+        return os.path.join(self.root, WEIGHT_FILES[self.repo_id])
+
+    def voice_path(self, voice):
+        # Names come from user input; "../x" must not leave the store.
+        if not VOICE_NAME_RE.fullmatch(voice):
+            raise ValueError(f"Invalid voice name: {voice!r}")
+        return os.path.join(self.root, "voices", f"{voice}.pt")
+
+    @property
+    def revision(self):
+        """Short content hash of the weights, used to tag derived data."""
+        entry = self._manifest.get(WEIGHT_FILES[self.repo_id])
+        return entry["sha256"][:16] if entry else ""
+
+    def required_files(self):
+        """Repository-relative names of every file the app needs."""
+        names = [CONFIG_FILE, WEIGHT_FILES[self.repo_id]]
+        names.extend(f"voices/{voice}.pt" for voice in self.voices)
+        return names
+
+    # --- Manifest ----------------------------------------------------------
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _record(self, name):
+        path = os.path.join(self.root, name)
+        stat = os.stat(path)
+        self._manifest[name] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256_file(path),
+        }
+
+    # --- Integrity ---------------------------------------------------------
+
+    def verify_file(self, name, full=False):
+        """
+        Returns True if the stored file matches its manifest entry.
+
+        By default the hash is only recomputed when the size or mtime changed
+        since it was recorded, which keeps startup at a couple of stat()
+        calls. `full=True` always re-hashes.
+        """
+        entry = self._manifest.get(name)
+        path = os.path.join(self.root, name)
+        if entry is None or not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        if stat.st_size != entry["size"]:
+            return False
+        if not full and stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        if sha256_file(path) != entry["sha256"]:
+            return False
+        # Same content with a new mtime (e.g. copied back from a backup).
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def missing_files(self, full=False):
+        return [name for name in self.required_files() if not self.verify_file(name, full)]
+
+    def is_complete(self, full=False):
+        return not self.missing_files(full)
+
+    # --- Population --------------------------------------------------------
+
+    def _fetch(self, name, allow_download):
+        """Copies a file from the Hugging Face cache, or downloads it."""
+        from huggingface_hub import hf_hub_download, try_to_load_from_cache
+
+        target = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        cached = try_to_load_from_cache(self.repo_id, name)
+        if isinstance(cached, str) and os.path.isfile(cached):
+            log.info("Importing %s from the Hugging Face cache", name)
+            shutil.copyfile(cached, target + ".part")
+        elif allow_download:
+            log.info("Downloading %s from %s", name, self.repo_id)
+            downloaded = hf_hub_download(repo_id=self.repo_id, filename=name)
+            shutil.copyfile(downloaded, target + ".part")
+        else:
+            raise ModelStoreError(f"{name} is not in the model store at {self.root}")
+        os.replace(target + ".part", target)
+
+    def ensure(self, allow_download=True, full=False):
+        """
+        Makes sure every required file is present and intact.
+
+        Returns without touching the network when the store is complete.
+        Files that are missing or fail verification are re-fetched; with
+        `allow_download=False` that raises ModelStoreError instead.
+        """
+        with self._lock:
+            missing = self.missing_files(full)
+            for name in missing:
+                self._fetch(name, allow_download)
+                self._record(name)
+            # Persist refreshed mtimes as well as new entries.
+            self._write_manifest()
+        return missing
+
+    def add_voice(self, voice, allow_download=True):
+        """
+        Adds a voice pack to the store, fetching it if needed.
+
+        The voice only becomes required once it was fetched, so a mistyped
+        name fails this call without breaking every later ensure().
+        """
+        self.voice_path(voice)  # Validates the name
+        name = f"voices/{voice}.pt"
+        with self._lock:
+            if not self.verify_file(name):
+                self._fetch(name, allow_download)
+                self._record(name)
+                self._write_manifest()
+            if voice not in self.voices:
+                self.voices.append(voice)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the local Kokoro model store.")
+    parser.add_argument("--root", default=None, help="store directory")
+    parser.add_argument("--verify", action="store_true", help="re-hash every file")
+    parser.add_argument("--offline", action="store_true", help="never download")
+    parser.add_argument("--voice", action="append", default=None, help="voice to keep")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    store = ModelStore(root=args.root, voices=args.voice)
+    try:
+        fetched = store.ensure(allow_download=not args.offline, full=args.verify)
+    except ModelStoreError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Model store at {store.root} is complete ({len(fetched)} files fetched).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Memory-mapped model weights and int8 dynamic quantization.
+
+KModel normally reads its `.pth` checkpoint into private memory, so every
+process (GUI, batch CLI, server, render farm workers) holds its own copy of
+the weights. `build_model()` instead converts the checkpoint once into a
+safetensors file next to it and maps that file read-only: the parameters
+point straight into the page cache, which the kernel shares between all
+processes that load the same file, and pages are only read when touched.
+
+`quantize_int8()` optionally replaces the Linear and LSTM layers with
+dynamically quantized int8 versions (CPU only), trading a little quality
+for speed and memory; `python -m benchmark --precision-compare` measures
+both.
+"""
+
+import io
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+def converted_path(store, extension):
+    """Path of a file derived from the store's current weights revision."""
+    stem = os.path.splitext(os.path.basename(store.weights_path))[0]
+    return os.path.join(store.root, f"{stem}-{store.revision or 'local'}{extension}")
+
+
+@contextmanager
+def creation_lock(path):
+    """
+    Serializes the processes that create `path` (render farm workers, the
+    GUI and the CLI starting at once) through a lock file next to it.
+    Callers re-check for `path` once they hold the lock.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # No flock() on Windows; concurrent creators still can't corrupt
+        # the file, they only duplicate the work.
+        yield
+        return
+    with open(path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def temp_path(path):
+    """A new, unique temporary file next to `path` for writing it atomically."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    return tmp_path
+
+
+def convert_checkpoint(torch, checkpoint_path, output_path):
+    """
+    Flattens a Kokoro checkpoint into one safetensors file.
+
+    The checkpoint maps each submodule ("bert", "decoder", ...) to its state
+    dict; keys become "bert.embeddings...". The "module." prefix left by
+    DataParallel training is dropped, as KModel does when loading.
+    """
+    from safetensors.torch import save_file
+
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
+    tensors = {}
+    for module_name, state_dict in checkpoint.items():
+        for key, tensor in state_dict.items():
+            if key.startswith("module."):
+                key = key[len("module.") :]
+            # safetensors refuses tensors that share memory.
+            tensors[f"{module_name}.{key}"] = tensor.contiguous().clone()
+    tmp_path = temp_path(output_path)
+    try:
+        save_file(
+            tensors, tmp_path, metadata={"source": os.path.basename(checkpoint_path)}
+        )
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    log.info("Converted %s to %s", checkpoint_path, output_path)
+    remove_stale_conversions(checkpoint_path, output_path)
+
+
+def remove_stale_conversions(checkpoint_path, output_path):
+    """Deletes files converted from earlier revisions of the checkpoint."""
+    stem = os.path.splitext(os.path.basename(checkpoint_path))[0]
+    extension = os.path.splitext(output_path)[1]
+    directory = os.path.dirname(output_path)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(f"{stem}-") and name.endswith(extension) and path != output_path:
+            os.remove(path)
+
+
+def _empty_checkpoint(torch):
+    """A checkpoint with no weights, so KModel only builds its modules."""
+    buffer = io.BytesIO()
+    torch.save({}, buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def build_model(torch, KModel, store, repo_id):
+    """
+    Builds a KModel whose parameters are mapped from a safetensors file.
+
+    Converts the checkpoint on first use. Returns None when safetensors is
+    not installed, so the caller can fall back to a regular load.
+    """
+    try:
+        from safetensors.torch import load_file
+    except ImportError:
+        log.warning("safetensors is not installed; loading weights into memory")
+        return None
+
+    path = converted_path(store, ".safetensors")
+    if not os.path.isfile(path):
+        with creation_lock(path):
+            # Another process may have converted it while this one waited.
+            if not os.path.isfile(path):
+                convert_checkpoint(torch, store.weights_path, path)
+    model = KModel(repo_id=repo_id, config=store.config_path, model=_empty_checkpoint(torch))
+    # Replace the freshly initialized parameters with views of the mapping.
+    result = model.load_state_dict(load_file(path), strict=False, assign=True)
+    if result.missing_keys:
+        raise RuntimeError(
+            f"{path} is missing {len(result.missing_keys)} weights, "
+            f"e.g. {result.missing_keys[0]}; delete it to convert again"
+        )
+    return model
+
+
+def quantize_int8(torch, model):
+    """Quantizes Linear and LSTM layers to int8 in place (CPU only)."""
+    # In place: a copy would pull every mapped weight into private memory.
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8, inplace=True
+    )
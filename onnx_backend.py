@@ -0,0 +1,136 @@
+"""
+Optional ONNX Runtime inference backend.
+
+With `"backend": "onnx"` the KModel is exported once to an ONNX file next
+to the weights in the model store (tagged with the weights revision, like
+the safetensors conversion) and every later load only opens an ONNX
+Runtime session on it, with full graph optimizations and its own thread
+settings. Phonemization still goes through kokoro's model-less pipelines;
+only model inference moves out of PyTorch.
+
+`python -m benchmark --backend-compare` checks the ONNX output against the
+torch backend and compares their speed.
+"""
+
+import json
+import logging
+import os
+
+from model_weights import (
+    converted_path,
+    creation_lock,
+    remove_stale_conversions,
+    temp_path,
+)
+
+log = logging.getLogger(__name__)
+
+# Opset with the STFT-free ops of KModel(disable_complex=True)
+OPSET_VERSION = 17
+
+
+def onnx_path(store):
+    return converted_path(store, ".onnx")
+
+
+def available():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_model(torch, KModel, store, repo_id, path):
+    """Exports the store's KModel to `path`, with dynamic token count."""
+
+    class Exportable(torch.nn.Module):
+        def __init__(self, kmodel):
+            super().__init__()
+            self.kmodel = kmodel
+
+        def forward(self, input_ids, ref_s, speed):
+            return self.kmodel.forward_with_tokens(input_ids, ref_s, speed)
+
+    # disable_complex swaps the complex-valued STFT for one ONNX can express.
+    kmodel = KModel(
+        repo_id=repo_id,
+        config=store.config_path,
+        model=store.weights_path,
+        disable_complex=True,
+    ).eval()
+    example = (
+        torch.LongTensor([[0, *range(1, 33), 0]]),
+        torch.zeros(1, 256),
+        torch.tensor([1.0]),
+    )
+    tmp_path = temp_path(path)
+    log.info("Exporting the model to %s (one-time)...", path)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                Exportable(kmodel),
+                example,
+                tmp_path,
+                input_names=["input_ids", "ref_s", "speed"],
+                output_names=["audio", "durations"],
+                dynamic_axes={
+                    "input_ids": {1: "tokens"},
+                    "audio": {0: "samples"},
+                    "durations": {0: "tokens"},
+                },
+                opset_version=OPSET_VERSION,
+                do_constant_folding=True,
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    remove_stale_conversions(store.weights_path, path)
+
+
+class OnnxModel:
+    """Runs an exported KModel with ONNX Runtime on the CPU."""
+
+    device = "cpu"
+
+    def __init__(self, path, config_path, threads=0):
+        import onnxruntime
+
+        with open(config_path, encoding="utf-8") as f:
+            self.vocab = json.load(f)["vocab"]
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+
+    def infer(self, phonemes, pack, speed):
+        """Like KPipeline.infer(), but returns the samples as a numpy array."""
+        import numpy as np
+
+        # Same tokenization as KModel.forward(): unknown symbols are dropped.
+        input_ids = [self.vocab[p] for p in phonemes if p in self.vocab]
+        audio, _ = self.session.run(
+            None,
+            {
+                "input_ids": np.array([[0, *input_ids, 0]], dtype=np.int64),
+                "ref_s": pack[len(phonemes) - 1].numpy().astype(np.float32),
+                "speed": np.array([speed], dtype=np.float32),
+            },
+        )
+        return audio.reshape(-1).astype(np.float32, copy=False)
+
+
+def load(torch, KModel, store, repo_id, threads=0):
+    """Returns an OnnxModel, exporting the model first if needed."""
+    path = onnx_path(store)
+    if not os.path.isfile(path):
+        with creation_lock(path):
+            # Another process may have exported it while this one waited.
+            if not os.path.isfile(path):
+                export_model(torch, KModel, store, repo_id, path)
+    return OnnxModel(path, store.config_path, threads=threads)
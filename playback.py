@@ -0,0 +1,271 @@
+"""
+In-app audio playback built on GStreamer.
+
+`StreamingPlayer` plays audio while it is still being synthesized: the
+synthesis thread feeds float32 chunks with `feed()`, and an `appsrc`
+element pulls them as the sink needs data, so playback starts as soon as
+the first segment is ready. Everything fed so far stays in memory, which
+makes seeking back a simple offset change. When synthesis falls behind
+real time the pipeline is paused until enough audio is buffered again,
+instead of letting the sink drop late buffers.
+"""
+
+import logging
+import threading
+
+import gi
+
+gi.require_version("Gst", "1.0")
+from gi.repository import GLib, Gst
+
+import settings
+
+log = logging.getLogger(__name__)
+
+# Audio pushed to the sink per need-data callback
+BLOCK_FRAMES = settings.SAMPLE_RATE // 10
+# Audio that must be buffered ahead before playback resumes after an underrun
+RESUME_FRAMES = settings.SAMPLE_RATE // 2
+
+
+class PlayerState:
+    STOPPED = "stopped"
+    PLAYING = "playing"
+    PAUSED = "paused"
+    BUFFERING = "buffering"
+    FINISHED = "finished"
+
+
+class StreamingPlayer:
+    def __init__(self, on_state_changed=None):
+        Gst.init(None)
+        self._on_state_changed = on_state_changed
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._chunk_starts = []
+        self._total_frames = 0
+        self._read_frame = 0
+        self._complete = False
+        self._starved = False
+        self.state = PlayerState.STOPPED
+
+        self._pipeline = Gst.parse_launch(
+            "appsrc name=src format=time stream-type=seekable ! "
+            "audioconvert ! audioresample ! autoaudiosink"
+        )
+        self._src = self._pipeline.get_by_name("src")
+        self._src.set_property(
+            "caps",
+            Gst.Caps.from_string(
+                f"audio/x-raw,format=F32LE,layout=interleaved,"
+                f"rate={settings.SAMPLE_RATE},channels=1"
+            ),
+        )
+        self._src.connect("need-data", self._on_need_data)
+        self._src.connect("seek-data", self._on_seek_data)
+
+        bus = self._pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message::eos", self._on_eos)
+        bus.connect("message::error", self._on_error)
+
+    # --- Feeding -----------------------------------------------------------
+
+    def start_stream(self):
+        """Discards the previous stream and starts playing a new one."""
+        self._pipeline.set_state(Gst.State.NULL)
+        with self._lock:
+            self._chunks = []
+            self._chunk_starts = []
+            self._total_frames = 0
+            self._read_frame = 0
+            self._complete = False
+            self._starved = True
+        # Stays paused until the first RESUME_FRAMES have arrived.
+        self._pipeline.set_state(Gst.State.PAUSED)
+        self._set_state(PlayerState.BUFFERING)
+
+    def feed(self, samples):
+        """Appends synthesized samples. Safe to call from any thread."""
+        samples = samples.astype("float32", copy=False)
+        with self._lock:
+            self._chunk_starts.append(self._total_frames)
+            self._chunks.append(samples)
+            self._total_frames += len(samples)
+            resume = (
+                self._starved
+                and self._total_frames - self._read_frame >= RESUME_FRAMES
+            )
+            if resume:
+                self._starved = False
+        if resume:
+            GLib.idle_add(self._resume_after_underrun)
+
+    def finish_stream(self):
+        """Marks the stream complete so playback ends at the last sample."""
+        with self._lock:
+            self._complete = True
+            resume = self._starved
+            self._starved = False
+        if resume:
+            GLib.idle_add(self._resume_after_underrun)
+
+    def play_file(self, path):
+        """Plays a finished audio file, reading it on a background thread."""
+        import soundfile
+
+        from audio_output import StreamingResampler
+
+        def read():
+            try:
+                rate = soundfile.info(path).samplerate
+                resampler = (
+                    StreamingResampler(rate, settings.SAMPLE_RATE)
+                    if rate != settings.SAMPLE_RATE
+                    else None
+                )
+                for block in soundfile.blocks(
+                    path, blocksize=rate, dtype="float32", always_2d=True
+                ):
+                    # Mix down in case the file is not mono.
+                    block = block.mean(axis=1)
+                    self.feed(resampler.process(block) if resampler else block)
+                if resampler is not None:
+                    self.feed(resampler.flush())
+            finally:
+                self.finish_stream()
+
+        self.start_stream()
+        threading.Thread(target=read, daemon=True).start()
+
+    # --- Controls ----------------------------------------------------------
+
+    def play(self):
+        if self.state in (PlayerState.PAUSED, PlayerState.FINISHED):
+            if self.state == PlayerState.FINISHED:
+                self.seek(0)
+            else:
+                # A need-data may have gone unanswered while paused.
+                self._push_next()
+            self._pipeline.set_state(Gst.State.PLAYING)
+            self._set_state(PlayerState.PLAYING)
+
+    def pause(self):
+        if self.state in (PlayerState.PLAYING, PlayerState.BUFFERING):
+            with self._lock:
+                self._starved = False
+            self._pipeline.set_state(Gst.State.PAUSED)
+            self._set_state(PlayerState.PAUSED)
+
+    def stop(self):
+        self._pipeline.set_state(Gst.State.NULL)
+        self._set_state(PlayerState.STOPPED)
+
+    def seek(self, seconds):
+        """Seeks within the audio produced so far."""
+        seconds = max(0.0, min(seconds, self.available_seconds()))
+        self._pipeline.seek_simple(
+            Gst.Format.TIME,
+            Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+            int(seconds * Gst.SECOND),
+        )
+
+    def position_seconds(self):
+        ok, position = self._pipeline.query_position(Gst.Format.TIME)
+        return position / Gst.SECOND if ok else 0.0
+
+    def available_seconds(self):
+        with self._lock:
+            return self._total_frames / settings.SAMPLE_RATE
+
+    @property
+    def complete(self):
+        with self._lock:
+            return self._complete
+
+    # --- appsrc callbacks (streaming thread) -------------------------------
+
+    def _read_block(self):
+        """Copies up to BLOCK_FRAMES samples starting at the read position."""
+        import bisect
+
+        import numpy as np
+
+        start = self._read_frame
+        end = min(start + BLOCK_FRAMES, self._total_frames)
+        parts = []
+        index = bisect.bisect_right(self._chunk_starts, start) - 1
+        position = start
+        while position < end:
+            chunk = self._chunks[index]
+            offset = position - self._chunk_starts[index]
+            take = min(len(chunk) - offset, end - position)
+            parts.append(chunk[offset : offset + take])
+            position += take
+            index += 1
+        self._read_frame = end
+        return start, np.concatenate(parts)
+
+    def _on_need_data(self, src, length):
+        self._push_next()
+
+    def _push_next(self):
+        """Pushes the next block to appsrc, ends the stream, or flags a stall."""
+        src = self._src
+        with self._lock:
+            if self._read_frame < self._total_frames:
+                start, block = self._read_block()
+            elif self._complete:
+                block = None
+            else:
+                # Synthesis is slower than real time: wait for more audio.
+                self._starved = True
+                GLib.idle_add(self._pause_for_underrun)
+                return
+
+        if block is None:
+            src.emit("end-of-stream")
+            return
+
+        buffer = Gst.Buffer.new_wrapped(block.tobytes())
+        buffer.pts = start * Gst.SECOND // settings.SAMPLE_RATE
+        buffer.duration = len(block) * Gst.SECOND // settings.SAMPLE_RATE
+        src.emit("push-buffer", buffer)
+
+    def _on_seek_data(self, src, offset):
+        with self._lock:
+            frame = offset * settings.SAMPLE_RATE // Gst.SECOND
+            self._read_frame = max(0, min(frame, self._total_frames))
+        return True
+
+    # --- Main-thread state handling ----------------------------------------
+
+    def _pause_for_underrun(self):
+        with self._lock:
+            starved = self._starved
+        if starved and self.state == PlayerState.PLAYING:
+            self._pipeline.set_state(Gst.State.PAUSED)
+            self._set_state(PlayerState.BUFFERING)
+        return False
+
+    def _resume_after_underrun(self):
+        if self.state == PlayerState.BUFFERING:
+            # appsrc won't ask again after a need-data we left unanswered.
+            self._push_next()
+            self._pipeline.set_state(Gst.State.PLAYING)
+            self._set_state(PlayerState.PLAYING)
+        return False
+
+    def _on_eos(self, bus, message):
+        self._pipeline.set_state(Gst.State.PAUSED)
+        self._set_state(PlayerState.FINISHED)
+
+    def _on_error(self, bus, message):
+        error, debug = message.parse_error()
+        log.error("Playback error: %s (%s)", error.message, debug)
+        self.stop()
+
+    def _set_state(self, state):
+        self.state = state
+        if self._on_state_changed is not None:
+            self._on_state_changed(state)
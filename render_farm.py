@@ -0,0 +1,332 @@
+"""
+Multi-process render farm for large batch jobs.
+
+Each worker process loads its own TTSEngine once and renders the segments
+the parent sends to its task queue; the parent splits jobs into segments,
+reassembles the results in order and writes the output files. The parent
+records which worker every segment was sent to, so when a worker dies, the
+segments it had not finished are handed to other workers.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import settings
+from audio_output import AudioWriter
+from jobs import JobStatus
+
+log = logging.getLogger(__name__)
+
+# Per-segment retries after a worker crash before the job is failed
+MAX_SEGMENT_RETRIES = 2
+
+# Segments sent to a worker ahead of its results, so it never waits on the
+# parent between segments
+SEGMENTS_PER_WORKER = 2
+
+
+def _worker_main(worker_id, config, device, task_queue, result_queue):
+    """Entry point of a worker process."""
+    # Imported in the child: spawned workers start from a fresh interpreter.
+    from tts_engine import TTSEngine
+
+    try:
+        engine = TTSEngine(device=device, config=config)
+        engine.load()
+    except Exception as e:
+        result_queue.put(("fatal", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+    result_queue.put(("ready", worker_id, None, None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            if engine.g2p_memo is not None:
+                engine.g2p_memo.save()
+            break
+        task_id, text, voice, language, speed, use_cache = task
+        try:
+            wav = engine.render_segment(text, voice, speed, language, use_cache=use_cache)
+            result_queue.put(("done", worker_id, task_id, wav))
+        except Exception as e:
+            log.exception("Render worker %d failed on segment %d", worker_id, task_id)
+            result_queue.put(("error", worker_id, task_id, f"{type(e).__name__}: {e}"))
+
+
+@dataclass
+class _JobState:
+    job: object
+    segments: list
+    next_index: int = 0
+    buffered: dict = field(default_factory=dict)
+    out_file: object = None
+    frames: int = 0
+    failed: bool = False
+
+
+@dataclass
+class FarmStats:
+    jobs_done: int = 0
+    jobs_failed: int = 0
+    segments: int = 0
+    audio_seconds: float = 0.0
+    elapsed: float = 0.0
+    worker_restarts: int = 0
+    segments_per_worker: dict = field(default_factory=dict)
+
+    @property
+    def real_time_factor(self):
+        return self.audio_seconds / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        per_worker = ", ".join(
+            f"w{worker_id}={count}"
+            for worker_id, count in sorted(self.segments_per_worker.items())
+        )
+        return (
+            f"{self.jobs_done} jobs ({self.jobs_failed} failed), {self.segments} segments, "
+            f"{self.audio_seconds:.1f}s of audio in {self.elapsed:.1f}s "
+            f"({self.real_time_factor:.2f}x real time, "
+            f"{self.segments / self.elapsed if self.elapsed else 0:.1f} segments/s), "
+            f"{self.worker_restarts} worker restarts [{per_worker}]"
+        )
+
+
+class RenderFarm:
+    def __init__(
+        self, processes, config=None, device="cpu", max_restarts=None, use_cache=True
+    ):
+        self.processes = max(1, processes)
+        self.device = device
+        self.use_cache = use_cache
+        self.config = dict(config or settings.CONFIG)
+        if not self.config.get("torch_threads"):
+            # Split the cores between workers instead of oversubscribing them.
+            self.config["torch_threads"] = max(1, (os.cpu_count() or 1) // self.processes)
+        self.max_restarts = (
+            max_restarts if max_restarts is not None else self.processes * 3
+        )
+        self._ctx = multiprocessing.get_context("spawn")
+        self._result_queue = self._ctx.Queue()
+        # worker id -> (process, its own task queue)
+        self._workers = {}
+        self._next_worker_id = 0
+
+    def _spawn_worker(self):
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        task_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker_id,
+                self.config,
+                self.device,
+                task_queue,
+                self._result_queue,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self._workers[worker_id] = (process, task_queue)
+        return worker_id
+
+    def run(self, jobs, on_job_done=None):
+        """
+        Renders every job and returns a FarmStats.
+
+        Jobs are consumed lazily, and each worker gets at most
+        SEGMENTS_PER_WORKER segments at a time, so arbitrarily long job
+        lists stream through in bounded memory.
+        """
+        from tts_engine import split_segments
+
+        stats = FarmStats()
+        start = time.perf_counter()
+        for _ in range(self.processes):
+            self._spawn_worker()
+
+        jobs = iter(jobs)
+        jobs_exhausted = False
+        states = {}
+        next_job_key = 0
+        # task id -> (job key, segment index, task) until it is done or failed
+        tasks = {}
+        retries = {}
+        # Tasks not sent to a worker yet; crashed workers' tasks go first.
+        backlog = deque()
+        # worker id -> ids of the tasks sent to it and not reported back
+        assigned = {}
+        next_task_id = 0
+        max_in_flight = self.processes * 4
+        segment_chars = self.config.get("segment_chars", 0)
+
+        def open_output(state):
+            os.makedirs(os.path.dirname(state.job.output_path) or ".", exist_ok=True)
+            state.out_file = AudioWriter(
+                state.job.output_path,
+                samplerate=self.config.get("output_sample_rate", 0),
+            )
+            return state.out_file
+
+        def finish(state):
+            job = state.job
+            if state.out_file is None and not state.failed:
+                # Text without any speakable segment still gets its file.
+                open_output(state)
+            if state.out_file is not None:
+                state.out_file.close()
+            if state.failed:
+                job.status = JobStatus.FAILED
+                stats.jobs_failed += 1
+                if os.path.exists(job.output_path):
+                    os.remove(job.output_path)
+            else:
+                job.status = JobStatus.DONE
+                job.audio_seconds = state.frames / settings.SAMPLE_RATE
+                stats.jobs_done += 1
+                stats.audio_seconds += job.audio_seconds
+            job.finished_at = time.time()
+            if on_job_done is not None:
+                on_job_done(job)
+
+        def flush(job_key):
+            """Writes the contiguous run of finished segments of a job."""
+            state = states[job_key]
+            while state.next_index in state.buffered:
+                wav = state.buffered.pop(state.next_index)
+                out_file = state.out_file
+                if out_file is None:
+                    out_file = open_output(state)
+                if wav is not None:
+                    out_file.write(wav)
+                    state.frames += len(wav)
+                state.next_index += 1
+            if state.next_index == len(state.segments):
+                del states[job_key]
+                finish(state)
+
+        def dispatch():
+            for worker_id, (_, task_queue) in self._workers.items():
+                sent = assigned.setdefault(worker_id, set())
+                while backlog and len(sent) < SEGMENTS_PER_WORKER:
+                    task_id = backlog.popleft()
+                    if task_id not in tasks:
+                        continue
+                    task_queue.put(tasks[task_id][2])
+                    sent.add(task_id)
+
+        def fail_task(task_id, message):
+            job_key, segment_index = tasks.pop(task_id)[:2]
+            state = states[job_key]
+            state.failed = True
+            state.job.error = message
+            # Keep ordering intact; the failed job's file is removed at the end.
+            state.buffered[segment_index] = None
+            flush(job_key)
+
+        try:
+            while True:
+                # Keep the workers fed without reading the whole input.
+                while not jobs_exhausted and len(backlog) < max_in_flight:
+                    try:
+                        job = next(jobs)
+                    except StopIteration:
+                        jobs_exhausted = True
+                        break
+                    job.status = JobStatus.RUNNING
+                    job_key = next_job_key
+                    next_job_key += 1
+                    segments = split_segments(job.text, segment_chars)
+                    states[job_key] = _JobState(job=job, segments=segments)
+                    if not segments:
+                        flush(job_key)
+                        continue
+                    for segment_index, segment in enumerate(segments):
+                        task = (
+                            next_task_id,
+                            segment,
+                            job.voice,
+                            job.language,
+                            job.speed,
+                            self.use_cache,
+                        )
+                        tasks[next_task_id] = (job_key, segment_index, task)
+                        backlog.append(next_task_id)
+                        next_task_id += 1
+
+                if jobs_exhausted and not tasks:
+                    break
+                dispatch()
+
+                try:
+                    kind, worker_id, task_id, payload = self._result_queue.get(timeout=0.5)
+                except queue.Empty:
+                    kind = None
+
+                if kind in ("done", "error"):
+                    assigned.get(worker_id, set()).discard(task_id)
+                if kind == "done":
+                    if task_id in tasks:
+                        job_key, segment_index, _ = tasks.pop(task_id)
+                        stats.segments += 1
+                        stats.segments_per_worker[worker_id] = (
+                            stats.segments_per_worker.get(worker_id, 0) + 1
+                        )
+                        states[job_key].buffered[segment_index] = payload
+                        flush(job_key)
+                elif kind == "error":
+                    if task_id in tasks:
+                        fail_task(task_id, payload)
+                elif kind == "fatal":
+                    log.error("Render worker %d failed to start: %s", worker_id, payload)
+
+                # Replace dead workers and hand their segments to others.
+                for worker_id, (process, _) in list(self._workers.items()):
+                    if process.is_alive():
+                        continue
+                    del self._workers[worker_id]
+                    # Finished segments whose results are still in the
+                    # queue are simply rendered twice; the duplicate is
+                    # ignored.
+                    for lost_task in sorted(assigned.pop(worker_id, ()), reverse=True):
+                        if lost_task not in tasks:
+                            continue
+                        retries[lost_task] = retries.get(lost_task, 0) + 1
+                        if retries[lost_task] > MAX_SEGMENT_RETRIES:
+                            fail_task(lost_task, "render worker crashed repeatedly")
+                        else:
+                            backlog.appendleft(lost_task)
+                    if stats.worker_restarts >= self.max_restarts:
+                        raise RuntimeError(
+                            f"Render workers crashed {stats.worker_restarts} times, giving up"
+                        )
+                    stats.worker_restarts += 1
+                    log.warning(
+                        "Render worker %d exited with code %s, starting a replacement",
+                        worker_id,
+                        process.exitcode,
+                    )
+                    self._spawn_worker()
+        finally:
+            self.shutdown()
+            for state in states.values():
+                if state.out_file is not None:
+                    state.out_file.close()
+
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    def shutdown(self):
+        for _, task_queue in self._workers.values():
+            task_queue.put(None)
+        for process, _ in self._workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._workers.clear()
@@ -0,0 +1,89 @@
+"""
+Per-output record of which segment produced which samples.
+
+Next to every rendered file `<output>.segments.json` lists the hash, start
+frame and length of each segment, together with the voice, language, speed
+and model revision it was rendered with. When a slightly edited text is
+rendered again with that file as its base, unchanged segments are copied
+from the old audio at their recorded offsets and only the edited ones go
+through the model.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+
+import settings
+from result_cache import normalize_text
+from voices import format_voice_spec, parse_voice_spec
+
+MANIFEST_SUFFIX = ".segments.json"
+
+
+def segment_hash(segment):
+    return hashlib.sha256(normalize_text(segment).encode("utf-8")).hexdigest()[:32]
+
+
+def manifest_path(output_path):
+    return output_path + MANIFEST_SUFFIX
+
+
+@dataclass
+class RenderManifest:
+    voice: str
+    language: str
+    speed: float
+    revision: str
+    sample_rate: int = settings.SAMPLE_RATE
+    # (hash, start_frame, frames) for each segment, in output order
+    segments: list = field(default_factory=list)
+
+    def __post_init__(self):
+        self.voice = format_voice_spec(parse_voice_spec(self.voice))
+        self.speed = round(float(self.speed), 4)
+
+    def add(self, segment, start, frames):
+        self.segments.append((segment_hash(segment), start, frames))
+
+    def compatible(self, voice, language, speed, revision):
+        """True if audio from this render can be reused for the given settings."""
+        return (
+            self.voice == format_voice_spec(parse_voice_spec(voice))
+            and self.language == language
+            and self.speed == round(float(speed), 4)
+            and self.revision == revision
+            and self.sample_rate == settings.SAMPLE_RATE
+        )
+
+    def spans(self):
+        """Maps each segment hash to the (start_frame, frames) it occupies."""
+        return {digest: (start, frames) for digest, start, frames in self.segments}
+
+    @classmethod
+    def load(cls, output_path):
+        """Returns the manifest of `output_path`, or None if it has none."""
+        try:
+            with open(manifest_path(output_path), encoding="utf-8") as f:
+                data = json.load(f)
+            data["segments"] = [tuple(entry) for entry in data["segments"]]
+            return cls(**data)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, output_path):
+        path = manifest_path(output_path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "voice": self.voice,
+                    "language": self.language,
+                    "speed": self.speed,
+                    "revision": self.revision,
+                    "sample_rate": self.sample_rate,
+                    "segments": self.segments,
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
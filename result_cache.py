@@ -0,0 +1,264 @@
+"""
+Content-addressed cache of synthesized audio.
+
+Entries are keyed by a hash of the normalized text, the voice spec, the
+language, the speed and the model revision. Audio is cached per segment, so
+editing one paragraph only re-renders that paragraph, and per finished
+output file, so re-generating an identical job only copies the stored
+file. The cache is capped in size and evicts the least recently
+used entries first; recency is tracked through file mtimes, so it survives
+restarts without a separate index.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unicodedata
+
+import settings
+from metrics import METRICS
+from voices import format_voice_spec, parse_voice_spec
+
+
+def normalize_text(text):
+    """Normalizes text so trivially different inputs share a cache entry."""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+class ResultCache:
+    SEGMENT_SUFFIX = ".npy"
+
+    def __init__(
+        self,
+        root=settings.RESULT_CACHE_DIR,
+        max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+        revision="",
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.revision = revision
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def key(self, text, voice, language, speed, kind="segment", variant=""):
+        """
+        Hashes everything that influences the rendered audio.
+
+        `variant` distinguishes encodings of the same audio, such as the
+        output sample rate.
+        """
+        payload = json.dumps(
+            [
+                kind,
+                variant,
+                normalize_text(text),
+                format_voice_spec(parse_voice_spec(voice)),
+                language,
+                round(float(speed), 4),
+                self.revision,
+            ],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        METRICS.increment("cache_hits" if hit else "cache_misses")
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    # --- Segments ----------------------------------------------------------
+
+    def get_segment(self, key):
+        """Returns the cached float32 samples for a segment, or None."""
+        import numpy as np
+
+        path = self._path(key, self.SEGMENT_SUFFIX)
+        if not self._touch(path):
+            self._record(False)
+            return None
+        try:
+            samples = np.load(path)
+        except (OSError, ValueError):
+            # Truncated or corrupt entry: drop it and render again.
+            self._remove(path)
+            self._record(False)
+            return None
+        self._record(True)
+        return samples
+
+    def put_segment(self, key, samples):
+        import numpy as np
+
+        path = self._path(key, self.SEGMENT_SUFFIX)
+        fd, tmp_path = self._temp_file(path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(samples, dtype=np.float32))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._commit(tmp_path, path)
+
+    # --- Whole outputs -----------------------------------------------------
+
+    def fetch_output(self, key, output_path, count=True):
+        """
+        Places a cached output file at `output_path`. Returns True on a hit.
+
+        Files next to an output, such as its segment manifest, are stored
+        under the same key with their own suffix and fetched with
+        `count=False`, so they don't count as lookups.
+
+        The file is always copied: writers truncate and rewrite output files
+        in place, which would corrupt a hard-linked cache entry.
+        """
+        suffix = os.path.splitext(output_path)[1]
+        path = self._path(key, suffix)
+        if not self._touch(path):
+            if count:
+                self._record(False)
+            return False
+        try:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            # Evicted between the touch and the copy.
+            if count:
+                self._record(False)
+            return False
+        if count:
+            self._record(True)
+        return True
+
+    def put_output(self, key, output_path):
+        path = self._path(key, os.path.splitext(output_path)[1])
+        fd, tmp_path = self._temp_file(path)
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, tmp_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._commit(tmp_path, path)
+
+    # --- Size management ---------------------------------------------------
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    @staticmethod
+    def _temp_file(path):
+        """
+        A new temporary file next to `path`. Unique per writer: threads,
+        render workers and the GUI may store the same entry at once.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+
+    def _commit(self, tmp_path, path):
+        try:
+            size = os.path.getsize(tmp_path)
+        except FileNotFoundError:
+            # Swept away by clear(); nothing to store.
+            return
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            try:
+                os.replace(tmp_path, path)
+            except FileNotFoundError:
+                # The shard directory was cleared meanwhile. Entries are
+                # content-addressed, so losing this write only costs a
+                # later re-render.
+                return
+            if self._total_bytes is None:
+                self._total_bytes = sum(entry[1] for entry in self._entries())
+            else:
+                self._total_bytes += size - previous
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits its cap."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(entry[1] for entry in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._total_bytes = total
+
+    def clear(self):
+        with self._lock:
+            if os.path.isdir(self.root):
+                shutil.rmtree(self.root)
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def size_bytes(self):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(entry[1] for entry in self._entries())
+            return self._total_bytes
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "size_bytes": self.size_bytes(),
+            "max_bytes": self.max_bytes,
+        }
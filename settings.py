@@ -1,4 +1,172 @@
+import json
+import os
+
+# Hugging Face repository of the Kokoro model
+REPO_ID = "hexgrad/Kokoro-82M-v1.1-zh"
+
+# Mirror endpoint for Chinese users to download models
+HF_ENDPOINT = "https://hf-mirror.com"
+
+# Local wheel directory the dependency installer tries before the network,
+# e.g. on a share filled once with `python -m tts_installer --download DIR`
+WHEELHOUSE_DIR = os.environ.get(
+    "KOKORO_GTK_WHEELHOUSE",
+    os.path.join(
+        os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")),
+        "kokoro-gtk",
+        "wheelhouse",
+    ),
+)
+
+# Offline-first model store holding the config, weights and voice packs
+MODEL_DIR = os.environ.get(
+    "KOKORO_GTK_MODEL_DIR",
+    os.path.join(
+        os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")),
+        "kokoro-gtk",
+        "models",
+    ),
+)
+
+# Never reach the network for model files (air-gapped machines)
+OFFLINE = os.environ.get("KOKORO_GTK_OFFLINE") == "1"
+
+# Voices kept in the model store
+DEFAULT_VOICES = ["zf_001", "zf_002"]
+
+# Content-addressed cache of synthesized segments and outputs
+RESULT_CACHE_ENABLED = os.environ.get("KOKORO_GTK_RESULT_CACHE", "1") == "1"
+RESULT_CACHE_DIR = os.environ.get(
+    "KOKORO_GTK_CACHE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "kokoro-gtk",
+        "results",
+    ),
+)
+RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# SQLite database holding the generation history
+HISTORY_DB = os.environ.get(
+    "KOKORO_GTK_HISTORY_DB",
+    os.path.join(
+        os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")),
+        "kokoro-gtk",
+        "history.sqlite3",
+    ),
+)
+
+# In-memory LRU of G2P results for recurring terms and sentences, saved
+# between sessions unless KOKORO_GTK_G2P_MEMO_PERSIST=0
+G2P_MEMO_ENABLED = os.environ.get("KOKORO_GTK_G2P_MEMO", "1") == "1"
+G2P_MEMO_SIZE = 50000
+G2P_MEMO_PATH = (
+    os.path.join(os.path.dirname(RESULT_CACHE_DIR), "g2p_memo.json")
+    if os.environ.get("KOKORO_GTK_G2P_MEMO_PERSIST", "1") == "1"
+    else ""
+)
+
+# Optional metrics exports: one JSON line per finished job, and a
+# Prometheus text file (e.g. for node_exporter's textfile collector)
+METRICS_JSONL_PATH = os.environ.get("KOKORO_GTK_METRICS_JSONL", "")
+METRICS_PROM_PATH = os.environ.get("KOKORO_GTK_METRICS_PROM", "")
+
+# Local HTTP synthesis server (tts_server.py), bound to localhost only
+SERVER_HOST = os.environ.get("KOKORO_GTK_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("KOKORO_GTK_SERVER_PORT", "8767"))
+
+# Number of voice tensors (including blends) kept in memory
+VOICE_CACHE_SIZE = 16
+
 LANG_ID = {
     "中文 (zh-cn)": "zh-cn",
     "English (en)": "en"
 }
+
+# Kokoro produces mono audio at a fixed sample rate
+SAMPLE_RATE = 24000
+
+# Default speaking speed passed to the pipeline
+DEFAULT_SPEED = 0.8 * 1.1
+
+# User-editable performance settings, stored as JSON
+CONFIG_PATH = os.environ.get(
+    "KOKORO_GTK_CONFIG",
+    os.path.join(
+        os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config")),
+        "kokoro-gtk",
+        "config.json",
+    ),
+)
+
+DEFAULT_CONFIG = {
+    # torch intra-op threads; 0 keeps torch's default (one per core)
+    "torch_threads": 0,
+    # torch inter-op threads; 0 keeps the default. Only applied at startup.
+    "interop_threads": 0,
+    # Run inference under torch.inference_mode()
+    "inference_mode": True,
+    # Pack sentences of a paragraph into segments of up to this many
+    # characters so each model call does more work; 0 = one sentence each
+    "segment_chars": 0,
+    # Output encoding: wav, flac, opus or mp3 (see audio_output.FORMATS)
+    "output_format": "wav",
+    # Resample outputs to this rate; 0 keeps the model's 24 kHz
+    "output_sample_rate": 0,
+    # Output file name; fields: date, time, timestamp, voice, language, id, text
+    "output_name_template": "{date}-{time}-{voice}",
+    # Map the weights from a safetensors file shared through the page cache
+    # instead of reading them into private memory
+    "weights_mmap": True,
+    # Dynamic int8 quantization of the Linear/LSTM layers (CPU only)
+    "quantize_int8": False,
+    # Phonemize ahead on a separate thread while the model runs, and encode
+    # on a third; pipeline_prefetch is how many segments G2P may run ahead
+    "staged_pipeline": True,
+    "pipeline_prefetch": 4,
+    # Inference backend: "torch", or "onnx" to run an exported copy of the
+    # model with ONNX Runtime (CPU, needs the onnxruntime package)
+    "backend": "torch",
+    # ONNX Runtime intra-op threads; 0 keeps its default
+    "onnx_threads": 0,
+    # Run a short dummy synthesis after loading, before the first job
+    "warm_up": True,
+    # Release the model after this many idle minutes; the next job reloads
+    # it. 0 keeps it loaded.
+    "idle_unload_minutes": 0,
+    # Keep the audio produced so far when a running job is stopped
+    "keep_partial_output": False,
+    # Watch a folder and synthesize new or changed .txt files into the
+    # output directory; poll seconds > 0 also rescans it periodically, for
+    # network shares whose changes raise no file events
+    "watch_enabled": False,
+    "watch_dir": "",
+    "watch_debounce_seconds": 2.0,
+    "watch_poll_seconds": 0,
+    # Start the local HTTP synthesis server together with the desktop app
+    "server_enabled": False,
+    # Requests the server synthesizes at once, and how many may wait
+    "server_workers": 1,
+    "server_max_pending": 8,
+}
+
+
+def load_config(path=CONFIG_PATH):
+    """Returns DEFAULT_CONFIG overlaid with the values saved at `path`."""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return config
+    config.update({key: saved[key] for key in DEFAULT_CONFIG if key in saved})
+    return config
+
+
+def save_config(config, path=CONFIG_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+
+
+CONFIG = load_config()
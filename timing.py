@@ -0,0 +1,53 @@
+"""
+Startup timing report.
+
+Records how long each heavy import took and when the main milestones
+(first window, model ready) were reached, relative to process start. The
+report is printed when enabled with `--timing` or `KOKORO_GTK_TIMING=1`.
+"""
+
+import importlib
+import os
+import threading
+import time
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.enabled = os.environ.get("KOKORO_GTK_TIMING") == "1"
+        self.imports = []
+        self.marks = []
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def import_module(self, name):
+        """Imports a module by name and records how long the import took."""
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        with self._lock:
+            self.imports.append((name, time.perf_counter() - started))
+        return module
+
+    def mark(self, name):
+        """Records that a startup milestone has been reached."""
+        with self._lock:
+            self.marks.append((name, self.elapsed()))
+
+    def report(self):
+        lines = ["Startup timing:"]
+        with self._lock:
+            for name, seconds in self.imports:
+                lines.append(f"  import {name:<24} {seconds * 1000:8.1f} ms")
+            for name, seconds in self.marks:
+                lines.append(f"  {name:<31} {seconds * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+    def print_report(self):
+        if self.enabled:
+            print(self.report())
+
+
+STARTUP = StartupTimer()
@@ -0,0 +1,522 @@
+"""
+Headless batch synthesis.
+
+Usage:
+    python -m tts_cli INPUT -o OUTPUT_DIR [--voice zf_001] [--workers 2]
+
+INPUT can be:
+  * a .txt file - every non-empty line becomes its own audio file,
+  * a directory - every .txt file inside it becomes one audio file,
+  * a .jsonl manifest - one {"text": ..., "voice": ..., "speed": ...,
+    "output": ...} object per line; only "text" is required.
+
+Files are written as WAV unless --format selects FLAC, Opus or MP3.
+
+With --watch, INPUT is a directory that is watched until interrupted: new
+or changed .txt files are synthesized into OUTPUT_DIR, mirroring their
+relative paths (see watch_folder.py).
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import settings
+from audio_output import FORMATS, OUTPUT_RATES, available_formats
+from jobs import JobQueue, JobStatus, SynthesisJob, record_job_metrics
+from metrics import (
+    METRICS,
+    JsonLinesExporter,
+    PrometheusTextfileExporter,
+    format_stages,
+    format_utilization,
+    utilization,
+)
+
+
+def _iter_text_file(path, output_dir, voice, speed, extension):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            text = line.strip()
+            if not text:
+                continue
+            yield SynthesisJob(
+                text=text,
+                voice=voice,
+                language="zh-cn",
+                speed=speed,
+                output_path=os.path.join(
+                    output_dir, f"{stem}_{line_number:05d}{extension}"
+                ),
+            )
+
+
+def _iter_directory(path, output_dir, voice, speed, extension):
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            text = f.read()
+        if not text.strip():
+            continue
+        yield SynthesisJob(
+            text=text,
+            voice=voice,
+            language="zh-cn",
+            speed=speed,
+            output_path=os.path.join(output_dir, os.path.splitext(name)[0] + extension),
+        )
+
+
+def _iter_manifest(path, output_dir, voice, speed, extension):
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            output = entry.get("output") or f"{line_number:05d}{extension}"
+            yield SynthesisJob(
+                text=entry["text"],
+                voice=entry.get("voice", voice),
+                language=entry.get("language", "zh-cn"),
+                speed=float(entry.get("speed", speed)),
+                output_path=os.path.join(output_dir, output),
+            )
+
+
+def iter_jobs(input_path, output_dir, voice, speed, extension=".wav"):
+    """Lazily yields one SynthesisJob per unit of input."""
+    if os.path.isdir(input_path):
+        return _iter_directory(input_path, output_dir, voice, speed, extension)
+    if input_path.endswith(".jsonl"):
+        return _iter_manifest(input_path, output_dir, voice, speed, extension)
+    return _iter_text_file(input_path, output_dir, voice, speed, extension)
+
+
+def run_batch(engine, jobs, workers=1, on_job_done=None, use_cache=True):
+    """
+    Runs jobs on `workers` threads that share one loaded engine.
+
+    Jobs are pulled from a bounded queue, so the input is streamed rather
+    than loaded up front. Returns a (done, failed, audio_seconds) tuple.
+    """
+    pending = queue.Queue(maxsize=workers * 4)
+    stats = {"done": 0, "failed": 0, "audio_seconds": 0.0}
+    stats_lock = threading.Lock()
+
+    def worker(slot):
+        while True:
+            job = pending.get()
+            if job is None:
+                break
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            with METRICS.trace() as stages:
+                try:
+                    os.makedirs(os.path.dirname(job.output_path) or ".", exist_ok=True)
+                    result = engine.synthesize(
+                        job.text,
+                        job.voice,
+                        job.output_path,
+                        speed=job.speed,
+                        language=job.language,
+                        slot=slot,
+                        use_cache=use_cache,
+                        # Re-running a batch after edits only renders what changed.
+                        base_path=job.output_path,
+                    )
+                    job.status = JobStatus.DONE
+                    job.audio_seconds = result.audio_seconds
+                except Exception as e:
+                    job.status = JobStatus.FAILED
+                    job.error = str(e)
+                    traceback.print_exc()
+            job.finished_at = time.time()
+            record_job_metrics(job, stages)
+            with stats_lock:
+                if job.status == JobStatus.DONE:
+                    stats["done"] += 1
+                    stats["audio_seconds"] += job.audio_seconds
+                else:
+                    stats["failed"] += 1
+            if on_job_done is not None:
+                on_job_done(job)
+
+    threads = [
+        threading.Thread(target=worker, args=(slot,), daemon=True)
+        for slot in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for job in jobs:
+        pending.put(job)
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+
+    return stats["done"], stats["failed"], stats["audio_seconds"]
+
+
+def run_watch(
+    engine,
+    directory,
+    output_dir,
+    voice,
+    speed,
+    extension=".wav",
+    debounce_seconds=2.0,
+    poll_seconds=0,
+    on_job_done=None,
+    use_cache=True,
+):
+    """
+    Synthesizes new and changed .txt files in `directory` until SIGINT or
+    SIGTERM. Returns the number of jobs that succeeded.
+
+    The job being rendered when the signal arrives is finished and recorded
+    before returning; a second signal cancels it instead.
+    """
+    from gi.repository import GLib
+
+    from watch_folder import FolderWatcher
+
+    loop = GLib.MainLoop()
+    stats = {"done": 0}
+
+    def run(job):
+        engine.synthesize(
+            job.text,
+            job.voice,
+            job.output_path,
+            speed=job.speed,
+            language=job.language,
+            use_cache=use_cache,
+            base_path=job.base_path,
+            cancel=job.cancel_event,
+        )
+
+    def on_finished(job):
+        watcher.job_finished(job)
+        # Long-running: don't keep the text of every job ever rendered.
+        job_queue.clear_finished()
+        if job.status == JobStatus.DONE:
+            stats["done"] += 1
+        if on_job_done is not None:
+            on_job_done(job)
+        return False
+
+    job_queue = JobQueue(
+        run,
+        on_update=lambda job: GLib.idle_add(on_finished, job) if job.finished else None,
+    )
+    watcher = FolderWatcher(
+        directory,
+        output_dir,
+        lambda text, output_path: SynthesisJob(
+            text=text, voice=voice, language="zh-cn", speed=speed, output_path=output_path
+        ),
+        job_queue.submit,
+        extension=extension,
+        debounce_seconds=debounce_seconds,
+        poll_seconds=poll_seconds,
+    )
+    stopping = threading.Event()
+
+    def wait_for_worker():
+        job_queue.join()
+        # Queued after the last job's on_finished, so that still runs.
+        GLib.idle_add(loop.quit)
+
+    def on_signal():
+        if stopping.is_set():
+            for job in job_queue.jobs():
+                if job.status == JobStatus.RUNNING:
+                    job_queue.cancel(job.id)
+            return True
+        stopping.set()
+        print("Finishing the current job (Ctrl+C again to cancel it)")
+        watcher.stop()
+        job_queue.stop()
+        threading.Thread(target=wait_for_worker, daemon=True).start()
+        return True
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, on_signal)
+    job_queue.start()
+    watcher.start()
+    try:
+        loop.run()
+    finally:
+        job_queue.stop()
+        watcher.stop()
+    return stats["done"]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="kokoro-tts", description="Batch text-to-speech with Kokoro."
+    )
+    parser.add_argument("input", help="text file, directory of .txt files or .jsonl manifest")
+    parser.add_argument("-o", "--output-dir", required=True, help="directory for audio files")
+    parser.add_argument(
+        "-v",
+        "--voice",
+        default="zf_001",
+        help='default voice, or a blend such as "zf_001:0.7,zf_002:0.3"',
+    )
+    parser.add_argument("--speed", type=float, default=settings.DEFAULT_SPEED)
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=sorted(FORMATS),
+        default=None,
+        help="output format (default from config, normally wav)",
+    )
+    parser.add_argument(
+        "--sample-rate",
+        type=int,
+        choices=OUTPUT_RATES,
+        default=None,
+        help="resample outputs to this rate; 0 keeps 24000",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="watch the INPUT directory and synthesize new or changed .txt files",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=None,
+        help="seconds a watched file must stay unchanged before it is synthesized",
+    )
+    parser.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=None,
+        help="also rescan the watched directory this often, e.g. on network shares",
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=1, help="number of synthesis threads"
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=0,
+        help="render with N worker processes, each with its own model (CPU)",
+    )
+    parser.add_argument("--device", default=None, help="torch device, e.g. cpu or cuda")
+    parser.add_argument(
+        "--timing", action="store_true", help="print import and model load timings"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=None, help="torch intra-op threads"
+    )
+    parser.add_argument(
+        "--interop-threads", type=int, default=None, help="torch inter-op threads"
+    )
+    parser.add_argument(
+        "--segment-chars",
+        type=int,
+        default=None,
+        help="pack sentences into segments of up to N characters",
+    )
+    parser.add_argument(
+        "--no-inference-mode",
+        action="store_true",
+        help="run under torch.no_grad() instead of torch.inference_mode()",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("torch", "onnx"),
+        default=None,
+        help="inference backend; onnx runs an exported model with ONNX Runtime",
+    )
+    parser.add_argument(
+        "--onnx-threads", type=int, default=None, help="ONNX Runtime intra-op threads"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always render, ignoring the result cache"
+    )
+    parser.add_argument(
+        "--metrics-jsonl", default=None, help="append one JSON line per finished job"
+    )
+    parser.add_argument(
+        "--metrics-prom", default=None, help="write Prometheus text metrics to this file"
+    )
+    parser.add_argument(
+        "--clear-cache", action="store_true", help="empty the result cache before running"
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.watch and args.processes > 0:
+        parser.error("--processes cannot be combined with --watch")
+    if not os.path.exists(args.input):
+        print(f"Input not found: {args.input}", file=sys.stderr)
+        return 2
+    if args.watch and not os.path.isdir(args.input):
+        print(f"--watch needs a directory: {args.input}", file=sys.stderr)
+        return 2
+    workers = max(1, args.workers)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    from timing import STARTUP
+    from tts_engine import TTSEngine
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.timing:
+        STARTUP.enabled = True
+    if args.metrics_jsonl:
+        METRICS.exporters.append(JsonLinesExporter(args.metrics_jsonl))
+    if args.metrics_prom:
+        METRICS.exporters.append(PrometheusTextfileExporter(args.metrics_prom))
+    config = dict(settings.CONFIG)
+    if args.threads is not None:
+        config["torch_threads"] = args.threads
+    if args.interop_threads is not None:
+        config["interop_threads"] = args.interop_threads
+    if args.segment_chars is not None:
+        config["segment_chars"] = args.segment_chars
+    if args.no_inference_mode:
+        config["inference_mode"] = False
+    if args.backend is not None:
+        config["backend"] = args.backend
+    if args.onnx_threads is not None:
+        config["onnx_threads"] = args.onnx_threads
+    if args.format is not None:
+        config["output_format"] = args.format
+    if args.sample_rate is not None:
+        config["output_sample_rate"] = args.sample_rate
+    output_format = FORMATS[config["output_format"]]
+    if output_format.name not in available_formats():
+        print(
+            f"This libsndfile build cannot write {output_format.name}; "
+            f"available: {', '.join(available_formats())}",
+            file=sys.stderr,
+        )
+        return 2
+    rate = config["output_sample_rate"] or settings.SAMPLE_RATE
+    if output_format.rates and rate not in output_format.rates:
+        print(f"{output_format.name} does not support {rate} Hz", file=sys.stderr)
+        return 2
+
+    def on_job_done(job):
+        if job.status == JobStatus.DONE:
+            print(f"[ok] {job.output_path} ({job.audio_seconds:.1f}s)")
+        else:
+            print(f"[failed] {job.output_path}: {job.error}", file=sys.stderr)
+
+    if args.clear_cache:
+        from result_cache import ResultCache
+
+        ResultCache().clear()
+
+    jobs = iter_jobs(
+        args.input, args.output_dir, args.voice, args.speed, output_format.extension
+    )
+
+    if args.processes > 0:
+        from render_farm import RenderFarm
+
+        farm = RenderFarm(
+            args.processes,
+            config=config,
+            device=args.device or "cpu",
+            use_cache=not args.no_cache,
+        )
+        stats = farm.run(jobs, on_job_done=on_job_done)
+        print(f"Render farm finished: {stats.summary()}")
+        return 1 if stats.jobs_failed else 0
+
+    engine = TTSEngine(device=args.device, config=config)
+    load_start = time.perf_counter()
+    engine.load(slots=workers)
+    print(f"Model ready in {time.perf_counter() - load_start:.1f}s")
+    STARTUP.mark("model ready")
+    STARTUP.print_report()
+
+    if args.watch:
+        # Jobs run one at a time on a JobQueue, like in the GUI.
+        print(f"Watching {args.input} (Ctrl+C to stop)")
+        done = run_watch(
+            engine,
+            args.input,
+            args.output_dir,
+            args.voice,
+            args.speed,
+            extension=output_format.extension,
+            debounce_seconds=(
+                args.debounce
+                if args.debounce is not None
+                else config["watch_debounce_seconds"]
+            ),
+            poll_seconds=(
+                args.poll_seconds
+                if args.poll_seconds is not None
+                else config["watch_poll_seconds"]
+            ),
+            on_job_done=on_job_done,
+            use_cache=not args.no_cache,
+        )
+        print(f"Stopped watching after {done} jobs")
+        if engine.g2p_memo is not None:
+            engine.g2p_memo.save()
+        return 0
+
+    start = time.perf_counter()
+    done, failed, audio_seconds = run_batch(
+        engine,
+        jobs,
+        workers=workers,
+        on_job_done=on_job_done,
+        use_cache=not args.no_cache,
+    )
+    elapsed = time.perf_counter() - start
+    rtf = audio_seconds / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Finished {done} jobs ({failed} failed): {audio_seconds:.1f}s of audio "
+        f"in {elapsed:.1f}s ({rtf:.2f}x real time)"
+    )
+    snapshot = METRICS.snapshot()
+    stages = {
+        name: snapshot["spans"][name]["total"]
+        for name in ("g2p", "inference", "write")
+        if name in snapshot["spans"]
+    }
+    if stages:
+        print(f"Stages: {format_stages(stages)}")
+        # Busy share of each stage per worker over the whole batch
+        print(f"Utilization: {format_utilization(utilization(stages, elapsed * workers))}")
+    if engine.g2p_memo is not None:
+        engine.g2p_memo.save()
+        memo = engine.g2p_memo.stats()
+        print(
+            f"G2P memo: {memo['hits']} hits, {memo['misses']} misses "
+            f"({memo['hit_rate']:.0%}), {memo['entries']} entries"
+        )
+    if engine.cache is not None and not args.no_cache:
+        stats = engine.cache.stats()
+        print(
+            f"Result cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}), {stats['size_bytes'] / (1024 * 1024):.1f} MB"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,919 @@
+"""
+GTK-free speech synthesis engine shared by the desktop app and the batch CLI.
+"""
+
+import functools
+import gc
+import json
+import logging
+import os
+import queue
+import re
+import ssl
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import settings
+from audio_output import AudioWriter
+from g2p_memo import G2PMemo
+import model_weights
+import onnx_backend
+from metrics import METRICS
+from model_store import ModelStore
+from render_manifest import RenderManifest, manifest_path, segment_hash
+from result_cache import ResultCache
+from timing import STARTUP
+from voices import VoiceManager
+
+log = logging.getLogger(__name__)
+
+# Set HF endpoint for Chinese users to download models - MUST be set before importing kokoro
+os.environ.setdefault("HF_ENDPOINT", settings.HF_ENDPOINT)
+
+# torch, kokoro and soundfile take seconds to import, so they are loaded by
+# `import_backend()` from the background loader instead of at import time.
+# The type checker sees them as regular imports.
+if TYPE_CHECKING:
+    import soundfile
+    import torch
+    from kokoro import KModel, KPipeline
+else:
+    torch = None
+    soundfile = None
+    KModel = None
+    KPipeline = None
+
+
+def import_backend():
+    """Imports the heavy inference dependencies once, recording their cost."""
+    global torch, soundfile, KModel, KPipeline
+    if KPipeline is not None:
+        return
+    torch = STARTUP.import_module("torch")
+    soundfile = STARTUP.import_module("soundfile")
+    kokoro = STARTUP.import_module("kokoro")
+    KModel = kokoro.KModel
+    KPipeline = kokoro.KPipeline
+
+
+# Short mixed text for the warm-up pass, so both the Chinese and the
+# English G2P initialize their lexicons
+WARM_UP_TEXT = "你好，this is a warm-up。"
+
+
+def _watch_idle(engine_ref):
+    """Unloads the engine's model once it was idle for `idle_unload_minutes`."""
+    while True:
+        engine = engine_ref()
+        if engine is None:
+            return
+        # Re-read every round, so a changed setting applies without restart.
+        timeout = engine.config.get("idle_unload_minutes", 0) * 60
+        del engine
+        time.sleep(min(60, max(5, timeout / 4)) if timeout else 60)
+        engine = engine_ref()
+        if engine is not None and timeout:
+            engine.unload(min_idle_seconds=timeout)
+        del engine
+
+
+def _uses_model(method):
+    """Reloads a model unloaded for idleness first, and keeps it loaded meanwhile."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._in_use():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+# Sentence-ending punctuation for both Chinese and English text. The
+# punctuation stays attached to the sentence it ends.
+SENTENCE_END_RE = re.compile(r"(?<=[。！？；!?;])|(?<=[.])(?=\s)")
+
+
+def split_segments(text, max_chars=0):
+    """
+    Splits text into the segments that are fed to the pipeline one by one.
+
+    Paragraphs are split on newlines and then on sentence-ending punctuation,
+    so the number of segments is known before synthesis starts. With
+    `max_chars`, consecutive sentences of the same paragraph are packed into
+    one segment up to that length. Packing restarts at every paragraph, so
+    an edit only changes the segments of its own paragraph.
+    """
+    segments = []
+    for paragraph in text.splitlines():
+        packed = ""
+        for sentence in SENTENCE_END_RE.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if not max_chars:
+                segments.append(sentence)
+            elif packed and len(packed) + len(sentence) + 1 > max_chars:
+                segments.append(packed)
+                packed = sentence
+            else:
+                packed = f"{packed} {sentence}" if packed else sentence
+        if packed:
+            segments.append(packed)
+    return segments
+
+
+def configure_torch(config):
+    """
+    Applies the CPU threading settings from the config to torch.
+
+    torch only accepts the inter-op thread count before any inter-op work
+    has started, so that one is applied once per process.
+    """
+    if config.get("torch_threads"):
+        torch.set_num_threads(int(config["torch_threads"]))
+    if config.get("interop_threads"):
+        try:
+            torch.set_num_interop_threads(int(config["interop_threads"]))
+        except RuntimeError as e:
+            log.info("Keeping current inter-op thread count: %s", e)
+    log.info(
+        "torch threads: intra-op %d, inter-op %d",
+        torch.get_num_threads(),
+        torch.get_num_interop_threads(),
+    )
+
+
+class PipelineRegistry:
+    """
+    Builds KPipeline instances once and shares them between generation jobs.
+
+    Pipelines are keyed by (lang_code, model, slot) so a G2P-only pipeline and
+    a pipeline bound to the loaded KModel never collide. Construction happens
+    under a registry-wide lock, so two workers asking for the same key at the
+    same time still build it only once. The G2P backends (misaki, jieba,
+    pypinyin) are not documented as thread-safe, so every pipeline also gets
+    its own re-entrant lock; callers must run the pipeline inside
+    `acquire()` so concurrent jobs take turns on it instead of interleaving.
+    Workers that should run truly in parallel ask for different slots: each
+    slot has its own G2P state while the KModel weights stay shared. With a
+    `g2p_memo`, the English callback and the Chinese G2P of every pipeline
+    share one memo table.
+    """
+
+    def __init__(self, repo_id, g2p_memo=None):
+        self.repo_id = repo_id
+        self.g2p_memo = g2p_memo
+        # Re-entrant: building the Chinese pipeline builds the English one.
+        self._lock = threading.RLock()
+        self._pipelines = {}
+        self._pipeline_locks = {}
+
+    def _build(self, lang_code, model, slot):
+        if lang_code == "zh":
+
+            def en_callable(text):
+                with self.acquire("a", slot=slot) as en_pipeline:
+                    return next(en_pipeline(text)).phonemes
+
+            if self.g2p_memo is not None:
+                en_callable = self.g2p_memo.wrap("en", en_callable)
+
+            # Make sure the English fallback exists before the Chinese
+            # pipeline can call into it.
+            self._get_or_build("a", None, slot)
+            pipeline = KPipeline(
+                lang_code="zh",
+                repo_id=self.repo_id,
+                model=model if model is not None else False,
+                en_callable=en_callable,
+            )
+            # KPipeline calls self.g2p per chunk; timing it separates G2P
+            # (including embedded English) from model inference.
+            g2p = pipeline.g2p
+            if self.g2p_memo is not None:
+                g2p = self.g2p_memo.wrap("zh", g2p, unpack=True)
+
+            def timed_g2p(text):
+                with METRICS.span("g2p"):
+                    return g2p(text)
+
+            pipeline.g2p = timed_g2p
+            return pipeline
+        return KPipeline(
+            lang_code=lang_code,
+            repo_id=self.repo_id,
+            model=model if model is not None else False,
+        )
+
+    def _get_or_build(self, lang_code, model, slot):
+        key = (lang_code, model, slot)
+        pipeline = self._pipelines.get(key)
+        if pipeline is not None:
+            return pipeline
+        with self._lock:
+            pipeline = self._pipelines.get(key)
+            if pipeline is None:
+                log.info("Building KPipeline for lang_code=%s slot=%s", lang_code, slot)
+                with METRICS.span("pipeline_build"):
+                    pipeline = self._build(lang_code, model, slot)
+                self._pipeline_locks[key] = threading.RLock()
+                self._pipelines[key] = pipeline
+        return pipeline
+
+    def get(self, lang_code, model=None, slot=0):
+        """Returns the shared pipeline for the key, building it on first use."""
+        return self._get_or_build(lang_code, model, slot)
+
+    @contextmanager
+    def acquire(self, lang_code, model=None, slot=0):
+        """Yields the shared pipeline while holding its per-pipeline lock."""
+        pipeline = self._get_or_build(lang_code, model, slot)
+        with self._pipeline_locks[(lang_code, model, slot)]:
+            yield pipeline
+
+    def warm(self, model, slots=1, g2p_only=False):
+        """
+        Builds the pipelines used by speech generation ahead of time.
+
+        `g2p_only` also builds the model-less Chinese pipelines that the
+        staged renderer phonemizes with.
+        """
+        for slot in range(slots):
+            self.get("a", slot=slot)
+            if model is not None:
+                self.get("zh", model, slot=slot)
+            if g2p_only or model is None:
+                self.get("zh", slot=slot)
+
+    def clear(self):
+        with self._lock:
+            self._pipelines.clear()
+            self._pipeline_locks.clear()
+
+
+def _concatenate(chunks):
+    import numpy as np
+
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+class SynthesisCancelled(Exception):
+    """Raised by TTSEngine.synthesize() when its cancel event is set."""
+
+    def __init__(self, segments_done, frames):
+        super().__init__(f"cancelled after {segments_done} segments")
+        self.segments_done = segments_done
+        self.frames = frames
+
+
+@dataclass
+class SynthesisResult:
+    output_path: str
+    segments: int
+    frames: int
+    # Segments copied from the base render instead of synthesized
+    reused: int = 0
+
+    @property
+    def audio_seconds(self):
+        return self.frames / settings.SAMPLE_RATE
+
+
+class TTSEngine:
+    """
+    Owns the KModel and the pipeline registry, and turns text into audio files.
+
+    The engine has no GUI dependencies: the GTK app drives it from its job
+    queue worker, and the batch CLI drives it from its own worker threads.
+    """
+
+    def __init__(self, repo_id=settings.REPO_ID, device=None, store=None, config=None):
+        self.repo_id = repo_id
+        self.config = dict(config or settings.CONFIG)
+        # Resolved in load(), once torch has been imported.
+        self.device = device
+        self.model = None
+        self.store = store or ModelStore(repo_id=repo_id)
+        self.voices = VoiceManager(self.store)
+        self.g2p_memo = G2PMemo() if settings.G2P_MEMO_ENABLED else None
+        self.pipelines = PipelineRegistry(repo_id, g2p_memo=self.g2p_memo)
+        self.cache = ResultCache() if settings.RESULT_CACHE_ENABLED else None
+        # Fixed at load time; changing the config takes effect on reload.
+        self.quantized = False
+        self.backend = "torch"
+        # Idle unloading: jobs in progress, last use, and whether the model
+        # was released and should come back on the next job
+        self._activity_lock = threading.Lock()
+        self._active_jobs = 0
+        self._last_used = time.monotonic()
+        self._slots = 1
+        self._idle_watcher = None
+        self.idle_unloaded = False
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    @property
+    def ready(self):
+        """True if jobs can be run, possibly after a transparent reload."""
+        return self.model is not None or self.idle_unloaded
+
+    def _loaded_model(self):
+        """The model of a loaded engine, for code that only runs after load()."""
+        model = self.model
+        if model is None:
+            raise RuntimeError("TTS model is not loaded")
+        return model
+
+    @property
+    def revision(self):
+        """
+        Tags derived audio: weights revision, plus the backend if not torch
+        and the precision if not fp32.
+        """
+        revision = self.store.revision
+        if self.backend != "torch":
+            revision += f"-{self.backend}"
+        if self.quantized:
+            revision += "-int8"
+        return revision
+
+    def _prepare_store(self):
+        """
+        Makes sure the local model store is complete.
+
+        Nothing touches the network when every file is already present and
+        intact. Otherwise the missing files are fetched, falling back to an
+        unverified SSL context if the download fails with an SSL error.
+        """
+        missing = self.store.missing_files()
+        if not missing:
+            # Keep huggingface_hub from probing the network for anything else.
+            os.environ.setdefault("HF_HUB_OFFLINE", "1")
+            log.info("Using local model store: %s", self.store.root)
+            return
+
+        import requests
+
+        log.info("HF_ENDPOINT: %s", os.environ.get("HF_ENDPOINT", "not set"))
+        log.info("Fetching %d missing model files into %s", len(missing), self.store.root)
+        allow_download = not settings.OFFLINE
+        try:
+            self.store.ensure(allow_download=allow_download)
+        except (ssl.SSLError, requests.exceptions.SSLError) as ssl_e:
+            log.warning("SSL error while fetching model files: %s", ssl_e)
+
+            # Second attempt: Try without SSL verification
+            try:
+                import urllib3
+
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+                log.warning("Retrying without SSL certificate verification")
+                original_context = ssl._create_default_https_context
+                ssl._create_default_https_context = ssl._create_unverified_context
+                try:
+                    self.store.ensure(allow_download=allow_download)
+                finally:
+                    ssl._create_default_https_context = original_context
+                log.info("Model files fetched without SSL verification")
+            except Exception as alt_e:
+                log.error("Fetching without SSL verification also failed: %s", alt_e)
+                raise Exception("All model loading methods failed") from alt_e
+
+    def _build_model(self):
+        if self.backend == "onnx":
+            return onnx_backend.load(
+                torch,
+                KModel,
+                self.store,
+                self.repo_id,
+                threads=self.config.get("onnx_threads", 0),
+            )
+        model = None
+        if self.config.get("weights_mmap"):
+            model = model_weights.build_model(torch, KModel, self.store, self.repo_id)
+        if model is None:
+            model = KModel(
+                repo_id=self.repo_id,
+                config=self.store.config_path,
+                model=self.store.weights_path,
+            )
+        model = model.to(self.device).eval()
+        if self.quantized:
+            model = model_weights.quantize_int8(torch, model)
+        elif self.config.get("quantize_int8"):
+            log.warning("int8 quantization is CPU only; using fp32 on %s", self.device)
+        return model
+
+    def load(self, slots=1, warm_up=None):
+        """
+        Loads the model from the local store and builds the shared pipelines.
+
+        With `warm_up` (default from the config) a short dummy synthesis
+        runs afterwards, so the first real job doesn't pay for lazy
+        initialization. Raises on failure.
+        """
+        self._slots = slots
+        with METRICS.span("model_load"):
+            self._load(slots)
+        if warm_up is None:
+            warm_up = self.config.get("warm_up", True)
+        if warm_up:
+            self.warm_up()
+            STARTUP.mark("warm-up done")
+        self.idle_unloaded = False
+        self._last_used = time.monotonic()
+        if self._idle_watcher is None:
+            # Weakly referenced, so the thread doesn't keep the engine alive.
+            self._idle_watcher = threading.Thread(
+                target=_watch_idle,
+                args=(weakref.ref(self),),
+                name="idle-unload",
+                daemon=True,
+            )
+            self._idle_watcher.start()
+
+    def warm_up(self, voice=None):
+        """
+        Runs a short dummy synthesis without writing anything.
+
+        This initializes the allocator, the kernels and the G2P lexicons.
+        """
+        voice = voice or (self.voices.available() or settings.DEFAULT_VOICES)[0]
+        with METRICS.span("warm_up"):
+            pack = self.voices.get(voice).to(self._loaded_model().device)
+            speed = settings.DEFAULT_SPEED
+            # The same path the jobs take, see synthesize().
+            if self.config.get("staged_pipeline"):
+                with self._grad_mode():
+                    self._infer(self._phonemize(WARM_UP_TEXT, speed, 0), pack, speed)
+            else:
+                self._render_segment(WARM_UP_TEXT, pack, speed, 0)
+        log.info("Warm-up took %.2fs", METRICS.spans["warm_up"].last)
+
+    # --- Idle unloading ----------------------------------------------------
+
+    @contextmanager
+    def _in_use(self):
+        with self._activity_lock:
+            if self.model is None and self.idle_unloaded:
+                log.info("Reloading the model after idle unload")
+                METRICS.increment("model_reloads")
+                with METRICS.span("reload"):
+                    # The job is the warm-up now.
+                    self.load(self._slots, warm_up=False)
+            self._active_jobs += 1
+        try:
+            yield
+        finally:
+            with self._activity_lock:
+                self._active_jobs -= 1
+                self._last_used = time.monotonic()
+
+    def unload(self, min_idle_seconds=0):
+        """
+        Releases the model, pipelines and voice packs if no job is running
+        and none ran for `min_idle_seconds`. The next job reloads them.
+        Returns True if the model was unloaded.
+        """
+        with self._activity_lock:
+            idle = time.monotonic() - self._last_used
+            if self.model is None or self._active_jobs or idle < min_idle_seconds:
+                return False
+            self.model = None
+            self.pipelines.clear()
+            self.voices.clear()
+            if self.g2p_memo is not None and self.g2p_memo.path:
+                # Saved, so load() brings it back.
+                self.g2p_memo.save()
+                self.g2p_memo.clear()
+            self.idle_unloaded = True
+        gc.collect()
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+        METRICS.increment("model_unloads")
+        log.info("Unloaded the model after %.0f idle seconds", idle)
+        return True
+
+    def _load(self, slots):
+        # Before importing kokoro, so HF_HUB_OFFLINE is seen by huggingface_hub.
+        self._prepare_store()
+        STARTUP.mark("model files resolved")
+        import_backend()
+        configure_torch(self.config)
+
+        self.backend = self.config.get("backend", "torch")
+        if self.backend == "onnx" and not onnx_backend.available():
+            log.warning("onnxruntime is not installed; using the torch backend")
+            self.backend = "torch"
+        if self.backend == "onnx":
+            # Sessions use ONNX Runtime's CPU provider.
+            self.device = "cpu"
+        elif self.device is None:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        log.info("Using device: %s (%s backend)", self.device, self.backend)
+        # Dynamic quantization only exists for CPU kernels.
+        self.quantized = (
+            bool(self.config.get("quantize_int8"))
+            and self.device == "cpu"
+            and self.backend == "torch"
+        )
+        if self.cache is not None:
+            # Audio rendered by different weights must never be reused.
+            self.cache.revision = self.revision
+        METRICS.set_info(
+            device=self.device,
+            revision=self.store.revision,
+            precision="int8" if self.quantized else "fp32",
+            backend=self.backend,
+        )
+        self.model = self._build_model()
+        log.info("Model loaded")
+
+        STARTUP.mark("model loaded")
+
+        if self.g2p_memo is not None:
+            loaded = self.g2p_memo.load()
+            log.info("Loaded %d memoized G2P results", loaded)
+        # Build the shared pipelines now so the first job doesn't pay for
+        # loading the G2P lexicons.
+        # The ONNX backend only needs the model-less G2P pipelines.
+        self.pipelines.warm(
+            self.model if self.backend == "torch" else None,
+            slots=slots,
+            g2p_only=self.config.get("staged_pipeline", False),
+        )
+        STARTUP.mark("pipelines built")
+        self.voices.preload()
+        STARTUP.mark("voices preloaded")
+
+    def _grad_mode(self):
+        if self.config.get("inference_mode"):
+            return torch.inference_mode()
+        return torch.no_grad()
+
+    def _phonemize(self, segment, speed, slot):
+        """Phonemes of each model-sized chunk of a segment, without inference."""
+        with self.pipelines.acquire("zh", slot=slot) as pipeline:
+            return [
+                result.phonemes
+                for result in pipeline(
+                    text=segment, voice=None, speed=speed, split_pattern=None
+                )
+            ]
+
+    def _infer(self, phonemes, pack, speed):
+        """Runs the model on phoneme chunks and returns the joined samples."""
+        model = self._loaded_model()
+        with METRICS.span("inference"):
+            if self.backend == "onnx":
+                chunks = [model.infer(ps, pack, speed) for ps in phonemes]
+            else:
+                chunks = [
+                    KPipeline.infer(model, ps, pack, speed).audio.numpy()
+                    for ps in phonemes
+                ]
+        return _concatenate(chunks)
+
+    def _render_segment(self, segment, voice_pack, speed, slot):
+        """Runs one segment through the pipeline and returns its samples."""
+        if self.backend == "onnx":
+            return self._infer(self._phonemize(segment, speed, slot), voice_pack, speed)
+        chunks = []
+        with self._grad_mode(), self.pipelines.acquire("zh", self.model, slot) as zh_pipeline:
+            g2p_before = METRICS.thread_total("g2p")
+            start = time.perf_counter()
+            for result in zh_pipeline(
+                text=segment, voice=voice_pack, speed=speed, split_pattern=None
+            ):
+                if result.audio is not None:
+                    chunks.append(result.audio.numpy())
+            # Whatever the segment took beyond G2P was spent in the model.
+            g2p_seconds = METRICS.thread_total("g2p") - g2p_before
+            METRICS.observe("inference", time.perf_counter() - start - g2p_seconds)
+        return _concatenate(chunks)
+
+    @_uses_model
+    def render_segment(
+        self, segment, voice, speed, language="zh-cn", slot=0, use_cache=True
+    ):
+        """Returns the samples for one segment, from the cache when possible."""
+        if self.model is None:
+            raise RuntimeError("TTS model is not loaded")
+        cache = self.cache if use_cache else None
+        if cache is not None:
+            segment_key = cache.key(segment, voice, language, speed)
+            wav = cache.get_segment(segment_key)
+            if wav is not None:
+                return wav
+        wav = self._render_segment(segment, self.voices.get(voice), speed, slot)
+        if cache is not None:
+            cache.put_segment(segment_key, wav)
+        return wav
+
+    @_uses_model
+    def synthesize(
+        self,
+        text,
+        voice,
+        output_path,
+        speed=settings.DEFAULT_SPEED,
+        language="zh-cn",
+        on_progress=None,
+        on_audio=None,
+        slot=0,
+        use_cache=True,
+        base_path=None,
+        samplerate=None,
+        cancel=None,
+        keep_partial=None,
+    ):
+        """
+        Synthesizes `text` into `output_path` and returns a SynthesisResult.
+
+        The format follows the file extension (see audio_output.FORMATS) and
+        `samplerate` defaults to the configured output rate. Every segment is
+        encoded into the output file as soon as it is produced, so memory
+        stays bounded no matter how long the text is. With the
+        `staged_pipeline` setting, G2P, inference and encoding overlap (see
+        _render_staged()).
+        Segments and whole outputs already in the result cache are reused
+        instead of re-rendered. With `base_path`, a previous render of an
+        earlier version of the text (possibly `output_path` itself),
+        segments whose text is unchanged are copied from that file at their
+        recorded sample offsets.
+
+        `on_progress(done, total, audio_seconds)` is called after each
+        segment from the calling thread, and `on_audio(samples)` receives
+        each segment's audio as soon as it exists, e.g. for streaming
+        playback. `cancel` is a threading.Event checked before every
+        segment; once it is set, SynthesisCancelled is raised and the audio
+        written so far is either finalized as a valid, shorter file
+        (`keep_partial`, default from the config) or removed.
+        """
+        if self.model is None:
+            raise RuntimeError("TTS model is not loaded")
+        cache = self.cache if use_cache else None
+
+        segments = split_segments(text, self.config.get("segment_chars", 0))
+        total = len(segments)
+        manifest = RenderManifest(voice, language, speed, self.revision)
+        if samplerate is None:
+            samplerate = self.config.get("output_sample_rate", 0)
+
+        if cache is not None:
+            # Keyed on the segments rather than the text: line breaks and
+            # the packing setting change the segments, and with them the
+            # pauses in the audio.
+            output_key = cache.key(
+                json.dumps(segments, ensure_ascii=False),
+                voice,
+                language,
+                speed,
+                kind="output",
+                variant=str(samplerate),
+            )
+            if cache.fetch_output(output_key, output_path):
+                # The segment offsets of an earlier render of other text
+                # must not stay next to this audio; the cached output's own
+                # manifest, if any, replaces them.
+                if os.path.exists(manifest_path(output_path)):
+                    os.remove(manifest_path(output_path))
+                cache.fetch_output(output_key, manifest_path(output_path), count=False)
+                info = soundfile.info(output_path)
+                frames = round(info.duration * settings.SAMPLE_RATE)
+                log.info("Result cache hit: %s", output_path)
+                if on_audio is not None and info.samplerate == settings.SAMPLE_RATE:
+                    for block in soundfile.blocks(
+                        output_path, blocksize=settings.SAMPLE_RATE, dtype="float32"
+                    ):
+                        on_audio(block)
+                if on_progress is not None:
+                    on_progress(total, total, frames / settings.SAMPLE_RATE)
+                return SynthesisResult(output_path, total, frames)
+
+        base_file, base_spans = self._open_base(
+            base_path, voice, language, speed, manifest.revision
+        )
+        # Never overwrite the base while still reading from it.
+        write_path = output_path
+        if (
+            base_file is not None
+            and base_path
+            and os.path.abspath(base_path) == os.path.abspath(output_path)
+        ):
+            root, extension = os.path.splitext(output_path)
+            write_path = f"{root}.part{extension}"
+
+        if keep_partial is None:
+            keep_partial = self.config.get("keep_partial_output", False)
+        progress = {"segments": 0, "frames": 0, "reused": 0}
+
+        def reuse(segment):
+            """Audio of an unchanged segment from the base render, or None."""
+            span = base_spans.get(segment_hash(segment))
+            if span is None or base_file is None:
+                return None
+            base_file.seek(span[0])
+            progress["reused"] += 1
+            return base_file.read(span[1], dtype="float32")
+
+        def write_segment(segment, wav):
+            if on_audio is not None:
+                on_audio(wav)
+            with METRICS.span("write"):
+                out_file.write(wav)
+            manifest.add(segment, progress["frames"], len(wav))
+            progress["frames"] += len(wav)
+            progress["segments"] += 1
+            if on_progress is not None:
+                on_progress(
+                    progress["segments"], total, progress["frames"] / settings.SAMPLE_RATE
+                )
+
+        try:
+            with AudioWriter(write_path, samplerate=samplerate) as out_file:
+                if self.config.get("staged_pipeline", False):
+                    self._render_staged(
+                        segments, voice, speed, language, slot, use_cache,
+                        reuse, write_segment, cancel,
+                    )
+                else:
+                    for segment in segments:
+                        if cancel is not None and cancel.is_set():
+                            break
+                        wav = reuse(segment)
+                        if wav is None:
+                            wav = self.render_segment(
+                                segment, voice, speed, language, slot=slot, use_cache=use_cache
+                            )
+                        write_segment(segment, wav)
+                if cancel is not None and cancel.is_set():
+                    raise SynthesisCancelled(progress["segments"], progress["frames"])
+        except SynthesisCancelled:
+            # The writer is closed, so the file on disk is already valid.
+            self._discard_partial(
+                output_path, write_path, manifest, out_file, keep_partial
+            )
+            raise
+        finally:
+            if base_file is not None:
+                base_file.close()
+        if write_path != output_path:
+            os.replace(write_path, output_path)
+        if out_file.native:
+            manifest.save(output_path)
+        elif os.path.exists(manifest_path(output_path)):
+            # Resampled or lossy audio can't be spliced sample-exactly.
+            os.remove(manifest_path(output_path))
+        if base_file is not None:
+            log.info(
+                "Reused %d of %d segments from %s", progress["reused"], total, base_path
+            )
+
+        if cache is not None:
+            cache.put_output(output_key, output_path)
+            if out_file.native:
+                cache.put_output(output_key, manifest_path(output_path))
+        return SynthesisResult(output_path, total, progress["frames"], progress["reused"])
+
+    def _render_staged(
+        self, segments, voice, speed, language, slot, use_cache, reuse, write, cancel
+    ):
+        """
+        Renders segments in three overlapping stages.
+
+        A G2P thread looks segments up in the base render and the cache and
+        phonemizes the rest on the slot's model-less pipeline, running up to
+        `pipeline_prefetch` segments ahead. The calling thread only runs the
+        model, and a writer thread encodes the audio. Phonemization and
+        encoding thereby hide behind inference instead of adding to it.
+        Stops early, without raising, when `cancel` is set.
+        """
+        cache = self.cache if use_cache else None
+        pack = self.voices.get(voice).to(self._loaded_model().device)
+        prefetch = max(1, self.config.get("pipeline_prefetch", 4))
+        phonemes_queue = queue.Queue(maxsize=prefetch)
+        audio_queue = queue.Queue(maxsize=prefetch)
+        done = object()
+        stop = threading.Event()
+        writer_errors = []
+        # Spans from the helper threads count towards the caller's job.
+        stages = METRICS.current_trace()
+
+        def g2p_stage():
+            with METRICS.trace(stages):
+                try:
+                    for segment in segments:
+                        key = None
+                        wav = reuse(segment)
+                        if wav is None and cache is not None:
+                            key = cache.key(segment, voice, language, speed)
+                            wav = cache.get_segment(key)
+                        phonemes = None
+                        if wav is None:
+                            phonemes = self._phonemize(segment, speed, slot)
+                        if not put(phonemes_queue, (segment, wav, phonemes, key)):
+                            return
+                    put(phonemes_queue, done)
+                except Exception as e:
+                    put(phonemes_queue, e)
+
+        def writer_stage():
+            with METRICS.trace(stages):
+                try:
+                    while (item := audio_queue.get()) is not done:
+                        write(*item)
+                except Exception as e:
+                    writer_errors.append(e)
+                    stop.set()
+
+        def put(target, item):
+            """Blocks while the next stage is busy, unless the render stopped."""
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        producer = threading.Thread(target=g2p_stage, name="g2p-stage", daemon=True)
+        writer = threading.Thread(target=writer_stage, name="writer-stage", daemon=True)
+        producer.start()
+        writer.start()
+        try:
+            with self._grad_mode():
+                while not stop.is_set() and not (cancel is not None and cancel.is_set()):
+                    try:
+                        # With a timeout, so a failed writer can't leave
+                        # this waiting on a G2P stage that already stopped.
+                        item = phonemes_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    segment, wav, phonemes, key = item
+                    if wav is None:
+                        wav = self._infer(phonemes, pack, speed)
+                        if cache is not None:
+                            cache.put_segment(key, wav)
+                    put(audio_queue, (segment, wav))
+        finally:
+            # Let the writer finish what it has, then release the G2P stage.
+            if not stop.is_set():
+                put(audio_queue, done)
+            writer.join()
+            stop.set()
+            producer.join()
+        if writer_errors:
+            raise writer_errors[0]
+
+    def _discard_partial(self, output_path, write_path, manifest, out_file, keep):
+        """Finalizes or removes the output of a cancelled synthesis."""
+        if write_path != output_path:
+            # Splicing in place: keep the previous complete render instead.
+            os.remove(write_path)
+        elif keep:
+            log.info("Kept partial output %s", output_path)
+            # The finished segments can be reused when the job is re-run.
+            if out_file.native:
+                manifest.save(output_path)
+        else:
+            for path in (output_path, manifest_path(output_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _open_base(self, base_path, voice, language, speed, revision):
+        """
+        Opens a previous render for splicing.
+
+        Returns (SoundFile, {segment hash: (start, frames)}), or (None, {})
+        when there is no usable base.
+        """
+        if not base_path or not os.path.isfile(base_path):
+            return None, {}
+        base = RenderManifest.load(base_path)
+        if base is None or not base.compatible(voice, language, speed, revision):
+            return None, {}
+        try:
+            base_file = soundfile.SoundFile(base_path)
+        except RuntimeError:
+            return None, {}
+        spans = base.spans()
+        if base_file.samplerate != settings.SAMPLE_RATE or any(
+            start + frames > base_file.frames for start, frames in spans.values()
+        ):
+            # The audio no longer matches its manifest.
+            base_file.close()
+            return None, {}
+        return base_file, spans
@@ -1,12 +1,35 @@
 import sys
+import importlib.util
+import os
+import shutil
 import subprocess
 import threading
+import time
 import ensurepip
+from collections import deque
+
 import gi
 
 gi.require_version("Gtk", "4.0")
 from gi.repository import Gtk, GLib
 
+import settings
+
+# Requirements installed when kokoro is missing
+TTS_REQUIREMENTS = ["misaki[zh]>=0.9.4", "kokoro>=0.9.4"]
+
+# Exact versions of TTS_REQUIREMENTS and everything they pull in, generated
+# from uv.lock with `python -m tts_installer --write-lock`
+LOCK_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "requirements-tts.lock"
+)
+
+# The log view is refreshed at most this often, and keeps this many lines
+LOG_FLUSH_INTERVAL_MS = 100
+MAX_LOG_LINES = 2000
+# Output lines shown in the error dialog when the installation fails
+ERROR_TAIL_LINES = 40
+
 try:
     import pip
 except ImportError:
@@ -31,57 +54,130 @@ def _run_dialog_sync(dialog):
     return response_holder["response"]
 
 
-def _run_install(window, text_buffer, text_view, on_done, loop):
-    """Runs the installation in a separate thread with real-time output."""
+class _InstallLog:
+    """
+    Shows installer output in a text view without flooding the main loop.
+
+    The installer thread only appends lines; a timer on the main loop
+    inserts whatever arrived every LOG_FLUSH_INTERVAL_MS in one go, and the
+    buffer is trimmed to the last MAX_LOG_LINES lines.
+    """
+
+    def __init__(self, text_view):
+        self.text_view = text_view
+        self.text_buffer = text_view.get_buffer()
+        # Last lines, for the error dialog
+        self.tail = deque(maxlen=ERROR_TAIL_LINES)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._source = GLib.timeout_add(LOG_FLUSH_INTERVAL_MS, self._flush)
+
+    def append(self, line):
+        """Queues a line; safe to call from any thread."""
+        with self._lock:
+            self._pending.append(line)
+            self.tail.append(line)
+
+    def close(self):
+        """Shows the remaining lines and stops the timer (main thread)."""
+        self._flush()
+        GLib.source_remove(self._source)
+
+    def _flush(self):
+        with self._lock:
+            lines, self._pending = self._pending[-MAX_LOG_LINES:], []
+        if lines:
+            end_iter = self.text_buffer.get_end_iter()
+            self.text_buffer.insert(end_iter, "\n".join(lines) + "\n")
+            excess = self.text_buffer.get_line_count() - 1 - MAX_LOG_LINES
+            if excess > 0:
+                _, cut = self.text_buffer.get_iter_at_line(excess)
+                self.text_buffer.delete(self.text_buffer.get_start_iter(), cut)
+            # Scroll to bottom
+            adj = self.text_view.get_parent().get_vadjustment()
+            adj.set_value(adj.get_upper() - adj.get_page_size())
+        return True  # Keep the timer running
+
+
+def _wheelhouse():
+    """The local wheel directory, if it has any wheels."""
+    directory = settings.WHEELHOUSE_DIR
     try:
-        # Start the pip install process with real-time output
-        process = subprocess.Popen(
-            [
-                sys.executable,
-                "-m",
-                "pip",
-                "install",
-                "-v",
-                "misaki[zh]>=0.9.4",
-                "kokoro>=0.9.4",
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,  # Merge stdout and stderr
-            bufsize=1,
-            universal_newlines=True,
-            encoding="utf-8",
+        if any(name.endswith(".whl") for name in os.listdir(directory)):
+            return directory
+    except OSError:
+        pass
+    return None
+
+
+def _install_commands():
+    """
+    Returns the (description, argv) installation attempts, best first.
+
+    The locked versions come from the local wheelhouse without touching the
+    network when it has them all; otherwise they are downloaded, with the
+    wheelhouse still used for whatever it holds. uv installs from its
+    global cache, in parallel, when it is on the PATH; pip otherwise.
+    """
+    if os.path.isfile(LOCK_PATH):
+        requirements = ["-r", LOCK_PATH]
+    else:
+        requirements = list(TTS_REQUIREMENTS)
+    uv = shutil.which("uv")
+    if uv is not None:
+        install = [uv, "pip", "install", "--python", sys.executable]
+    else:
+        install = [sys.executable, "-m", "pip", "install", "--progress-bar", "off"]
+    wheelhouse = _wheelhouse()
+    find_links = ["--find-links", wheelhouse] if wheelhouse else []
+    tool = "uv" if uv is not None else "pip"
+
+    commands = []
+    if wheelhouse:
+        commands.append(
+            (
+                f"从本地 wheelhouse 安装 ({tool}): {wheelhouse}",
+                install + ["--no-index"] + find_links + requirements,
+            )
         )
+    if not settings.OFFLINE:
+        commands.append((f"在线安装 ({tool})", install + find_links + requirements))
+    return commands
 
-        # Read output in real-time
-        full_output = []
-        while True:
-            line = process.stdout.readline()
-            if not line:
-                break
-
-            line = line.rstrip()
-            full_output.append(line)
-
-            # Update the text view in the main thread
-            def update_text_view():
-                end_iter = text_buffer.get_end_iter()
-                text_buffer.insert(end_iter, line + "\n")
-                # Scroll to bottom
-                adj = text_view.get_parent().get_vadjustment()
-                adj.set_value(adj.get_upper() - adj.get_page_size())
-                return False
-
-            GLib.idle_add(update_text_view)
-
-        # Wait for process to complete
-        returncode = process.wait()
-
-        # Final result handling
-        if returncode == 0:
-            GLib.idle_add(on_done, window, True, None, loop)
-        else:
-            error_output = "\n".join(full_output)
-            GLib.idle_add(on_done, window, False, error_output, loop)
+
+def _run_command(argv, log):
+    """Runs one installer command, streaming its output to `log`."""
+    process = subprocess.Popen(
+        argv,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,  # Merge stdout and stderr
+        bufsize=1,
+        universal_newlines=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    # Never None: stdout is a pipe.
+    for line in process.stdout or ():
+        log.append(line.rstrip())
+    return process.wait()
+
+
+def _run_install(window, log, on_done, loop):
+    """Runs the installation in a separate thread with real-time output."""
+    try:
+        commands = _install_commands()
+        if not commands:
+            raise RuntimeError(
+                f"离线模式下本地 wheelhouse 为空: {settings.WHEELHOUSE_DIR}"
+            )
+        start = time.monotonic()
+        for description, argv in commands:
+            log.append(f"==> {description}")
+            if _run_command(argv, log) == 0:
+                log.append(f"==> 完成，用时 {time.monotonic() - start:.0f} 秒")
+                GLib.idle_add(on_done, window, True, None, loop)
+                return
+        GLib.idle_add(on_done, window, False, "\n".join(log.tail), loop)
 
     except Exception as e:
         # Catch other exceptions like file not found
@@ -95,7 +191,10 @@ def check_and_install_tts():
     Returns True if TTS is available, False otherwise.
     """
     try:
-        import kokoro
+        # Only locate the package: importing kokoro pulls in torch and would
+        # delay the main window by several seconds.
+        if importlib.util.find_spec("kokoro") is None:
+            raise ImportError("kokoro is not installed")
 
         print("TTS is already installed.")
         return True
@@ -165,7 +264,10 @@ def check_and_install_tts():
         install_result = {"success": False, "error": None}
         install_loop = GLib.MainLoop()
 
+        install_log = _InstallLog(text_view)
+
         def on_install_done(window, success, error_message, loop):
+            install_log.close()
             window.destroy()
             install_result["success"] = success
             install_result["error"] = error_message
@@ -175,8 +277,7 @@ def check_and_install_tts():
             target=_run_install,
             args=(
                 install_window,
-                text_buffer,
-                text_view,
+                install_log,
                 on_install_done,
                 install_loop,
             ),
@@ -205,3 +306,80 @@ def check_and_install_tts():
             )
             _run_dialog_sync(error_dialog)
             return False
+
+
+def write_lock(uv_lock_path="uv.lock", output_path=LOCK_PATH):
+    """
+    Writes the versions uv.lock resolved for TTS_REQUIREMENTS and all their
+    dependencies as a pip requirements file, with the environment markers
+    under which each package is needed.
+    """
+    import tomllib
+    from packaging.requirements import Requirement
+
+    with open(uv_lock_path, "rb") as f:
+        packages = {package["name"]: package for package in tomllib.load(f)["package"]}
+
+    # Package name -> the marker conditions of every path that reaches it
+    conditions = {}
+    stack = []
+    for spec in TTS_REQUIREMENTS:
+        requirement = Requirement(spec)
+        stack.append((requirement.name, tuple(requirement.extras), ()))
+    while stack:
+        name, extras, path = stack.pop()
+        seen = conditions.setdefault(name, set())
+        if (frozenset(path), frozenset(extras)) in seen:
+            continue
+        seen.add((frozenset(path), frozenset(extras)))
+        package = packages[name]
+        dependencies = list(package.get("dependencies", []))
+        for extra in extras:
+            dependencies += package.get("optional-dependencies", {}).get(extra, [])
+        for dependency in dependencies:
+            marker = (f"({dependency['marker']})",) if "marker" in dependency else ()
+            dependency_extras = tuple(dependency.get("extra", ()))
+            stack.append((dependency["name"], dependency_extras, path + marker))
+
+    lines = [
+        "# Exact versions installed by tts_installer.py.",
+        "# Generated from uv.lock by `python -m tts_installer --write-lock`.",
+    ]
+    for name in sorted(conditions):
+        paths = {path for path, _ in conditions[name]}
+        line = f"{name}=={packages[name]['version']}"
+        if frozenset() not in paths:
+            alternatives = sorted(" and ".join(sorted(path)) for path in paths)
+            line += " ; " + " or ".join(alternatives)
+        lines.append(line)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return len(lines) - 2
+
+
+def download_wheelhouse(directory):
+    """Downloads the locked wheels for this platform into `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    # uv has no download command.
+    return subprocess.call(
+        [sys.executable, "-m", "pip", "download", "-d", directory, "-r", LOCK_PATH]
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the TTS dependency lock.")
+    parser.add_argument(
+        "--write-lock", action="store_true", help=f"regenerate {LOCK_PATH} from uv.lock"
+    )
+    parser.add_argument(
+        "--download",
+        metavar="DIR",
+        help="download the locked wheels into DIR, e.g. a shared wheelhouse",
+    )
+    args = parser.parse_args()
+    if args.write_lock:
+        print(f"Locked {write_lock()} packages in {LOCK_PATH}")
+    if args.download:
+        sys.exit(download_wheelhouse(args.download))
@@ -0,0 +1,503 @@
+"""
+Local HTTP synthesis server.
+
+Usage:
+    python -m tts_server [--port 8767] [--workers 1]
+
+Gives other tools access to the loaded model over HTTP on localhost. Started
+from the desktop app, the server shares the app's TTSEngine (model,
+pipelines, voice packs and caches); run headless, it loads its own once.
+
+Endpoints:
+  POST /synthesize  JSON {"text", "voice", "speed", "language", "format"};
+                    answers with chunked audio/wav, or raw 16-bit PCM with
+                    "format": "pcm", streamed segment by segment
+  GET  /voices      installed voices, as JSON
+  GET  /health      model status, busy workers and queue depth, as JSON
+  GET  /metrics     Prometheus text
+
+At most `workers` requests are synthesized at once and up to `max_pending`
+more wait in line; beyond that the server answers 503 with Retry-After.
+Audio reaches the client through a small bounded queue, so a slow reader
+slows down its own synthesis instead of buffering the whole recording, and
+a client that disconnects cancels its job.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from metrics import METRICS
+from render_manifest import manifest_path
+from tts_engine import SynthesisCancelled, TTSEngine
+from voices import parse_voice_spec
+
+log = logging.getLogger(__name__)
+
+# Largest request body accepted
+MAX_BODY_BYTES = 1024 * 1024
+# Seconds a client may take to send its request
+REQUEST_TIMEOUT = 30
+# Segments buffered between a synthesis thread and its client
+AUDIO_QUEUE_SEGMENTS = 4
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def wav_stream_header(samplerate=settings.SAMPLE_RATE):
+    """Header of a 16-bit mono WAV stream whose length is not known yet."""
+    # 0xFFFFFFFF sizes tell players to read until the data ends.
+    return (
+        b"RIFF"
+        + struct.pack("<I", 0xFFFFFFFF)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack("<IHHIIHH", 16, 1, 1, samplerate, samplerate * 2, 2, 16)
+        + b"data"
+        + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+def to_pcm16(samples):
+    import numpy as np
+
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+async def read_request(reader):
+    """Reads one request. Returns (method, path, headers, body)."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError("client closed the connection")
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "invalid Content-Length") from None
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"request body exceeds {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+class SynthesisServer:
+    def __init__(
+        self,
+        engine,
+        host=settings.SERVER_HOST,
+        port=settings.SERVER_PORT,
+        workers=1,
+        max_pending=8,
+    ):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_pending = max_pending
+        self.busy = 0
+        self.waiting = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="tts-server"
+        )
+        self._routes = {
+            "/synthesize": ("POST", self._synthesize),
+            "/voices": ("GET", self._voices),
+            "/health": ("GET", self._health),
+            "/metrics": ("GET", self._metrics),
+        }
+        # Every worker renders on its own pipeline slot. The queue only
+        # binds to the event loop once it is used.
+        self._free_slots = asyncio.Queue()
+        for slot in range(self.workers):
+            self._free_slots.put_nowait(slot)
+        self._loop = None
+        self._server = None
+
+    # --- Lifecycle ---------------------------------------------------------
+
+    async def start(self):
+        """Starts listening and returns the asyncio server."""
+        self._loop = asyncio.get_running_loop()
+        self._server = server = await asyncio.start_server(
+            self._handle, self.host, self.port
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        log.info("Synthesis server listening on http://%s:%d", self.host, self.port)
+        return server
+
+    async def serve_forever(self):
+        server = await self.start()
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def start_in_thread(self):
+        """Runs the server on its own event loop in a daemon thread."""
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            server = None
+            try:
+                server = loop.run_until_complete(self.start())
+            except OSError as e:
+                errors.append(e)
+            started.set()
+            try:
+                if server is not None:
+                    loop.run_until_complete(server.serve_forever())
+            except asyncio.CancelledError:
+                pass
+            finally:
+                loop.close()
+
+        threading.Thread(target=run, daemon=True, name="tts-server").start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        """Stops accepting connections. Safe to call from any thread."""
+        server, loop = self._server, self._loop
+        if server is not None and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(server.close)
+        self._server = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self):
+        return {
+            "status": (
+                "ok" if self.engine.loaded else "idle" if self.engine.ready else "loading"
+            ),
+            "device": self.engine.device,
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": self.waiting,
+            "max_pending": self.max_pending,
+        }
+
+    # --- Connections -------------------------------------------------------
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, path, headers, body = await asyncio.wait_for(
+                    read_request(reader), REQUEST_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise HTTPError(408, "request timed out") from None
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                raise HTTPError(400, "malformed request") from None
+            route = self._routes.get(path)
+            if route is None:
+                raise HTTPError(404, f"no such endpoint: {path}")
+            if method != route[0]:
+                raise HTTPError(405, f"{path} only accepts {route[0]}", {"Allow": route[0]})
+            await route[1](body, writer)
+        except HTTPError as e:
+            try:
+                await self._send_json(writer, e.status, {"error": str(e)}, e.headers)
+            except ConnectionError:
+                pass
+        except ConnectionError:
+            pass
+        except Exception:
+            log.exception("Unhandled error in the synthesis server")
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, body, content_type, headers=None):
+        head = [
+            f"HTTP/1.1 {status} {REASONS[status]}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        await self._send(writer, status, body, "application/json; charset=utf-8", headers)
+
+    # --- Endpoints ---------------------------------------------------------
+
+    async def _health(self, body, writer):
+        status = self.status()
+        await self._send_json(writer, 200 if self.engine.ready else 503, status)
+
+    async def _voices(self, body, writer):
+        await self._send_json(
+            writer,
+            200,
+            {
+                "voices": self.engine.voices.available(),
+                "default": settings.DEFAULT_VOICES[0],
+            },
+        )
+
+    async def _metrics(self, body, writer):
+        text = METRICS.prometheus_text() + "".join(
+            f"# TYPE kokoro_server_{name} gauge\nkokoro_server_{name} {value}\n"
+            for name, value in (
+                ("busy_workers", self.busy),
+                ("queued_requests", self.waiting),
+            )
+        )
+        await self._send(
+            writer, 200, text.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    def _parse_synthesis_request(self, body):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "request body must be JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "request body must be a JSON object")
+        text = data.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(400, '"text" is required')
+        fmt = data.get("format", "wav")
+        if fmt not in ("wav", "pcm"):
+            raise HTTPError(400, '"format" must be "wav" or "pcm"')
+        try:
+            speed = float(data.get("speed", settings.DEFAULT_SPEED))
+        except (TypeError, ValueError):
+            raise HTTPError(400, '"speed" must be a number') from None
+        if not 0.1 <= speed <= 4.0:
+            raise HTTPError(400, '"speed" must be between 0.1 and 4')
+        voice = str(data.get("voice") or settings.DEFAULT_VOICES[0])
+        # Only installed voices: a client must not trigger downloads.
+        try:
+            names = [name for name, _ in parse_voice_spec(voice)]
+        except ValueError as e:
+            raise HTTPError(400, f"invalid voice: {e}") from None
+        unknown = set(names) - set(self.engine.voices.available())
+        if unknown:
+            raise HTTPError(400, f"unknown voice: {', '.join(sorted(unknown))}")
+        return {
+            "text": text,
+            "voice": voice,
+            "speed": speed,
+            "language": str(data.get("language") or "zh-cn"),
+            "format": fmt,
+        }
+
+    async def _synthesize(self, body, writer):
+        request = self._parse_synthesis_request(body)
+        if not self.engine.ready:
+            raise HTTPError(503, "model is still loading", {"Retry-After": "5"})
+        if self._free_slots.empty() and self.waiting >= self.max_pending:
+            METRICS.increment("server_rejected")
+            raise HTTPError(503, "server is busy", {"Retry-After": "1"})
+        METRICS.increment("server_requests")
+
+        self.waiting += 1
+        try:
+            slot = await self._free_slots.get()
+        finally:
+            self.waiting -= 1
+        self.busy += 1
+        cancel = threading.Event()
+        audio = asyncio.Queue(maxsize=AUDIO_QUEUE_SEGMENTS)
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(
+            self._executor, self._run_job, request, slot, cancel, audio, loop
+        )
+        try:
+            await self._stream(writer, request["format"], audio, cancel)
+        finally:
+            # The slot is only free once the worker has really finished.
+            await job
+            self.busy -= 1
+            self._free_slots.put_nowait(slot)
+
+    async def _stream(self, writer, fmt, audio, cancel):
+        """Sends the job's audio as a chunked response while it is produced."""
+        item = await audio.get()
+        if isinstance(item, Exception):
+            # Nothing has been sent yet, so the failure gets a proper status.
+            status = 400 if isinstance(item, (KeyError, ValueError)) else 500
+            raise HTTPError(status, str(item))
+
+        if fmt == "wav":
+            content_type = "audio/wav"
+        else:
+            content_type = f"audio/L16; rate={settings.SAMPLE_RATE}; channels=1"
+        writer.write(
+            (
+                "HTTP/1.1 200 OK\r\n"
+                f"Content-Type: {content_type}\r\n"
+                "Transfer-Encoding: chunked\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+        )
+        connected = True
+        pending = [wav_stream_header()] if fmt == "wav" else []
+        while True:
+            if isinstance(item, bytes):
+                pending.append(item)
+            if connected and pending:
+                try:
+                    for data in pending:
+                        if data:
+                            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                    await writer.drain()
+                except ConnectionError:
+                    # The client is gone; stop rendering for it.
+                    connected = False
+                    cancel.set()
+            pending = []
+            if item is None or isinstance(item, Exception):
+                break
+            # Keep draining after a disconnect so the worker never blocks.
+            item = await audio.get()
+        if connected and item is None:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        # After a mid-stream failure the terminating chunk is left out, so
+        # the client sees a truncated response rather than a short success.
+
+    def _run_job(self, request, slot, cancel, audio, loop):
+        """Synthesizes one request on a worker thread of `loop`."""
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(audio.put(item), loop).result()
+
+        def on_audio(samples):
+            if not cancel.is_set():
+                put(to_pcm16(samples))
+
+        # The engine renders into a file; the client only gets the stream.
+        fd, path = tempfile.mkstemp(prefix="kokoro-server-", suffix=".wav")
+        os.close(fd)
+        start = time.perf_counter()
+        try:
+            with METRICS.trace() as stages:
+                result = self.engine.synthesize(
+                    request["text"],
+                    request["voice"],
+                    path,
+                    speed=request["speed"],
+                    language=request["language"],
+                    on_audio=on_audio,
+                    slot=slot,
+                    samplerate=0,
+                    cancel=cancel,
+                    keep_partial=False,
+                )
+            METRICS.record_job(
+                stages,
+                result.audio_seconds,
+                time.perf_counter() - start,
+                source="server",
+                segments=result.segments,
+            )
+            put(None)
+        except SynthesisCancelled:
+            METRICS.increment("server_cancelled")
+            put(None)
+        except Exception as e:
+            log.exception("Server synthesis failed")
+            METRICS.increment("server_failed")
+            put(e)
+        finally:
+            for leftover in (path, manifest_path(path)):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="kokoro-serve", description="Local HTTP text-to-speech server."
+    )
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.CONFIG["server_workers"],
+        help="requests synthesized at the same time",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=settings.CONFIG["server_max_pending"],
+        help="requests allowed to wait for a worker before 503 is returned",
+    )
+    parser.add_argument("--device", default=None, help="torch device (default: auto)")
+    parser.add_argument(
+        "--backend", choices=("torch", "onnx"), default=None, help="inference backend"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    workers = max(1, args.workers)
+
+    config = dict(settings.CONFIG)
+    if args.backend is not None:
+        config["backend"] = args.backend
+    engine = TTSEngine(device=args.device, config=config)
+    engine.load(slots=workers)
+    server = SynthesisServer(
+        engine,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        max_pending=max(0, args.max_pending),
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if engine.g2p_memo is not None:
+            engine.g2p_memo.save()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+"""
+Memory-resident voice pack cache.
+
+Voice packs are scanned from the model store once and loaded on demand into
+an LRU cache, so switching voices between jobs is a dictionary lookup.
+A voice spec is either a single name ("zf_001") or a weighted blend
+("zf_001:0.7,zf_002:0.3"); blends are computed once and cached like any
+other voice.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import settings
+
+
+def parse_voice_spec(spec):
+    """
+    Parses a voice spec into a tuple of (name, weight) pairs.
+
+    Weights are normalized to sum to 1 and the pairs are sorted by name, so
+    equivalent specs produce the same cache key. Names without a weight get
+    an equal share, matching KPipeline's "a,b" averaging.
+    """
+    parts = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition(":")
+        parts.append((name.strip(), float(weight) if weight else 1.0))
+    if not parts:
+        raise ValueError(f"Empty voice spec: {spec!r}")
+
+    merged = {}
+    for name, weight in parts:
+        merged[name] = merged.get(name, 0.0) + weight
+    total = sum(merged.values())
+    if total <= 0:
+        raise ValueError(f"Voice weights must be positive: {spec!r}")
+    return tuple(sorted((name, weight / total) for name, weight in merged.items()))
+
+
+def format_voice_spec(weights):
+    """Formats (name, weight) pairs back into a voice spec string."""
+    if len(weights) == 1:
+        return weights[0][0]
+    return ",".join(f"{name}:{weight:.2f}" for name, weight in weights)
+
+
+class VoiceManager:
+    def __init__(self, store, capacity=settings.VOICE_CACHE_SIZE):
+        self.store = store
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._available = None
+
+    def available(self, rescan=False):
+        """Names of the voice packs installed in the model store."""
+        if self._available is None or rescan:
+            voices_dir = os.path.dirname(self.store.voice_path("_"))
+            try:
+                names = [
+                    name[: -len(".pt")]
+                    for name in os.listdir(voices_dir)
+                    if name.endswith(".pt")
+                ]
+            except FileNotFoundError:
+                names = []
+            self._available = sorted(names)
+        return self._available
+
+    def _load_single(self, name):
+        import torch
+
+        path = self.store.voice_path(name)
+        if not os.path.isfile(path):
+            self.store.add_voice(name, allow_download=not settings.OFFLINE)
+            self.available(rescan=True)
+        return torch.load(path, weights_only=True)
+
+    def _cached(self, key):
+        with self._lock:
+            pack = self._cache.get(key)
+            if pack is not None:
+                self._cache.move_to_end(key)
+            return pack
+
+    def _insert(self, key, pack):
+        with self._lock:
+            self._cache[key] = pack
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def get(self, spec):
+        """Returns the voice tensor for a spec, loading or blending it once."""
+        weights = parse_voice_spec(spec)
+        pack = self._cached(weights)
+        if pack is not None:
+            return pack
+
+        if len(weights) == 1:
+            pack = self._load_single(weights[0][0])
+        else:
+            pack = self.get(weights[0][0]) * weights[0][1]
+            for name, weight in weights[1:]:
+                pack = pack + self.get(name) * weight
+        self._insert(weights, pack)
+        return pack
+
+    def preload(self, specs=None):
+        """Loads voices ahead of the first job, up to the cache capacity."""
+        for spec in list(specs or self.available())[: self.capacity]:
+            self.get(spec)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
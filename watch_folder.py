@@ -0,0 +1,341 @@
+"""
+Watch-folder mode: synthesizes `.txt` files as they are dropped into a
+directory.
+
+`FolderWatcher` monitors the directory tree with Gio.FileMonitor (inotify on
+Linux, FSEvents on macOS) and only rescans it when no monitor can be
+created; `poll_seconds` adds periodic rescans anyway, for network shares
+whose remote writes raise no local events. A file is picked up once it has
+not changed for `debounce_seconds`, so half-written scripts are not
+rendered. Its content is then hashed and compared with the `WatchManifest`
+in the output directory: only new or changed text becomes a job, whose
+output mirrors the file's relative path below the output directory. A hash
+is recorded once its job succeeds, so after a restart only the files that
+changed in the meantime are rendered again, and an edited file re-renders
+only its changed segments (see render_manifest.py).
+
+The watcher runs on a GLib main context: the GUI's, or the main loop of
+`python -m tts_cli --watch`. All its methods must be called from that
+context's thread.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from gi.repository import Gio, GLib
+
+from jobs import JobStatus
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".kokoro-watch.json"
+FORMAT_VERSION = 1
+
+# How often due files are checked while some are waiting out the debounce
+_DEBOUNCE_TICK_MS = 250
+
+
+def is_script(path):
+    name = os.path.basename(path)
+    return name.lower().endswith(".txt") and not name.startswith((".", "~"))
+
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class WatchManifest:
+    """
+    Content hash, size and mtime of every watched file rendered so far,
+    keyed by its path relative to the watched directory.
+
+    Size and mtime let a rescan skip unchanged files without reading them.
+    """
+
+    def __init__(self, path, save_every=20):
+        self.path = path
+        self.save_every = save_every
+        self._files = {}
+        self._unsaved = 0
+
+    def load(self):
+        """Loads the saved entries. Returns how many were loaded."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if data.get("format") == FORMAT_VERSION:
+            self._files = data.get("files", {})
+        return len(self._files)
+
+    def get(self, name):
+        return self._files.get(name)
+
+    def record(self, name, digest, stat, output):
+        self._files[name] = {
+            "hash": digest,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "output": output,
+        }
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def save(self):
+        if not self._unsaved:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"format": FORMAT_VERSION, "files": self._files}, f, ensure_ascii=False
+            )
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+
+class FolderWatcher:
+    """
+    Turns new and changed `.txt` files below `directory` into jobs.
+
+    `make_job(text, output_path)` builds the SynthesisJob for a file and
+    `submit(job)` queues it; the caller reports every finished job back
+    through job_finished(), also after stop(), so jobs queued before the
+    watcher stopped are still recorded.
+    """
+
+    def __init__(
+        self,
+        directory,
+        output_dir,
+        make_job,
+        submit,
+        extension=".wav",
+        debounce_seconds=2.0,
+        poll_seconds=0,
+    ):
+        self.directory = os.path.abspath(directory)
+        self.output_dir = os.path.abspath(output_dir or directory)
+        self.make_job = make_job
+        self.submit = submit
+        self.extension = extension
+        self.debounce_seconds = debounce_seconds
+        self.poll_seconds = poll_seconds
+        self.manifest = WatchManifest(os.path.join(self.output_dir, MANIFEST_NAME))
+        self.polling = False
+        self._monitors = {}
+        # path -> (monotonic deadline, stat signature when it was armed)
+        self._due = {}
+        # job id -> (relative path, digest, stat) of the file it renders
+        self._jobs = {}
+        self._debounce_source = None
+        self._poll_source = None
+        self.stopped = False
+
+    @property
+    def busy(self):
+        """True while jobs it queued have not been reported finished."""
+        return bool(self._jobs)
+
+    def start(self):
+        self.stopped = False
+        loaded = self.manifest.load()
+        log.info("Watching %s (%d files rendered before)", self.directory, loaded)
+        self._watch_tree(self.directory)
+        if self.polling:
+            log.warning("File monitoring unavailable; polling %s instead", self.directory)
+        interval = self.poll_seconds or (10 if self.polling else 0)
+        if interval:
+            self._poll_source = GLib.timeout_add_seconds(
+                max(1, round(interval)), self._on_poll
+            )
+        # Whatever changed while nobody was watching
+        self.rescan()
+
+    def stop(self):
+        for monitor in self._monitors.values():
+            monitor.cancel()
+        self._monitors.clear()
+        for source in (self._debounce_source, self._poll_source):
+            if source is not None:
+                GLib.source_remove(source)
+        self._debounce_source = self._poll_source = None
+        self._due.clear()
+        self.manifest.save()
+        self.stopped = True
+
+    def adopt(self, other):
+        """
+        Takes over the queued jobs of a stopped watcher of the same folders,
+        so they are recorded here and their files are not queued twice.
+        Returns False if `other` watched different folders.
+        """
+        if (other.directory, other.output_dir) != (self.directory, self.output_dir):
+            return False
+        self._jobs.update(other._jobs)
+        other._jobs.clear()
+        return True
+
+    def owns(self, job):
+        return job.id in self._jobs
+
+    def job_finished(self, job):
+        """Records the file of a successfully rendered job as processed."""
+        entry = self._jobs.pop(job.id, None)
+        if entry is None:
+            return
+        name, digest, stat = entry
+        if job.status == JobStatus.DONE:
+            output = os.path.relpath(job.output_path, self.output_dir)
+            self.manifest.record(name, digest, stat, output)
+        else:
+            log.warning("Watched file %s not rendered: %s", name, job.error or job.status)
+        if self.stopped:
+            # No later stop() saves for it.
+            self.manifest.save()
+
+    def rescan(self):
+        """Arms every script whose size or mtime differs from the manifest."""
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in files:
+                path = os.path.join(root, name)
+                if is_script(path) and self._changed_since_render(path):
+                    self._arm(path)
+
+    # --- Monitoring --------------------------------------------------------
+
+    def _watch_tree(self, directory):
+        # Gio monitors a single directory, so each subdirectory gets its own.
+        for root, dirs, _ in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            if root in self._monitors or self.polling:
+                continue
+            try:
+                monitor = Gio.File.new_for_path(root).monitor_directory(
+                    Gio.FileMonitorFlags.WATCH_MOVES, None
+                )
+            except GLib.Error as e:
+                log.warning("Cannot monitor %s: %s", root, e.message)
+                self.polling = True
+                continue
+            monitor.connect("changed", self._on_changed)
+            self._monitors[root] = monitor
+
+    def _on_changed(self, monitor, file, other_file, event_type):
+        if event_type == Gio.FileMonitorEvent.RENAMED:
+            # Editors save through a temporary file renamed over the script.
+            file = other_file
+        elif event_type in (Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_OUT):
+            self._due.pop(file.get_path(), None)
+            # A removed subdirectory takes its monitor with it.
+            removed = self._monitors.pop(file.get_path(), None)
+            if removed is not None:
+                removed.cancel()
+            return
+        elif event_type not in (
+            Gio.FileMonitorEvent.CREATED,
+            Gio.FileMonitorEvent.CHANGED,
+            Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+            Gio.FileMonitorEvent.MOVED_IN,
+        ):
+            return
+        path = file.get_path()
+        if path is None:
+            return
+        if os.path.isdir(path):
+            if not os.path.basename(path).startswith("."):
+                self._watch_tree(path)
+                for root, _, files in os.walk(path):
+                    for name in files:
+                        if is_script(os.path.join(root, name)):
+                            self._arm(os.path.join(root, name))
+        elif is_script(path):
+            self._arm(path)
+
+    def _on_poll(self):
+        self.rescan()
+        return True
+
+    # --- Debouncing --------------------------------------------------------
+
+    def _arm(self, path):
+        """(Re)starts the quiet period after which `path` is processed."""
+        self._due[path] = (time.monotonic() + self.debounce_seconds, _signature(path))
+        if self._debounce_source is None:
+            self._debounce_source = GLib.timeout_add(
+                _DEBOUNCE_TICK_MS, self._on_debounce_tick
+            )
+
+    def _on_debounce_tick(self):
+        now = time.monotonic()
+        for path, (deadline, signature) in list(self._due.items()):
+            if deadline > now:
+                continue
+            if _signature(path) != signature:
+                # Still being written.
+                self._arm(path)
+                continue
+            del self._due[path]
+            try:
+                self._process(path)
+            except OSError as e:
+                log.warning("Cannot read %s: %s", path, e)
+        if self._due:
+            return True
+        self._debounce_source = None
+        return False
+
+    # --- Processing --------------------------------------------------------
+
+    def _changed_since_render(self, path):
+        entry = self.manifest.get(os.path.relpath(path, self.directory))
+        return entry is None or _signature(path) != (entry["size"], entry["mtime_ns"])
+
+    def _process(self, path):
+        name = os.path.relpath(path, self.directory)
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            data = f.read()
+        digest = file_digest(data)
+        entry = self.manifest.get(name)
+        if entry is not None and entry["hash"] == digest:
+            # Touched or rewritten with the same text: only refresh the stat.
+            self.manifest.record(name, digest, stat, entry["output"])
+            METRICS.increment("watch_files_unchanged")
+            return
+        if any(queued[:2] == (name, digest) for queued in self._jobs.values()):
+            return
+        try:
+            text = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            log.warning("Skipping %s: not UTF-8 text", name)
+            return
+        if not text.strip():
+            return
+        output_path = os.path.join(
+            self.output_dir, os.path.splitext(name)[0] + self.extension
+        )
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        job = self.make_job(text, output_path)
+        if os.path.isfile(output_path):
+            # Only the edited segments of a changed script go through the model.
+            job.base_path = output_path
+        self._jobs[job.id] = (name, digest, stat)
+        METRICS.increment("watch_files_queued")
+        log.info("Queued %s as job #%d", name, job.id)
+        self.submit(job)
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
@@ -8,7 +8,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[('logo.png', '.')],
+    datas=[('logo.png', '.'), ('requirements-tts.lock', '.')],
     hiddenimports=[
         'gi',
         'gi.repository.Gtk',